@@ -2,29 +2,41 @@ import asyncio
 import logging
 import aiohttp # Use aiohttp for async requests
 # Removed ssl import and patch
-from bs4 import BeautifulSoup
-import io
 import re
-from urllib.parse import urlparse, urljoin
-from collections import deque # Use deque for queue
+from urllib.parse import urlparse
 import datetime
+import hashlib
+import random
+from collections import deque
+import charset_normalizer
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.aiohttp import AiohttpSession # Import Aiogram's session wrapper
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 
 # Импортируем наши модули
-from database import init_db, get_db, User, AISession, Message as DBMessage, get_cached_document, cache_document, get_cached_summary, cache_summary, cleanup_old_cache, CachedDocument, CachedSummary, cache_stats
-from sqlalchemy import func
+from database import init_db, close_db, session_scope, User, AISession, Message as DBMessage, get_cached_document, cache_document, get_cached_summary, cache_summary, cleanup_old_cache, CachedDocument, CachedSummary, cache_stats, get_cached_page, save_cached_page, touch_cached_page, record_page_cache_event, get_document_content, get_document_hash, get_blob_text, read_blob_into, update_cache_stats, Blob, save_crawl_checkpoint, get_crawl_checkpoint, delete_crawl_checkpoint
+from sqlalchemy import func, select, delete
 from ai_client import AIClient
-from config import BOT_TOKEN, GEMINI_API_KEY, AI_MODEL, GEMINI_API_URL, AI_SYSTEM_PROMPT_TEMPLATE, MAX_SESSION_REQUESTS, SESSION_TIMEOUT_MINUTES, AI_SUMMARY_PROMPT, MAX_MESSAGE_LENGTH, ADMIN_IDS
+from config import BOT_TOKEN, GEMINI_API_KEY, AI_MODEL, GEMINI_API_URL, AI_SYSTEM_PROMPT_TEMPLATE, MAX_SESSION_REQUESTS, SESSION_TIMEOUT_MINUTES, AI_SUMMARY_PROMPT, MAX_MESSAGE_LENGTH, ADMIN_IDS, CRAWL_SETTINGS, CRAWL_BUDGET_SETTINGS, FETCH_SETTINGS, FRONTIER_SETTINGS, DOCUMENT_CACHE_TTL_HOURS, PAGE_CACHE_TTL_MINUTES
 from rate_limiter import rate_limiter
+from fetch_limiter import fetch_limiter, parse_retry_after
+from circuit_breaker import circuit_breaker
+from crawl_scheduler import crawl_scheduler
+from http_client import http_client
+from page_extractor import parse_executor, EXTRACTOR_VERSION
+from frontier import Frontier, PriorityFrontier, canonicalize_url
+from site_discovery import load_robots, discover_sitemap_urls
+from document_builder import DocumentBuilder, CrawlDocument
+from near_duplicates import NearDuplicateIndex, shingles, simhash
+from crawl_budget import CrawlBudget, BUDGET_TIME, BUDGET_DOWNLOAD, BUDGET_TEXT
+from progress_reporter import ProgressReporter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -50,117 +62,6 @@ def is_valid_url(url):
     # Basic check, can be improved
     return re.match(URL_REGEX, url) is not None
 
-def get_text_from_html(html_content: str) -> str:
-    """Extracts text content from HTML string with preserved structure."""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Remove script, style, and nav elements
-    for element in soup(["script", "style", "nav", "footer", "aside"]):
-        element.decompose()
-    
-    # Добавим разделители для структурных элементов
-    for header in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-        # Определяем уровень заголовка по тегу
-        level = int(header.name[1])
-        
-        # Добавляем разделители в зависимости от уровня заголовка
-        if level == 1:
-            header.insert_before(soup.new_string('\n\n★' + '═' * 48 + '★\n'))
-            header.insert_after(soup.new_string('\n★' + '═' * 48 + '★\n'))
-        elif level == 2:
-            header.insert_before(soup.new_string('\n\n┌' + '─' * 38 + '┐\n'))
-            header.insert_after(soup.new_string('\n└' + '─' * 38 + '┘\n'))
-        else:
-            header.insert_before(soup.new_string('\n\n• • • • • •\n'))
-            header.insert_after(soup.new_string('\n• • • • • •\n'))
-    
-    # Добавляем разделители для параграфов
-    for paragraph in soup.find_all('p'):
-        paragraph.insert_after(soup.new_string('\n\n'))
-    
-    # Добавляем разделители для списков
-    for ul in soup.find_all('ul'):
-        ul.insert_before(soup.new_string('\n┌─────────────────────────────┐\n'))
-        ul.insert_after(soup.new_string('\n└─────────────────────────────┘\n'))
-    
-    for ol in soup.find_all('ol'):
-        ol.insert_before(soup.new_string('\n┌─────────────────────────────┐\n'))
-        ol.insert_after(soup.new_string('\n└─────────────────────────────┘\n'))
-    
-    for li in soup.find_all('li'):
-        if li.parent.name == 'ol':
-            # Для нумерованных списков используем цифры
-            li.insert_before(soup.new_string('\n  ➜ '))
-        else:
-            # Для ненумерованных списков используем другой маркер
-            li.insert_before(soup.new_string('\n  ◆ '))
-    
-    # Добавляем разделители для таблиц
-    for table in soup.find_all('table'):
-        table.insert_before(soup.new_string('\n\n┏' + '━' * 30 + ' ТАБЛИЦА ' + '━' * 30 + '┓\n'))
-        table.insert_after(soup.new_string('\n┗' + '━' * 70 + '┛\n\n'))
-    
-    # Добавляем информацию о ссылках
-    for a in soup.find_all('a', href=True):
-        a.insert_after(soup.new_string(f" 🔗 [{a['href']}]"))
-    
-    # Обрабатываем изображения
-    for img in soup.find_all('img'):
-        alt_text = img.get('alt', 'Изображение')
-        img.insert_before(soup.new_string(f'\n[🖼️ ИЗОБРАЖЕНИЕ: {alt_text}]\n'))
-    
-    # Обрабатываем блоки кода
-    for code in soup.find_all('code'):
-        code.insert_before(soup.new_string('\n```\n'))
-        code.insert_after(soup.new_string('\n```\n'))
-    
-    for pre in soup.find_all('pre'):
-        pre.insert_before(soup.new_string('\n```\n'))
-        pre.insert_after(soup.new_string('\n```\n'))
-    
-    # Обрабатываем цитаты
-    for blockquote in soup.find_all('blockquote'):
-        blockquote.insert_before(soup.new_string('\n\n▌ '))
-        lines = blockquote.get_text().split('\n')
-        # Заменяем содержимое blockquote на форматированное
-        blockquote.clear()
-        for line in lines:
-            blockquote.append(f'\n▌ {line}')
-        blockquote.insert_after(soup.new_string('\n\n'))
-    
-    # Get text with preserved structure
-    text = soup.get_text()
-    
-    # Break into lines and remove leading/trailing space on each
-    lines = (line.strip() for line in text.splitlines())
-    
-    # Remove duplicated empty lines but keep meaningful structure
-    processed_lines = []
-    prev_line_empty = False
-    
-    for line in lines:
-        is_empty = len(line) == 0
-        is_separator = any(c in '─═━•┌┐└┘┏┓┗┛★◆➜' for c in line)
-        
-        # Всегда добавляем разделители
-        if is_separator:
-            processed_lines.append(line)
-            prev_line_empty = False
-        # Добавляем пустые строки только если предыдущая не была пустой
-        elif is_empty:
-            if not prev_line_empty:
-                processed_lines.append(line)
-                prev_line_empty = True
-        # Добавляем непустые строки
-        else:
-            processed_lines.append(line)
-            prev_line_empty = False
-    
-    # Объединяем с одинарными переносами строк
-    text = '\n'.join(processed_lines)
-    
-    return text
-
 def clean_text_for_telegram(text):
     """
     Очищает текст от символов, которые могут вызвать проблемы в Telegram.
@@ -231,249 +132,737 @@ def split_long_message(text, max_length=MAX_MESSAGE_LENGTH):
     
     return parts
 
-async def fetch_page(session: aiohttp.ClientSession, url: str) -> tuple[str | None, str | None]:
-    """Fetches a single page asynchronously."""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
+
+# Отдельные таймауты на соединение, паузы при чтении ответа и загрузку страницы целиком
+FETCH_TIMEOUT = aiohttp.ClientTimeout(
+    total=FETCH_SETTINGS["total_timeout"],
+    sock_connect=FETCH_SETTINGS["connect_timeout"],
+    sock_read=FETCH_SETTINGS["read_timeout"]
+)
+
+# Ответы, после которых запрос стоит повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# <meta charset="..."> или <meta http-equiv="Content-Type" content="...; charset=...">
+META_CHARSET_REGEX = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+
+def sniff_html_charset(data: bytes) -> str | None:
+    """Определяет кодировку по BOM или тегу <meta> в начале документа."""
+    if data.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+
+    match = META_CHARSET_REGEX.search(data[:4096])
+    return match.group(1).decode('ascii') if match else None
+
+def decode_html(body: bytes, header_charset: str | None) -> str:
+    """
+    Декодирует HTML: сначала по charset из заголовка Content-Type, затем по
+    BOM/<meta charset>, затем как UTF-8, и только после этого медленным
+    определением кодировки через charset_normalizer.
+    """
+    for encoding in (header_charset, sniff_html_charset(body)):
+        if not encoding:
+            continue
+        try:
+            return body.decode(encoding, errors='replace')
+        except LookupError:
+            logger.debug(f"Unknown charset {encoding}")
+
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        best_match = charset_normalizer.from_bytes(body).best()
+        return str(best_match) if best_match else body.decode('utf-8', errors='replace')
+
+def new_fetch_info() -> dict:
+    """Returns the default result details of a page fetch."""
+    return {"status": None, "retry_after": None, "network_error": False, "not_modified": False,
+            "etag": None, "last_modified": None, "attempts": 0, "circuit_open": False,
+            "bytes": 0, "url": None}
+
+async def fetch_page(session: aiohttp.ClientSession, url: str, cached_page: dict | None = None) -> tuple[str | None, str | None, dict]:
+    """
+    Fetches a single page asynchronously.
+
+    If a previously stored page is given, the request is conditional
+    (If-None-Match / If-Modified-Since); a 304 answer is reported with
+    info["not_modified"] instead of a body. The body is read in chunks up to
+    CRAWL_SETTINGS["max_page_bytes"]: pages declared larger are skipped, and
+    so are pages whose body turns out longer while it is streamed (reading
+    stops at the limit); info["bytes"] is the number of body bytes actually downloaded, info["url"] is the
+    final URL after redirects (relative links are resolved against it).
+    info["status"], info["retry_after"] and info["network_error"] (no
+    complete response: timeout or connection failure) are used for retries
+    and per-host rate control.
+    """
+    max_bytes = CRAWL_SETTINGS["max_page_bytes"]
+    headers = dict(REQUEST_HEADERS)
+    if cached_page:
+        if cached_page["etag"]:
+            headers['If-None-Match'] = cached_page["etag"]
+        if cached_page["last_modified"]:
+            headers['If-Modified-Since'] = cached_page["last_modified"]
+
+    info = new_fetch_info()
     try:
-        async with session.get(url, headers=headers, timeout=10, ssl=False) as response: # Added ssl=False for potential issues
+        async with session.get(url, headers=headers, timeout=FETCH_TIMEOUT, ssl=False) as response: # Added ssl=False for potential issues
+            info["status"] = response.status
+            info["url"] = str(response.url)
+            info["retry_after"] = response.headers.get('Retry-After')
+            info["etag"] = response.headers.get('ETag')
+            info["last_modified"] = response.headers.get('Last-Modified')
+            if response.status == 304 and cached_page:
+                info["not_modified"] = True
+                return None, None, info
+
             response.raise_for_status()
             content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' in content_type:
-                return await response.text(), None
-            else:
-                return None, f"Content type is not HTML ({content_type})"
+            if 'text/html' not in content_type:
+                return None, f"Content type is not HTML ({content_type})", info
+
+            if response.content_length and response.content_length > max_bytes:
+                return None, f"Page is too large ({response.content_length // 1024} KB)", info
+
+            # Читаем тело по частям; страницу длиннее лимита пропускаем так же, как по Content-Length
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                body += chunk
+                info["bytes"] += len(chunk)
+                if len(body) > max_bytes:
+                    logger.warning(f"Page {url} exceeds {max_bytes} bytes, skipped")
+                    return None, f"Page is too large (over {max_bytes // 1024} KB)", info
+
+            # Бинарные данные с заголовком text/html не разбираем
+            if b'\x00' in body[:1024] and not body.startswith((b'\xff\xfe', b'\xfe\xff')):
+                return None, "Content is binary, not HTML", info
+
+            return decode_html(bytes(body), response.charset), None, info
     except aiohttp.ClientError as e:
         logger.warning(f"HTTP Error fetching {url}: {e}")
-        return None, f"HTTP Error: {e}"
+        info["network_error"] = not isinstance(e, aiohttp.ClientResponseError)
+        return None, f"HTTP Error: {e}", info
     except asyncio.TimeoutError:
         logger.warning(f"Timeout fetching {url}")
-        return None, "Timeout"
+        info["network_error"] = True
+        return None, "Timeout", info
     except Exception as e:
         logger.error(f"Unexpected error fetching {url}: {e}")
-        return None, f"Unexpected error: {e}"
+        return None, f"Unexpected error: {e}", info
+
+
+async def fetch_page_with_retries(session: aiohttp.ClientSession, url: str, cached_page: dict | None = None,
+                                  min_interval: float = 0, timeout: float | None = None) -> tuple[str | None, str | None, dict]:
+    """
+    Fetches a page through the per-host limiter, retrying transient failures.
+
+    Timeouts, connection errors and 429/5xx answers are retried up to
+    FETCH_SETTINGS["retries"] times after a jittered exponential backoff
+    (or the server's Retry-After, if longer). Requests to a host that keeps
+    failing are rejected at once by the circuit breaker. If timeout is given,
+    all attempts, waits for the limiter and backoff pauses together take no
+    longer than that many seconds; a retry that could not start in time is not
+    made. info["attempts"] and info["circuit_open"] report what happened,
+    info["bytes"] counts the body bytes of all attempts.
+    """
+    host = urlparse(url).netloc
+    loop = asyncio.get_running_loop()
+    max_attempts = FETCH_SETTINGS["retries"] + 1
+    deadline = loop.time() + timeout if timeout is not None else None
+    downloaded = 0
+
+    for attempt in range(1, max_attempts + 1):
+        if not circuit_breaker.allow(host):
+            info = new_fetch_info()
+            info["attempts"] = attempt - 1
+            info["circuit_open"] = True
+            info["bytes"] = downloaded
+            return None, "Host is unavailable (too many failures in a row), skipped", info
+
+        try:
+            async with asyncio.timeout_at(deadline):
+                async with fetch_limiter.acquire(host, min_interval=min_interval):
+                    started = loop.time()
+                    html_content, error, info = await fetch_page(session, url, cached_page)
+                    # Подстраиваем скорость запросов к хосту по статусу и времени ответа
+                    status = None if info["network_error"] else info["status"]
+                    fetch_limiter.record_response(host, status, loop.time() - started, info["retry_after"])
+        except TimeoutError:
+            # Время обхода вышло: хост в этом не виноват, скорость и счетчик ошибок не меняем
+            info = new_fetch_info()
+            info["attempts"] = attempt
+            info["bytes"] = downloaded
+            return None, "Crawl time limit reached", info
+        info["attempts"] = attempt
+        downloaded += info["bytes"]
+        info["bytes"] = downloaded
+
+        # Ошибки сети и сервера говорят о недоступности хоста, любой другой ответ - о том, что он жив
+        if info["network_error"] or (status or 0) >= 500:
+            circuit_breaker.record_failure(host)
+        elif status is not None:
+            circuit_breaker.record_success(host)
+
+        if attempt == max_attempts or not (info["network_error"] or info["status"] in RETRY_STATUSES):
+            return html_content, error, info
+
+        # Экспоненциальная пауза со случайным разбросом, но не меньше Retry-After
+        delay = random.uniform(0, min(FETCH_SETTINGS["backoff_max"], FETCH_SETTINGS["backoff_base"] * 2 ** (attempt - 1)))
+        retry_after = parse_retry_after(info["retry_after"], FETCH_SETTINGS["backoff_max"])
+        if retry_after:
+            delay = max(delay, retry_after)
+        if deadline is not None and loop.time() + delay >= deadline:
+            return html_content, error, info
+        logger.info(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 1}/{max_attempts}): {error}")
+        await asyncio.sleep(delay)
+
+
+def get_sequential_order(seed_urls: list[str], page_links: dict[str, list[str]]) -> list[str]:
+    """
+    Восстанавливает порядок страниц, в котором их обошел бы последовательный обход.
+
+    Повторяет очередь FIFO последовательного обхода (начиная с seed_urls) по уже
+    собранному графу ссылок, поэтому порядок документа не зависит от того,
+    какой воркер закончил раньше.
+    """
+    frontier = Frontier(seed_urls)
+    order = []
+
+    while frontier:
+        url = frontier.pop()
+        if url not in page_links:
+            continue
 
+        order.append(url)
+        for link in page_links[url]:
+            frontier.add(link)
 
-async def crawl_website(start_url: str, max_pages: int = 1000, status_message: Message = None) -> tuple[str, int]:
-    """Crawls a website starting from start_url, collecting text."""
-    logger.info(f"Starting crawl for: {start_url} (max_pages={max_pages})")
+    # Страницы, недостижимые по графу (не должно случаться), добавляем в конец
+    order.extend(url for url in page_links if url not in frontier)
+    return order
+
+
+async def crawl_website(start_url: str, max_pages: int = 1000, status_message: Message = None, workers: int | None = None,
+                        use_sitemaps: bool | None = None) -> tuple[CrawlDocument, int]:
+    """
+    Crawls a website starting from start_url, collecting text.
+
+    Pages are fetched by several concurrent workers sharing one frontier.
+    Their links and text are applied in the order the pages were handed out,
+    so repeated crawls of a site give the same document, and the document
+    keeps the page order of a sequential crawl. For multi-page
+    crawls robots.txt rules and Crawl-delay are honored, and with use_sitemaps
+    the frontier is seeded from the site's sitemaps. Multi-page crawls are
+    checkpointed to the database periodically, so a crawl interrupted by an
+    error or a restart resumes from its last checkpoint on the next request.
+    """
+    if workers is None:
+        workers = CRAWL_SETTINGS["workers"]
+    workers = max(1, min(workers, max_pages))
+    if use_sitemaps is None:
+        use_sitemaps = CRAWL_SETTINGS["use_sitemaps"]
+
+    logger.info(f"Starting crawl for: {start_url} (max_pages={max_pages}, workers={workers})")
     if not start_url.startswith(('http://', 'https://')):
         start_url = 'https://' + start_url
+    start_url = canonicalize_url(start_url)
 
     parsed_start_url = urlparse(start_url)
     base_domain = parsed_start_url.netloc
     if not base_domain:
-        return "Error: Invalid starting URL.", 0
-
-    to_visit = deque([start_url])
-    visited = set()
-    scraped_data = {}
+        raise ValueError("Error: Invalid starting URL.")
+
+    # Очередь хранит канонические URL, помнит все встреченные адреса и выдает первыми самые ценные
+    to_visit = PriorityFrontier([start_url], settings=FRONTIER_SETTINGS)
+    seed_urls = [start_url]
+    robots = None
+    crawl_delay = 0
+    # Разделы страниц пишутся во временный файл по мере загрузки, повторяющиеся на всех страницах строки выносятся отдельно
+    document = DocumentBuilder(boilerplate_min_share=CRAWL_SETTINGS["boilerplate_min_share"] if max_pages > 1 else None)
+    page_links = {}  # Внутренние ссылки каждой страницы в порядке появления
     pages_processed = 0
+    pages_reused = 0  # Страницы, взятые из кэша страниц без повторного разбора
+    duplicate_index = NearDuplicateIndex(CRAWL_SETTINGS["near_duplicate_distance"]) if CRAWL_SETTINGS["near_duplicate_distance"] is not None else None
+    duplicate_pages = {}  # Почти дубликаты, не попавшие в документ {url: url оригинала}
+    page_cache_ttl = datetime.timedelta(minutes=PAGE_CACHE_TTL_MINUTES)
+    fetch_stats = {"retries": 0, "circuit_rejections": 0}  # Повторные запросы и отказы из-за недоступности хоста
     errors = []
     
+    # Лимиты обхода: страницы, время, загруженные данные и текст
+    budget = CrawlBudget(
+        max_pages,
+        max_seconds=CRAWL_BUDGET_SETTINGS["max_seconds"],
+        max_download_bytes=CRAWL_BUDGET_SETTINGS["max_download_mb"] and CRAWL_BUDGET_SETTINGS["max_download_mb"] * 1024 * 1024,
+        max_text_bytes=CRAWL_BUDGET_SETTINGS["max_text_mb"] and CRAWL_BUDGET_SETTINGS["max_text_mb"] * 1024 * 1024
+    )
+    
     # Переменные для отслеживания динамики обнаружения новых URL
     total_links_found = 0
-    new_links_by_page = {}
     consecutive_low_discovery_pages = 0
     discovery_threshold = 3  # Порог для определения страниц с низким количеством новых ссылок
     max_consecutive_low_pages = 5  # Максимальное количество подряд идущих страниц с низким обнаружением
     
-    # Для отслеживания прогресса
-    last_update_time = datetime.datetime.now()
-    update_interval = datetime.timedelta(seconds=2)  # Обновляем сообщение каждые 2 секунды
+    # Страницы загружаются параллельно, но их ссылки, текст и проверка остановки применяются строго
+    # в порядке выдачи, а страница с номером k выдается только после применения страниц до k - workers.
+    # Поэтому очередь, документ и момент остановки зависят только от сайта и числа воркеров,
+    # а не от того, какой воркер закончил раньше
+    crawl_order = []  # URL в порядке выдачи воркерам
+    results = {}  # Загруженные, но еще не примененные страницы {url: результат process_page}
+    pages_committed = 0  # Сколько страниц из crawl_order применено
+    resumed_in_flight = deque()  # Страницы, бывшие в обработке при сохранении контрольной точки: выдаются первыми
+    resumed_pages = 0  # Страницы, обработанные до контрольной точки
+    stop_crawl = False
+    crawl_aborted = False  # Обход прерван ошибкой или отменой
+    frontier_changed = asyncio.Condition()
+    
+    # Контрольные точки сохраняются только для обхода нескольких страниц
+    use_checkpoints = max_pages > 1
+    checkpoint_interval = CRAWL_SETTINGS["checkpoint_interval_seconds"]
+    last_checkpoint_time = asyncio.get_running_loop().time()
+    resumed = False
+    
+    checkpoint = None
+    if use_checkpoints:
+        checkpoint = await get_crawl_checkpoint(start_url, max_pages, max_age=datetime.timedelta(hours=DOCUMENT_CACHE_TTL_HOURS))
+    if checkpoint:
+        # Готовые страницы берем из кэша страниц; если страницы там уже нет, загружаем ее заново
+        state = checkpoint["state"]
+        missing_urls = []
+        for url in state["completed"]:
+            if url in state["duplicates"]:
+                duplicate_pages[url] = state["duplicates"][url]
+                page_links[url] = state["page_links"][url]
+                continue
+            page = await get_cached_page(url)
+            if page is None:
+                missing_urls.append(url)
+                continue
+            document.add_page(url, page["title"].strip(), page["text"])
+            budget.add_text(page["text"])
+            page_links[url] = state["page_links"][url]
+            if duplicate_index is not None:
+                duplicate_index.add(url, await parse_executor.run(simhash, page["text"]))
+        
+        to_visit = PriorityFrontier.restore(missing_urls + state["pending"], state["seen"], depths=state.get("depths"),
+                                            inlinks=state.get("inlinks"), settings=FRONTIER_SETTINGS)
+        resumed_in_flight.extend(state.get("in_flight", []))
+        seed_urls = state["seed_urls"]
+        errors = state["errors"]
+        total_links_found = state.get("total_links_found", 0)
+        consecutive_low_discovery_pages = state.get("consecutive_low_discovery_pages", 0)
+        stop_crawl = state.get("stop_crawl", False)
+        pages_processed = checkpoint["pages_processed"] - len(missing_urls)
+        resumed_pages = pages_processed
+        resumed = True
+        logger.info(f"Resuming crawl of {start_url} from checkpoint: {len(page_links)} pages done, "
+                    f"{len(resumed_in_flight) + len(to_visit)} queued")
+    
+    async def save_checkpoint():
+        """
+        Сохраняет в БД примененные страницы, очередь и счетчики эвристики остановки.
+
+        Выданные, но еще не примененные страницы сохраняются в порядке выдачи и после
+        возобновления выдаются первыми, поэтому возобновленный обход дает тот же документ.
+        Ошибка записи только логируется: обход продолжается без этой контрольной точки.
+        """
+        nonlocal last_checkpoint_time
+        # Время отмечаем сразу, чтобы другие воркеры не начали сохранять ту же точку, пока идет запись
+        last_checkpoint_time = asyncio.get_running_loop().time()
+        pending, seen, depths, inlinks = to_visit.snapshot()
+        in_flight = crawl_order[pages_committed:] + list(resumed_in_flight)
+        state = {
+            "seed_urls": seed_urls,
+            "in_flight": in_flight,
+            "pending": pending,
+            "seen": seen,
+            "depths": depths,
+            "inlinks": inlinks,
+            "completed": list(page_links),
+            "page_links": page_links,
+            "duplicates": duplicate_pages,
+            "errors": errors,
+            "total_links_found": total_links_found,
+            "consecutive_low_discovery_pages": consecutive_low_discovery_pages,
+            "stop_crawl": stop_crawl
+        }
+        try:
+            await save_crawl_checkpoint(start_url, max_pages, state, resumed_pages + pages_committed)
+        except Exception as e:
+            logger.exception(f"Failed to save crawl checkpoint for {start_url}: {e}")
+    
+    # Для отслеживания прогресса: статус показывает отдельная задача, воркеры только меняют счетчики
+    current_page = None
     
     # Оценка общего количества страниц (начинаем с количества в очереди)
     estimated_total_pages = len(to_visit)
 
-    async with aiohttp.ClientSession() as session:
-        while to_visit and pages_processed < max_pages:
-            current_url = to_visit.popleft()
-
-            if current_url in visited:
-                continue
+    def render_status():
+        """Строит текст статусного сообщения по текущему состоянию обхода."""
+        nonlocal estimated_total_pages
+        if current_page is None:
+            return None
+        
+        # Если обнаружено значительное количество страниц, обновляем оценку
+        if len(to_visit) > estimated_total_pages - pages_processed:
+            estimated_total_pages = pages_processed + len(to_visit)
+        
+        # Рассчитываем процент на основе текущей оценки общего количества
+        if estimated_total_pages > 0:
+            percent = min(int((pages_processed / estimated_total_pages) * 100), 99)
+        else:
+            percent = 0
+        
+        # Создаем прогресс-бар
+        progress_bar_length = 20
+        filled = int(progress_bar_length * percent / 100)
+        bar = '█' * filled + '░' * (progress_bar_length - filled)
+        
+        # Строим сообщение с обновлением статуса
+        return (
+            f"🔄 <b>Обработка сайта {base_domain}...</b>\n\n"
+            f"📊 Прогресс: {percent}% [{bar}]\n"
+            f"📑 Обработано страниц: <b>{pages_processed}</b>\n"
+            f"📈 Оценка общего кол-ва страниц: <b>~{estimated_total_pages}</b>\n"
+            f"🔗 Текущая страница: <code>{current_page}</code>\n\n"
+            f"⏳ Пожалуйста, подождите...\n"
+            f"<i>Бот автоматически определяет количество страниц</i>"
+        )
 
-            # Normalize URL slightly (e.g., remove fragment)
-            current_url = urljoin(current_url, urlparse(current_url).path)
-            if not current_url.startswith(('http://', 'https://')): # Ensure scheme is present
-                 continue
+    reporter = ProgressReporter(status_message, render_status, interval=2.0)
 
-            if current_url in visited:
-                continue
+    def commit_next_page():
+        """Применяет следующую по порядку выдачи загруженную страницу."""
+        nonlocal pages_committed
+        url = crawl_order[pages_committed]
+        result = results.pop(url)
+        pages_committed += 1
+        try:
+            commit_page(url, result)
+        except Exception as e:
+            # Ошибка одной страницы не должна останавливать применение следующих
+            logger.exception(f"Unexpected error committing {url}: {e}")
+            errors.append(f"{url}: Unexpected error: {e}")
+
+    async def next_url():
+        """Выдает воркеру следующий URL из общей очереди или None, если обход закончен."""
+        nonlocal pages_processed
+        async with frontier_changed:
+            while True:
+                # Исчерпан любой из лимитов - новые страницы не выдаем, начатые дорабатываются
+                if stop_crawl or crawl_aborted or budget.check(pages_processed):
+                    return None
+
+                # Перед выдачей страницы k применяем все страницы до k - workers; если очередь пуста,
+                # применяем следующую страницу - у нее могут быть новые ссылки
+                uncommitted = len(crawl_order) - pages_committed
+                if uncommitted >= workers or (uncommitted and not to_visit and not resumed_in_flight):
+                    if crawl_order[pages_committed] in results:
+                        commit_next_page()
+                    else:
+                        await frontier_changed.wait()
+                    continue
+
+                if not to_visit and not resumed_in_flight:
+                    return None
+
+                current_url = resumed_in_flight.popleft() if resumed_in_flight else to_visit.pop()
+                logger.info(f"Processing ({pages_processed+1}/{estimated_total_pages}): {current_url}")
+                pages_processed += 1
+                crawl_order.append(current_url)
+                return current_url
+
+    async def process_page(session, current_url):
+        """
+        Загружает и разбирает страницу.
+
+        Returns:
+            dict: page - данные страницы или None, если ее не удалось загрузить,
+                  fingerprint - отпечаток текста для поиска дубликатов, errors - ошибки загрузки
+        """
+        nonlocal pages_reused, current_page
+
+        current_page = current_url
+
+        # Страницы общие для всех обходов всех пользователей
+        cached_page = await get_cached_page(current_url)
+
+        if cached_page and cached_page["checked_at"] >= datetime.datetime.now() - page_cache_ttl:
+            # Страница недавно загружалась (этим или другим обходом) - запрос к сайту не нужен
+            page = cached_page
+            record_page_cache_event("hits")
+        else:
+            # Если страница уже сохранялась, запрос будет условным
+            # Загрузка (с повторами) не выходит за оставшееся время обхода
+            html_content, error, fetch_info = await fetch_page_with_retries(session, current_url, cached_page,
+                                                                            min_interval=crawl_delay,
+                                                                            timeout=budget.remaining_seconds)
+            fetch_stats["retries"] += max(fetch_info["attempts"] - 1, 0)
+            fetch_stats["circuit_rejections"] += fetch_info["circuit_open"]
+            budget.add_download(fetch_info["bytes"])
 
-            # Обновляем статус прогресса
-            current_time = datetime.datetime.now()
-            if status_message and (current_time - last_update_time > update_interval or pages_processed == 0):
-                last_update_time = current_time
-                
-                # Если обнаружено значительное количество страниц, обновляем оценку
-                if len(to_visit) > estimated_total_pages - pages_processed:
-                    estimated_total_pages = pages_processed + len(to_visit)
-                
-                # Рассчитываем процент на основе текущей оценки общего количества
-                if estimated_total_pages > 0:
-                    percent = min(int((pages_processed / estimated_total_pages) * 100), 99)
+            if error:
+                return {"page": None, "fingerprint": None, "errors": [f"{current_url}: {error}"]}
+
+            if fetch_info["not_modified"]:
+                # Сервер подтвердил, что страница не изменилась - берем сохраненный текст
+                page = cached_page
+            elif html_content:
+                # Хеш учитывает версию извлечения текста: после ее изменения сохраненный текст устаревает
+                content_hash = hashlib.sha256((EXTRACTOR_VERSION + html_content).encode('utf-8', errors='ignore')).hexdigest()
+                if cached_page and cached_page["content_hash"] == content_hash:
+                    # Сервер не поддерживает условные запросы, но содержимое то же самое
+                    page = cached_page
                 else:
-                    percent = 0
-                
-                # Создаем прогресс-бар
-                progress_bar_length = 20
-                filled = int(progress_bar_length * percent / 100)
-                bar = '█' * filled + '░' * (progress_bar_length - filled)
-                
-                # Строим сообщение с обновлением статуса
-                status_text = (
-                    f"🔄 <b>Обработка сайта {base_domain}...</b>\n\n"
-                    f"📊 Прогресс: {percent}% [{bar}]\n"
-                    f"📑 Обработано страниц: <b>{pages_processed}</b>\n"
-                    f"📈 Оценка общего кол-ва страниц: <b>~{estimated_total_pages}</b>\n"
-                    f"🔗 Текущая страница: <code>{current_url}</code>\n\n"
-                    f"⏳ Пожалуйста, подождите...\n"
-                    f"<i>Бот автоматически определяет количество страниц</i>"
-                )
-                
-                try:
-                    await status_message.edit_text(status_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-                except Exception as e:
-                    logger.warning(f"Couldn't update status message: {e}")
-
-            logger.info(f"Processing ({pages_processed+1}/{estimated_total_pages}): {current_url}")
-            visited.add(current_url)
-            pages_processed += 1
-            
-            # Запоминаем сколько ссылок было до обработки этой страницы
-            links_before = len(to_visit)
-
-            html_content, error = await fetch_page(session, current_url)
+                    # Разбираем страницу один раз вне цикла событий: заголовок, текст и ссылки
+                    # Относительные ссылки разрешаются от фактического адреса страницы (после перенаправлений)
+                    page = await parse_executor.extract_page(html_content, fetch_info["url"] or current_url)
+                    await save_cached_page(current_url, page["title"], page["text"], page["links"], content_hash,
+                                     etag=fetch_info["etag"], last_modified=fetch_info["last_modified"])
+                    record_page_cache_event("misses")
+            else:
+                return {"page": None, "fingerprint": None, "errors": []}
 
-            if error:
-                errors.append(f"{current_url}: {error}")
-                continue
+            if page is cached_page:
+                await touch_cached_page(current_url, etag=fetch_info["etag"], last_modified=fetch_info["last_modified"])
+                record_page_cache_event("revalidated")
 
-            if html_content:
-                # Получаем заголовок страницы
-                try:
-                    page_soup = BeautifulSoup(html_content, 'html.parser')
-                    page_title = page_soup.title.string if page_soup.title else "Без заголовка"
-                except:
-                    page_title = "Без заголовка"
-                
-                # Добавляем разделитель страницы и URL перед текстом
-                page_separator = "\n\n" + "╔" + "═" * 78 + "╗\n"
-                page_header = f"{page_separator}║  СТРАНИЦА: {page_title.strip()}\n"
-                page_header += f"║  URL: {current_url}\n"
-                page_header += "╚" + "═" * 78 + "╝\n\n"
-                
-                # Получаем текст страницы и добавляем заголовок
-                text = page_header + get_text_from_html(html_content)
-                scraped_data[current_url] = text
-
-                # Find links
-                soup = BeautifulSoup(html_content, 'html.parser')
-                for link in soup.find_all('a', href=True):
-                    href = link['href']
-                    absolute_url = urljoin(current_url, href)
-                    parsed_absolute_url = urlparse(absolute_url)
-
-                    # Check if internal link, http/https, and not visited/queued
-                    if (parsed_absolute_url.netloc == base_domain and
-                        parsed_absolute_url.scheme in ['http', 'https'] and
-                        absolute_url not in visited and
-                        absolute_url not in to_visit):
-                        to_visit.append(absolute_url)
-                
-                # Подсчитываем, сколько новых ссылок найдено на этой странице
-                links_after = len(to_visit)
-                new_links = links_after - links_before
-                new_links_by_page[current_url] = new_links
-                total_links_found += new_links
-                
-                # Проверяем, является ли эта страница "малопродуктивной" в плане новых ссылок
-                avg_links_per_page = total_links_found / max(1, pages_processed)
-                if new_links < avg_links_per_page * 0.3 or new_links < discovery_threshold:
-                    consecutive_low_discovery_pages += 1
-                else:
-                    consecutive_low_discovery_pages = 0
-                
-                # Если несколько страниц подряд дают мало новых ссылок и мы обработали достаточно страниц,
-                # можно предположить, что мы исследовали большую часть сайта
-                if consecutive_low_discovery_pages >= max_consecutive_low_pages and pages_processed > 50:
-                    logger.info(f"Stopping crawl after {pages_processed} pages due to low discovery rate")
-                    break
-                    
-            # Small delay to be polite to the server
-            await asyncio.sleep(0.1)
+        if page is cached_page:
+            pages_reused += 1
+        
+        fingerprint = None
+        if duplicate_index is not None:
+            fingerprint = page.get("fingerprint")
+            if fingerprint is None:
+                fingerprint = await parse_executor.run(simhash, page["text"])
+
+        return {"page": page, "fingerprint": fingerprint, "errors": []}
+
+    def commit_page(current_url, result):
+        """Добавляет страницу в документ, а ее новые ссылки - в очередь, и проверяет, не пора ли остановиться."""
+        nonlocal total_links_found, consecutive_low_discovery_pages, stop_crawl
+        errors.extend(result["errors"])
+        page = result["page"]
+        if page is None:
+            return
 
+        # Почти такие же страницы (версии для печати, варианты адресов) в документ не добавляем,
+        # но ссылки с них обходим как обычно
+        duplicate_of = None
+        if duplicate_index is not None:
+            # Близкий отпечаток подтверждаем по тексту: у коротких страниц с общим шаблоном сайта
+            # отпечатки тоже близки, но своих шинглов у каждой из них достаточно
+            page_shingles = None
+
+            def is_duplicate_of(other_url):
+                nonlocal page_shingles
+                if page_shingles is None:
+                    page_shingles = shingles(page["text"])
+                unique_shingles = page_shingles - shingles(document.page_text(other_url))
+                return len(unique_shingles) <= CRAWL_SETTINGS["near_duplicate_max_unique_shingles"]
+
+            duplicate_of = duplicate_index.find(result["fingerprint"], confirm=is_duplicate_of)
+            if duplicate_of is None:
+                duplicate_index.add(current_url, result["fingerprint"])
+        
+        if duplicate_of:
+            duplicate_pages[current_url] = duplicate_of
+            logger.info(f"Skipping {current_url}: near-duplicate of {duplicate_of}")
+        else:
+            # Добавляем раздел страницы (разделитель, заголовок, URL и текст) в документ
+            document.add_page(current_url, page["title"].strip(), page["text"])
+            budget.add_text(page["text"])
+
+        # Find links
+        links = []
+        new_links = 0
+        link_depth = to_visit.depth(current_url) + 1
+        for absolute_url in page["links"]:
+            absolute_url = canonicalize_url(absolute_url)
+            parsed_absolute_url = urlparse(absolute_url)
+
+            # Check if internal link, http/https and allowed by robots.txt
+            if (parsed_absolute_url.netloc == base_domain and
+                parsed_absolute_url.scheme in ['http', 'https'] and
+                (robots is None or robots.can_fetch(REQUEST_HEADERS['User-Agent'], absolute_url))):
+                links.append(absolute_url)
+
+                # Add to the queue if not visited/queued
+                if to_visit.add(absolute_url, depth=link_depth, referrer=current_url):
+                    new_links += 1
+        page_links[current_url] = links
+        
+        # Подсчитываем, сколько новых ссылок найдено на этой странице
+        total_links_found += new_links
+        
+        # Проверяем, является ли эта страница "малопродуктивной" в плане новых ссылок
+        pages_done = resumed_pages + pages_committed
+        avg_links_per_page = total_links_found / pages_done
+        if new_links < avg_links_per_page * 0.3 or new_links < discovery_threshold:
+            consecutive_low_discovery_pages += 1
+        else:
+            consecutive_low_discovery_pages = 0
+        
+        # Если несколько страниц подряд дают мало новых ссылок и мы обработали достаточно страниц,
+        # можно предположить, что мы исследовали большую часть сайта
+        # (если страницы взяты из sitemap, сайт уже перечислен и эвристика не нужна).
+        # Страницы, выданные после этой, уже не применяются
+        if consecutive_low_discovery_pages >= max_consecutive_low_pages and pages_done > 50 and len(seed_urls) == 1:
+            logger.info(f"Stopping crawl after {pages_done} pages due to low discovery rate")
+            stop_crawl = True
+
+    async def worker(session):
+        """Загружает страницы из общей очереди, пока она не опустеет."""
+        while True:
+            current_url = await next_url()
+            if current_url is None:
+                return
+
+            try:
+                result = await process_page(session, current_url)
+            except Exception as e:
+                logger.exception(f"Unexpected error processing {current_url}: {e}")
+                result = {"page": None, "fingerprint": None, "errors": [f"{current_url}: Unexpected error: {e}"]}
+
+            # Отмена во время запроса к БД может прийти сюда как ошибка драйвера - после прерывания не продолжаем
+            if crawl_aborted:
+                return
+
+            # Страница загружена (прерванные отменой не попадают в results и вернутся в очередь в контрольной точке)
+            async with frontier_changed:
+                results[current_url] = result
+                frontier_changed.notify_all()
+
+            if use_checkpoints and asyncio.get_running_loop().time() - last_checkpoint_time >= checkpoint_interval:
+                await save_checkpoint()
+
+    # Общая сессия с пулом keep-alive соединений, переживающая отдельные обходы
+    session = await http_client.get_session()
+
+    # Для полного обхода учитываем robots.txt и берем страницы из sitemap
+    if max_pages > 1 and CRAWL_SETTINGS["respect_robots"]:
+        robots = await load_robots(session, start_url, REQUEST_HEADERS)
+        crawl_delay = float(robots.crawl_delay(REQUEST_HEADERS['User-Agent']) or 0)
+        if crawl_delay:
+            logger.info(f"Honoring Crawl-delay of {crawl_delay}s for {base_domain}")
+
+        if use_sitemaps and not resumed:
+            for url in await discover_sitemap_urls(session, start_url, robots, REQUEST_HEADERS, max_urls=max_pages):
+                if to_visit.add(url, seed=True):
+                    seed_urls.append(url)
+            estimated_total_pages = len(to_visit)
+
+    reporter.start()
+    tasks = [asyncio.create_task(worker(session)) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Воркеры не должны пережить обход: их сессия и документ сейчас закроются
+        crawl_aborted = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await reporter.stop()
+        # Обход прерван (ошибка или остановка бота) - следующий запрос продолжит с этого места
+        if use_checkpoints:
+            await save_checkpoint()
+        raise
+
+    # Страницы, загруженные после исчерпания лимита, применяем; после остановки по эвристике - отбрасываем
+    while not stop_crawl and pages_committed < len(crawl_order) and crawl_order[pages_committed] in results:
+        commit_next_page()
+    pages_processed -= len(crawl_order) - pages_committed
+
+    completion_reason = get_completion_reason(pages_processed, max_pages, max_consecutive_low_pages if stop_crawl else 0,
+                                              budget_exhausted=budget.exhausted)
+    
     # Показываем финальный статус 100%
-    if status_message:
+    final_status = (
+        f"✅ <b>Обработка сайта {base_domain} завершена!</b>\n\n"
+        f"📊 Прогресс: 100% [{'█' * 20}]\n"
+        f"📑 Обработано страниц: <b>{pages_processed}</b>\n"
+    )
+    if fetch_stats["retries"]:
+        final_status += f"🔁 Повторных запросов: <b>{fetch_stats['retries']}</b>\n"
+    if duplicate_pages:
+        final_status += f"♻️ Пропущено дубликатов: <b>{len(duplicate_pages)}</b>\n"
+    if to_visit.trapped or to_visit.capped:
+        final_status += f"🪤 Пропущено адресов-ловушек: <b>{to_visit.trapped + to_visit.capped}</b>\n"
+    if fetch_stats["circuit_rejections"]:
+        final_status += f"⛔ Пропущено из-за недоступности сайта: <b>{fetch_stats['circuit_rejections']}</b>\n"
+    if max_pages > 1:
+        final_status += f"🏁 {completion_reason}\n"
+    final_status += (
+        f"⏱ Завершено!\n\n"
+        f"🔄 Подготовка результатов..."
+    )
+    await reporter.stop(final_status)
+
+    # Собираем документ с оглавлением, упорядочив страницы так же, как при последовательном обходе
+    order = [url for url in get_sequential_order(seed_urls, page_links) if url in document]
+    crawl_document = document.finish(order, base_domain, pages_processed, errors, duplicates_skipped=len(duplicate_pages),
+                                     completion_reason=completion_reason if max_pages > 1 else None)
+    if use_checkpoints:
+        await delete_crawl_checkpoint(start_url, max_pages)
+    
+    logger.info(f"Crawl completed: {pages_processed} pages processed, {pages_reused} reused from the page cache, "
+                f"{len(duplicate_pages)} near-duplicates skipped, "
+                f"{to_visit.trapped} trap URLs and {to_visit.capped} URLs over the per-template cap dropped, "
+                f"{fetch_stats['retries']} retries, {fetch_stats['circuit_rejections']} skipped by the circuit breaker, "
+                f"request rate for {base_domain}: {fetch_limiter.get_host_rate(base_domain) or 0:.1f}/s")
+    return crawl_document, pages_processed
+
+async def run_crawl_job(user_id: int, url: str, max_pages: int, status_message: Message) -> tuple[CrawlDocument, int, int | None]:
+    """
+    Runs a crawl through the global crawl scheduler and caches its document.
+
+    Single-page crawls go to the priority lane. If the same crawl is already
+    queued or running, the user waits for it instead of starting another one;
+    every waiting user gets the same CrawlDocument and must close() it.
+
+    Returns:
+        tuple: (document, pages_count, document_id) - document_id is None if nothing was crawled
+    """
+    is_single_page = max_pages == 1
+    job_key = (canonicalize_url(url), max_pages)
+
+    async def crawl_job():
+        document, pages_count = await crawl_website(url, max_pages=max_pages, status_message=status_message)
         try:
-            final_status = (
-                f"✅ <b>Обработка сайта {base_domain} завершена!</b>\n\n"
-                f"📊 Прогресс: 100% [{'█' * 20}]\n"
-                f"📑 Обработано страниц: <b>{pages_processed}</b>\n"
-                f"⏱ Завершено!\n\n"
-                f"🔄 Подготовка результатов..."
+            # Документ сохраняется в кэш один раз для всех ожидающих пользователей
+            document_id = None
+            if pages_count:
+                document_id = await cache_document(url, document.read_text(), pages_count, is_single_page=is_single_page)
+        except Exception:
+            document.close()
+            raise
+        return document, pages_count, document_id
+
+    if crawl_scheduler.has_job(job_key):
+        try:
+            await status_message.edit_text(
+                f"⏳ <b>Этот сайт уже обрабатывается по запросу другого пользователя.</b>\n\n"
+                f"Результат будет отправлен, как только обработка завершится.",
+                parse_mode=ParseMode.HTML
             )
-            await status_message.edit_text(final_status, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
         except Exception as e:
-            logger.warning(f"Couldn't update final status message: {e}")
+            logger.warning(f"Couldn't update status message: {e}")
 
-    # Собираем все скрапленные тексты в один документ с оглавлением
-    all_text = ""
-    
-    # Создаем оглавление
-    toc = "\n\n" + "╔" + "═" * 78 + "╗\n"
-    toc += "║" + " " * 30 + "ОГЛАВЛЕНИЕ" + " " * 30 + "║\n"
-    toc += "╚" + "═" * 78 + "╝\n\n"
-    
-    page_number = 1
-    titles = {}
-    for url, text in scraped_data.items():
-        # Извлекаем заголовок страницы из текста
-        try:
-            title_line = text.split("\n")[3]  # Строка с "СТРАНИЦА: ..."
-            title = title_line.replace("СТРАНИЦА: ", "").strip()
-        except:
-            title = f"Страница {page_number}"
-            
-        # Сохраняем для оглавления
-        titles[url] = (title, page_number)
-        page_number += 1
-    
-    # Сортируем по номеру страницы
-    for url, (title, page_num) in sorted(titles.items(), key=lambda x: x[1][1]):
-        toc += f"  {page_num:02d}. {title}\n"
-    
-    toc += "\n" + "╔" + "═" * 78 + "╗\n"
-    toc += "║" + " " * 25 + "ИНФОРМАЦИЯ О ДОКУМЕНТЕ" + " " * 25 + "║\n"
-    toc += "╚" + "═" * 78 + "╝\n\n"
-    
-    # Добавляем информацию о сайте
-    domain_info = f"📋 Сайт: {base_domain}\n"
-    domain_info += f"📊 Обработано страниц: {pages_processed}\n\n"
-    
-    # Собираем итоговый документ
-    all_text = domain_info + toc + "\n\n" + "╔" + "═" * 78 + "╗\n"
-    all_text += "║" + " " * 27 + "СОДЕРЖИМОЕ САЙТА" + " " * 27 + "║\n"
-    all_text += "╚" + "═" * 78 + "╝\n\n"
-    
-    all_text += "\n".join(scraped_data.values())
-    
-    # Если были ошибки, добавляем их в конец
-    if errors:
-        error_section = "\n\n" + "╔" + "═" * 78 + "╗\n"
-        error_section += "║" + " " * 26 + "ОШИБКИ ПРИ СКАНИРОВАНИИ" + " " * 25 + "║\n"
-        error_section += "╚" + "═" * 78 + "╝\n\n"
-        for error in errors:
-            error_section += f"⚠️ {error}\n"
-        all_text += error_section
-    
-    logger.info(f"Crawl completed: {pages_processed} pages processed")
-    return all_text, pages_processed
-
-def get_completion_reason(pages_processed, max_pages, consecutive_low_discovery):
+    return await crawl_scheduler.run(user_id, job_key, crawl_job, priority=is_single_page,
+                                     share_result=lambda result, waiters: result[0].retain(waiters - 1))
+
+def get_completion_reason(pages_processed, max_pages, consecutive_low_discovery, budget_exhausted=None):
     """Возвращает причину завершения сканирования."""
-    if pages_processed >= max_pages:
+    if budget_exhausted == BUDGET_TIME:
+        return "Достигнут лимит времени обхода, документ содержит уже обработанные страницы"
+    elif budget_exhausted == BUDGET_DOWNLOAD:
+        return "Достигнут лимит объема загруженных данных, документ содержит уже обработанные страницы"
+    elif budget_exhausted == BUDGET_TEXT:
+        return "Достигнут лимит объема текста, документ содержит уже обработанные страницы"
+    elif pages_processed >= max_pages:
         return "Достигнут максимальный лимит страниц"
     elif consecutive_low_discovery >= 5:
         return "Исчерпаны доступные страницы сайта"
@@ -481,169 +870,166 @@ def get_completion_reason(pages_processed, max_pages, consecutive_low_discovery)
         return "Завершено успешно"
 
 # Функция для работы с сессиями ИИ
-async def create_ai_session(user_id, username, first_name, document_text):
-    """Создает новую сессию чата с ИИ."""
-    db = get_db()
-    
-    # Проверяем существование пользователя или создаем его
-    user = db.query(User).filter(User.telegram_id == user_id).first()
-    if not user:
-        user = User(telegram_id=user_id, username=username, first_name=first_name)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    
-    # Закрываем все активные сессии пользователя
-    active_sessions = db.query(AISession).filter(
-        AISession.user_id == user.id,
-        AISession.is_active == True
-    ).all()
-    
-    # Удаляем сообщения из активных сессий и закрываем их
-    for session in active_sessions:
-        # Удаляем сообщения
-        db.query(DBMessage).filter(
-            DBMessage.session_id == session.id
-        ).delete()
-        
-        # Закрываем сессию
-        session.is_active = False
-    
-    # Удаляем старые сессии (оставляем последние 5)
-    old_sessions = db.query(AISession).filter(
-        AISession.user_id == user.id,
-        AISession.is_active == False
-    ).order_by(AISession.last_activity.desc()).offset(5).all()
-    
-    for old_session in old_sessions:
-        # Удаляем сообщения
-        db.query(DBMessage).filter(
-            DBMessage.session_id == old_session.id
-        ).delete()
-        
-        # Удаляем сессию
-        db.delete(old_session)
-    
-    # Используем datetime без UTC для совместимости с БД
-    current_time = datetime.datetime.now()
-    
-    # Создаем новую сессию
-    new_session = AISession(
-        user_id=user.id,
-        document_text=document_text,
-        created_at=current_time,
-        last_activity=current_time,
-        is_active=True,
-        request_count=0
-    )
-    
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
+async def create_ai_session(user_id, username, first_name, document_hash):
+    """Создает новую сессию чата с ИИ по тексту документа из хранилища blobs."""
+    async with session_scope() as db:
+        # Проверяем существование пользователя или создаем его
+        user = await db.scalar(select(User).filter(User.telegram_id == user_id))
+        if not user:
+            user = User(telegram_id=user_id, username=username, first_name=first_name)
+            db.add(user)
+            await db.flush()
+        
+        # Закрываем все активные сессии пользователя
+        active_sessions = (await db.scalars(select(AISession).filter(
+            AISession.user_id == user.id,
+            AISession.is_active == True
+        ))).all()
+        
+        # Удаляем сообщения из активных сессий и закрываем их
+        for session in active_sessions:
+            # Удаляем сообщения
+            await db.execute(delete(DBMessage).filter(
+                DBMessage.session_id == session.id
+            ))
+            
+            # Закрываем сессию
+            session.is_active = False
+        
+        # Удаляем старые сессии (оставляем последние 5)
+        old_session_ids = (await db.scalars(select(AISession.id).filter(
+            AISession.user_id == user.id,
+            AISession.is_active == False
+        ).order_by(AISession.last_activity.desc()).offset(5))).all()
+        
+        if old_session_ids:
+            # Тексты удаляемых сессий больше не учитываются в статистике хранилища blobs
+            old_sessions_size = await db.scalar(select(func.coalesce(func.sum(Blob.size), 0)).select_from(AISession).join(
+                Blob, AISession.document_hash == Blob.hash
+            ).filter(AISession.id.in_(old_session_ids)))
+            await update_cache_stats(db, blob_referenced_bytes=-old_sessions_size)
+            
+            # Удаляем сообщения и сами сессии
+            await db.execute(delete(DBMessage).filter(DBMessage.session_id.in_(old_session_ids)))
+            await db.execute(delete(AISession).filter(AISession.id.in_(old_session_ids)))
+        
+        # Используем datetime без UTC для совместимости с БД
+        current_time = datetime.datetime.now()
+        
+        # Создаем новую сессию
+        new_session = AISession(
+            user_id=user.id,
+            document_hash=document_hash,
+            created_at=current_time,
+            last_activity=current_time,
+            is_active=True,
+            request_count=0
+        )
+        
+        db.add(new_session)
+        await db.flush()
+        await update_cache_stats(db, blob_referenced_bytes=await db.scalar(select(Blob.size).filter(Blob.hash == document_hash)) or 0)
     
     logger.info(f"Created new AI session {new_session.id} for user {user_id}")
     return new_session.id
 
 async def get_active_session(user_id):
     """Получает активную сессию для пользователя."""
-    db = get_db()
-    user = db.query(User).filter(User.telegram_id == user_id).first()
-    
-    if not user:
-        return None
-    
-    # Проверяем таймаут сессии - используем datetime без UTC для совместимости с БД
-    timeout = datetime.datetime.now() - datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    
-    # Находим активную сессию
-    session = db.query(AISession).filter(
-        AISession.user_id == user.id,
-        AISession.is_active == True
-    ).first()
-    
-    # Если сессия не найдена
-    if not session:
-        return None
-    
-    # Проверяем таймаут и лимит запросов
-    if session.last_activity <= timeout or session.request_count >= MAX_SESSION_REQUESTS:
-        # Удаляем сообщения
-        deleted_count = db.query(DBMessage).filter(
-            DBMessage.session_id == session.id
-        ).delete()
+    async with session_scope() as db:
+        user = await db.scalar(select(User).filter(User.telegram_id == user_id))
         
-        # Закрываем сессию
-        session.is_active = False
-        db.commit()
+        if not user:
+            return None
         
-        reason = "timeout" if session.last_activity <= timeout else "request limit exceeded"
-        logger.info(f"Session {session.id} closed due to {reason}. Deleted {deleted_count} messages.")
-        return None
-    
-    return session
+        # Проверяем таймаут сессии - используем datetime без UTC для совместимости с БД
+        timeout = datetime.datetime.now() - datetime.timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+        
+        # Находим активную сессию
+        session = await db.scalar(select(AISession).filter(
+            AISession.user_id == user.id,
+            AISession.is_active == True
+        ).limit(1))
+        
+        # Если сессия не найдена
+        if not session:
+            return None
+        
+        # Проверяем таймаут и лимит запросов
+        if session.last_activity <= timeout or session.request_count >= MAX_SESSION_REQUESTS:
+            # Удаляем сообщения
+            deleted_count = (await db.execute(delete(DBMessage).filter(
+                DBMessage.session_id == session.id
+            ))).rowcount
+            
+            # Закрываем сессию
+            session.is_active = False
+            
+            reason = "timeout" if session.last_activity <= timeout else "request limit exceeded"
+            logger.info(f"Session {session.id} closed due to {reason}. Deleted {deleted_count} messages.")
+            return None
+        
+        return session
 
 async def add_message_to_session(session_id, role, content):
     """Добавляет сообщение в сессию."""
-    db = get_db()
-    session = db.query(AISession).filter(AISession.id == session_id).first()
-    
-    if not session:
-        return False
-    
-    # Обновляем время последней активности
-    session.last_activity = datetime.datetime.now()
-    
-    # Если это сообщение от пользователя, увеличиваем счетчик запросов
-    if role == 'user':
-        session.request_count += 1
-    
-    # Добавляем сообщение
-    message = DBMessage(
-        session_id=session_id,
-        role=role,
-        content=content,
-        timestamp=datetime.datetime.now()
-    )
-    
-    db.add(message)
-    db.commit()
+    async with session_scope() as db:
+        session = await db.get(AISession, session_id)
+        
+        if not session:
+            return False
+        
+        # Обновляем время последней активности
+        session.last_activity = datetime.datetime.now()
+        
+        # Если это сообщение от пользователя, увеличиваем счетчик запросов
+        if role == 'user':
+            session.request_count += 1
+        
+        # Добавляем сообщение
+        message = DBMessage(
+            session_id=session_id,
+            role=role,
+            content=content,
+            timestamp=datetime.datetime.now()
+        )
+        
+        db.add(message)
     
     return True
 
 async def get_session_messages(session_id):
     """Получает все сообщения из сессии."""
-    db = get_db()
-    messages = db.query(DBMessage).filter(
-        DBMessage.session_id == session_id
-    ).order_by(DBMessage.timestamp).all()
+    async with session_scope() as db:
+        messages = (await db.execute(select(DBMessage.role, DBMessage.content).filter(
+            DBMessage.session_id == session_id
+        ).order_by(DBMessage.timestamp))).all()
     
     return [{'role': msg.role, 'content': msg.content} for msg in messages]
 
 async def close_session(user_id):
     """Закрывает активную сессию пользователя и удаляет связанные сообщения."""
-    db = get_db()
-    user = db.query(User).filter(User.telegram_id == user_id).first()
-    
-    if not user:
-        return False
-    
-    session = db.query(AISession).filter(
-        AISession.user_id == user.id,
-        AISession.is_active == True
-    ).first()
-    
-    if session:
-        # Удаляем все сообщения, связанные с этой сессией
-        deleted_messages = db.query(DBMessage).filter(
-            DBMessage.session_id == session.id
-        ).delete()
+    async with session_scope() as db:
+        user = await db.scalar(select(User).filter(User.telegram_id == user_id))
+        
+        if not user:
+            return False
         
-        # Помечаем сессию как неактивную
-        session.is_active = False
-        db.commit()
+        session = await db.scalar(select(AISession).filter(
+            AISession.user_id == user.id,
+            AISession.is_active == True
+        ).limit(1))
         
-        logger.info(f"Session {session.id} for user {user_id} closed. Deleted {deleted_messages} messages.")
-        return True
+        if session:
+            # Удаляем все сообщения, связанные с этой сессией
+            deleted_messages = (await db.execute(delete(DBMessage).filter(
+                DBMessage.session_id == session.id
+            ))).rowcount
+            
+            # Помечаем сессию как неактивную
+            session.is_active = False
+            
+            logger.info(f"Session {session.id} for user {user_id} closed. Deleted {deleted_messages} messages.")
+            return True
     
     return False
 
@@ -739,13 +1125,16 @@ async def admin_command(message: Message):
     
     # Получаем статистику от rate_limiter
     stats = rate_limiter.get_stats()
+    http_stats = http_client.get_stats()
+    breaker_stats = circuit_breaker.get_stats()
+    scheduler_stats = crawl_scheduler.get_stats()
     
     # Получаем статистику из базы данных
-    db = get_db()
-    users_count = db.query(User).count()
-    active_sessions = db.query(AISession).filter(AISession.is_active == True).count()
-    total_sessions = db.query(AISession).count()
-    total_messages = db.query(DBMessage).count()
+    async with session_scope() as db:
+        users_count = await db.scalar(select(func.count()).select_from(User))
+        active_sessions = await db.scalar(select(func.count()).select_from(AISession).filter(AISession.is_active == True))
+        total_sessions = await db.scalar(select(func.count()).select_from(AISession))
+        total_messages = await db.scalar(select(func.count()).select_from(DBMessage))
     
     # Формируем ответ
     admin_message = (
@@ -765,6 +1154,18 @@ async def admin_command(message: Message):
         f"- ИИ запросы: <code>{stats['requests_by_type']['ai_requests']}</code>\n"
         f"- Общие запросы: <code>{stats['requests_by_type']['general_requests']}</code>\n\n"
         
+        f"🕸 <b>Обходы сайтов:</b>\n"
+        f"- Выполняется: <code>{scheduler_stats['running']}/{scheduler_stats['max_jobs']}</code>, в очереди: <code>{scheduler_stats['queued']}</code>\n"
+        f"- Запущено: <code>{scheduler_stats['started']}</code>, объединено одинаковых: <code>{scheduler_stats['coalesced']}</code>\n\n"
+        
+        f"🌐 <b>HTTP-соединения:</b>\n"
+        f"- HTTP-запросов при обходе: <code>{http_stats['requests']}</code>\n"
+        f"- Новых соединений: <code>{http_stats['connections_created']}</code>\n"
+        f"- Переиспользовано: <code>{http_stats['connections_reused']}</code> ({http_stats['reuse_ratio']:.1%})\n"
+        f"- DNS-кэш (попадания/промахи): <code>{http_stats['dns_cache_hits']}/{http_stats['dns_cache_misses']}</code>\n"
+        f"- Недоступных хостов сейчас: <code>{breaker_stats['open_hosts']}</code> "
+        f"(отклонено запросов: <code>{breaker_stats['rejected']}</code>)\n\n"
+        
         f"⏱ <b>Данные собраны:</b> <code>{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>"
     )
     
@@ -803,11 +1204,13 @@ async def process_ask_ai_button(callback_query: types.CallbackQuery, state: FSMC
     # Сразу отвечаем на callback query, чтобы избежать таймаута
     await callback_query.answer()
     
-    # Получаем текст документа из состояния
+    # Получаем хеш текста документа из кэша по ID, сохраненному в состоянии:
+    # сессия ссылается на тот же blob, текст не копируется
     data = await state.get_data()
-    document_text = data.get("document_text")
+    cached_document_id = data.get("cached_document_id")
+    document_hash = await get_document_hash(cached_document_id) if cached_document_id else None
     
-    if not document_text:
+    if not document_hash:
         await callback_query.message.answer("❌ Сначала отправьте URL для сбора информации.")
         return
     
@@ -816,7 +1219,7 @@ async def process_ask_ai_button(callback_query: types.CallbackQuery, state: FSMC
         callback_query.from_user.id,
         callback_query.from_user.username,
         callback_query.from_user.first_name,
-        document_text
+        document_hash
     )
     
     # Сохраняем ID сессии в состоянии
@@ -862,10 +1265,10 @@ async def process_summary_button(callback_query: types.CallbackQuery, state: FSM
     # Сразу отвечаем на callback query, чтобы избежать таймаута
     await callback_query.answer()
     
-    # Получаем текст документа, ID кэшированного документа и тип обхода из состояния
+    # Получаем ID кэшированного документа и тип обхода из состояния, текст документа - из кэша
     data = await state.get_data()
-    document_text = data.get("document_text")
     cached_document_id = data.get("cached_document_id")
+    document_text = await get_document_content(cached_document_id) if cached_document_id else None
     
     # Проверяем, является ли это обходом одной страницы
     is_single_page = data.get("is_single_page", False)
@@ -882,7 +1285,7 @@ async def process_summary_button(callback_query: types.CallbackQuery, state: FSM
     
     # Если есть ID кэшированного документа, проверяем кэш конспектов
     if cached_document_id:
-        cached_summary = get_cached_summary(cached_document_id, is_single_page=is_single_page)
+        cached_summary = await get_cached_summary(cached_document_id, is_single_page=is_single_page)
         if cached_summary:
             logger.info(f"Using cached summary for document {cached_document_id} (single_page: {is_single_page})")
             
@@ -918,7 +1321,7 @@ async def process_summary_button(callback_query: types.CallbackQuery, state: FSM
         if ai_response and not ai_response.startswith("Ошибка при получении ответа"):
             # Если есть ID кэшированного документа, сохраняем конспект в кэш
             if cached_document_id:
-                cache_summary(cached_document_id, ai_response, is_single_page=is_single_page)
+                await cache_summary(cached_document_id, ai_response, is_single_page=is_single_page)
                 logger.info(f"Cached summary for document {cached_document_id} (single_page: {is_single_page})")
             
             # Обновляем сообщение о загрузке
@@ -982,7 +1385,8 @@ async def handle_ai_chat_message(message: Message, state: FSMContext):
     messages = await get_session_messages(session_id)
     
     # Формируем системный промпт с текстом документа
-    system_prompt = AI_SYSTEM_PROMPT_TEMPLATE.format(document_text=session.document_text)
+    document_text = await get_blob_text(session.document_hash)
+    system_prompt = AI_SYSTEM_PROMPT_TEMPLATE.format(document_text=document_text)
     
     # Отправляем индикатор набора текста
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
@@ -1097,21 +1501,18 @@ async def process_single_page_crawl(callback_query: types.CallbackQuery, state:
     parsed_url = urlparse(url)
     
     # Проверяем кэш для этого URL (с флагом is_single_page=True)
-    cached_doc = get_cached_document(url, is_single_page=True)
+    cached_doc = await get_cached_document(url, is_single_page=True, max_age=datetime.timedelta(hours=DOCUMENT_CACHE_TTL_HOURS))
     
     # Если документ найден в кэше
     if cached_doc:
         logger.info(f"Using cached document for URL {url} (single page)")
         
-        # Сохраняем текст документа в состоянии с флагом одиночной страницы
+        # Сохраняем ID документа в состоянии с флагом одиночной страницы (текст хранится в кэше)
         await state.update_data(
-            document_text=cached_doc["content"], 
             cached_document_id=cached_doc["id"],
             is_single_page=True
         )
         
-        # Создаем файл в памяти
-        file_content = io.BytesIO(cached_doc["content"].encode('utf-8', errors='ignore'))
         filename_base = parsed_url.netloc or "scraped_page"
         filename = "".join(c if c.isalnum() or c in ('-', '_', '.') else '_' for c in filename_base) + "_single_cached.txt"
         
@@ -1121,25 +1522,31 @@ async def process_single_page_crawl(callback_query: types.CallbackQuery, state:
             [InlineKeyboardButton(text="📝 Получить конспект документа", callback_data="get_summary")]
         ])
         
-        input_file = BufferedInputFile(file_content.getvalue(), filename=filename)
-        
-        # Отправляем результат с пометкой о кэше
-        result_caption = (
-            f"📄 <b>Текст со страницы:</b> <code>{url}</code>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"✅ Обработано страниц: <b>1</b>\n"
-            f"📦 Размер данных: <b>{len(cached_doc['content']) // 1024} Кб</b>\n"
-            f"🔄 <i>Данные получены из кэша</i>\n\n"
-            f"👇 <b>Выберите действие:</b>"
-        )
-        
-        await callback_query.message.answer_document(
-            input_file,
-            caption=result_caption,
-            reply_markup=inline_kb,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True
-        )
+        # Документ распаковывается из кэша во временный файл по частям и отправляется потоком, как после обхода
+        document = await CrawlDocument.from_writer(lambda file: read_blob_into(cached_doc["content_hash"], file),
+                                                   cached_doc["pages_processed"])
+        try:
+            input_file = document.as_input_file(filename)
+            
+            # Отправляем результат с пометкой о кэше
+            result_caption = (
+                f"📄 <b>Текст со страницы:</b> <code>{url}</code>\n\n"
+                f"📊 <b>Статистика:</b>\n"
+                f"✅ Обработано страниц: <b>1</b>\n"
+                f"📦 Размер данных: <b>{document.size // 1024} Кб</b>\n"
+                f"🔄 <i>Данные получены из кэша</i>\n\n"
+                f"👇 <b>Выберите действие:</b>"
+            )
+            
+            await callback_query.message.answer_document(
+                input_file,
+                caption=result_caption,
+                reply_markup=inline_kb,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True
+            )
+        finally:
+            document.close()
         
         logger.info(f"Sent cached single page content for {url} to user {user_id}")
         return
@@ -1154,30 +1561,21 @@ async def process_single_page_crawl(callback_query: types.CallbackQuery, state:
     )
     status_message = await callback_query.message.answer(start_message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
     
+    document = None
     try:
-        # Используем функцию crawl_website с max_pages=1 для обработки только одной страницы
-        scraped_text, pages_count = await crawl_website(url, max_pages=1, status_message=status_message)
-
-        if scraped_text.startswith("Error:"):
-            await status_message.edit_text(scraped_text, disable_web_page_preview=True)
-            return
+        # Обход одной страницы идет через приоритетную очередь, документ сохраняется в кэш внутри задачи
+        document, pages_count, document_id = await run_crawl_job(user_id, url, max_pages=1, status_message=status_message)
         
-        if not scraped_text.strip() or pages_count == 0:
+        if pages_count == 0:
             await status_message.edit_text("Не удалось найти текстовый контент на указанной странице.", disable_web_page_preview=True)
             return
         
-        # Сохраняем документ в кэш
-        document_id = cache_document(url, scraped_text, pages_count, is_single_page=True)
-        
-        # Сохраняем текст документа и ID в состоянии с флагом одиночной страницы
+        # Сохраняем ID документа в состоянии с флагом одиночной страницы
         await state.update_data(
-            document_text=scraped_text, 
             cached_document_id=document_id,
             is_single_page=True
         )
         
-        # Создаем файл в памяти
-        file_content = io.BytesIO(scraped_text.encode('utf-8', errors='ignore'))
         filename_base = parsed_url.netloc or "scraped_page"
         filename = "".join(c if c.isalnum() or c in ('-', '_', '.') else '_' for c in filename_base) + "_single.txt"
         
@@ -1187,14 +1585,15 @@ async def process_single_page_crawl(callback_query: types.CallbackQuery, state:
             [InlineKeyboardButton(text="📝 Получить конспект документа", callback_data="get_summary")]
         ])
         
-        input_file = BufferedInputFile(file_content.getvalue(), filename=filename)
+        # Файл отправляется потоком из документа
+        input_file = document.as_input_file(filename)
         
         # Отправляем результат
         result_caption = (
             f"📄 <b>Текст со страницы:</b> <code>{url}</code>\n\n"
             f"📊 <b>Статистика обработки:</b>\n"
             f"✅ Обработано страниц: <b>1</b>\n"
-            f"📦 Размер данных: <b>{len(scraped_text) // 1024} Кб</b>\n\n"
+            f"📦 Размер данных: <b>{document.size // 1024} Кб</b>\n\n"
             f"👇 <b>Выберите действие:</b>"
         )
         
@@ -1211,9 +1610,14 @@ async def process_single_page_crawl(callback_query: types.CallbackQuery, state:
         
         logger.info(f"Sent single page content for {url} to user {user_id}")
         
+    except ValueError as e:
+        await status_message.edit_text(str(e), disable_web_page_preview=True)
     except Exception as e:
         logger.exception(f"Error processing single page crawl for URL {url} from user {user_id}: {e}")
         await status_message.edit_text(f"❌ Произошла непредвиденная ошибка при обработке вашего запроса: {e}", disable_web_page_preview=True)
+    finally:
+        if document:
+            document.close()
 
 
 @dp.callback_query(lambda c: c.data == 'crawl_full')
@@ -1235,21 +1639,18 @@ async def process_full_crawl(callback_query: types.CallbackQuery, state: FSMCont
     parsed_initial_url = urlparse(url)
     
     # Проверяем кэш для этого URL (с флагом is_single_page=False)
-    cached_doc = get_cached_document(url, is_single_page=False)
+    cached_doc = await get_cached_document(url, is_single_page=False, max_age=datetime.timedelta(hours=DOCUMENT_CACHE_TTL_HOURS))
     
     # Если документ найден в кэше
     if cached_doc:
         logger.info(f"Using cached document for URL {url} (full crawl)")
         
-        # Сохраняем текст документа в состоянии с флагом полного обхода
+        # Сохраняем ID документа в состоянии с флагом полного обхода (текст хранится в кэше)
         await state.update_data(
-            document_text=cached_doc["content"], 
             cached_document_id=cached_doc["id"],
             is_single_page=False
         )
         
-        # Создаем файл в памяти
-        file_content = io.BytesIO(cached_doc["content"].encode('utf-8', errors='ignore'))
         filename_base = parsed_initial_url.netloc or "scraped_site"
         filename = "".join(c if c.isalnum() or c in ('-', '_', '.') else '_' for c in filename_base) + "_full_cached.txt"
         
@@ -1259,25 +1660,31 @@ async def process_full_crawl(callback_query: types.CallbackQuery, state: FSMCont
             [InlineKeyboardButton(text="📝 Получить конспект документа", callback_data="get_summary")]
         ])
         
-        input_file = BufferedInputFile(file_content.getvalue(), filename=filename)
-        
-        # Отправляем результат с пометкой о кэше
-        result_caption = (
-            f"📄 <b>Текст со страниц сайта:</b> <code>{parsed_initial_url.netloc}</code>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"✅ Обработано страниц: <b>{cached_doc['pages_processed']}</b>\n"
-            f"📦 Размер данных: <b>{len(cached_doc['content']) // 1024} Кб</b>\n"
-            f"🔄 <i>Данные получены из кэша</i>\n\n"
-            f"👇 <b>Выберите действие:</b>"
-        )
-        
-        await callback_query.message.answer_document(
-            input_file,
-            caption=result_caption,
-            reply_markup=inline_kb,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True
-        )
+        # Документ распаковывается из кэша во временный файл по частям и отправляется потоком, как после обхода
+        document = await CrawlDocument.from_writer(lambda file: read_blob_into(cached_doc["content_hash"], file),
+                                                   cached_doc["pages_processed"])
+        try:
+            input_file = document.as_input_file(filename)
+            
+            # Отправляем результат с пометкой о кэше
+            result_caption = (
+                f"📄 <b>Текст со страниц сайта:</b> <code>{parsed_initial_url.netloc}</code>\n\n"
+                f"📊 <b>Статистика:</b>\n"
+                f"✅ Обработано страниц: <b>{cached_doc['pages_processed']}</b>\n"
+                f"📦 Размер данных: <b>{document.size // 1024} Кб</b>\n"
+                f"🔄 <i>Данные получены из кэша</i>\n\n"
+                f"👇 <b>Выберите действие:</b>"
+            )
+            
+            await callback_query.message.answer_document(
+                input_file,
+                caption=result_caption,
+                reply_markup=inline_kb,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True
+            )
+        finally:
+            document.close()
         
         logger.info(f"Sent cached full crawl content for {url} to user {user_id}")
         return
@@ -1293,29 +1700,21 @@ async def process_full_crawl(callback_query: types.CallbackQuery, state: FSMCont
     )
     status_message = await callback_query.message.answer(start_message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+    document = None
     try:
-        scraped_text, pages_count = await crawl_website(url, max_pages=1000, status_message=status_message)
+        # Обход идет через общую очередь, документ сохраняется в кэш внутри задачи
+        document, pages_count, document_id = await run_crawl_job(user_id, url, max_pages=1000, status_message=status_message)
 
-        if scraped_text.startswith("Error:"):
-             await status_message.edit_text(scraped_text, disable_web_page_preview=True)
-             return
-
-        if not scraped_text.strip() or pages_count == 0:
+        if pages_count == 0:
             await status_message.edit_text("Не удалось найти текстовый контент или доступные страницы для обхода.", disable_web_page_preview=True)
             return
-
-        # Сохраняем документ в кэш
-        document_id = cache_document(url, scraped_text, pages_count, is_single_page=False)
         
-        # Сохраняем текст документа и ID в состоянии с флагом полного обхода
+        # Сохраняем ID документа в состоянии с флагом полного обхода
         await state.update_data(
-            document_text=scraped_text, 
             cached_document_id=document_id,
             is_single_page=False
         )
 
-        # Create a file in memory
-        file_content = io.BytesIO(scraped_text.encode('utf-8', errors='ignore'))
         # Sanitize filename
         filename_base = parsed_initial_url.netloc or "scraped_site"
         filename = "".join(c if c.isalnum() or c in ('-', '_', '.') else '_' for c in filename_base) + "_full.txt"
@@ -1326,14 +1725,15 @@ async def process_full_crawl(callback_query: types.CallbackQuery, state: FSMCont
             [InlineKeyboardButton(text="📝 Получить конспект документа", callback_data="get_summary")]
         ])
 
-        input_file = BufferedInputFile(file_content.getvalue(), filename=filename)
+        # Stream the file from the document
+        input_file = document.as_input_file(filename)
 
         # Отправляем сообщение с результатами
         result_caption = (
             f"📄 <b>Текст со страниц сайта:</b> <code>{parsed_initial_url.netloc}</code>\n\n"
             f"📊 <b>Статистика обработки:</b>\n"
             f"✅ Обработано страниц: <b>{pages_count}</b>\n"
-            f"📦 Размер данных: <b>{len(scraped_text) // 1024} Кб</b>\n\n"
+            f"📦 Размер данных: <b>{document.size // 1024} Кб</b>\n\n"
             f"👇 <b>Выберите действие:</b>"
         )
 
@@ -1350,9 +1750,14 @@ async def process_full_crawl(callback_query: types.CallbackQuery, state: FSMCont
         
         logger.info(f"Sent crawled content for {url} ({pages_count} pages) to user {user_id}")
 
+    except ValueError as e:
+        await status_message.edit_text(str(e), disable_web_page_preview=True)
     except Exception as e:
         logger.exception(f"Error handling full crawl for URL {url} from user {user_id}: {e}")
         await status_message.edit_text(f"❌ Произошла непредвиденная ошибка при обработке вашего запроса: {e}", disable_web_page_preview=True)
+    finally:
+        if document:
+            document.close()
 
 @dp.message(Command("cleanup_cache"))
 async def clear_cache_command(message: Message):
@@ -1367,7 +1772,7 @@ async def clear_cache_command(message: Message):
     
     try:
         # Удаляем старые записи кэша (старше 30 дней)
-        removed_count = cleanup_old_cache(days_threshold=30)
+        removed_count = await cleanup_old_cache(days_threshold=30)
         
         # Отправляем информацию о результате очистки
         await message.answer(
@@ -1393,7 +1798,7 @@ async def cache_stats_command(message: Message):
     
     try:
         # Получаем статистику кэша
-        stats = cache_stats()
+        stats = await cache_stats()
         
         # Если в кэше есть записи, показываем подробную статистику
         if stats["docs_count"] > 0:
@@ -1402,23 +1807,34 @@ async def cache_stats_command(message: Message):
                 f"📊 <b>Статистика кэша:</b>\n\n"
                 f"📑 <b>Документы:</b>\n"
                 f"- Всего документов: <b>{stats['docs_count']}</b>\n"
-                f"  • Одиночных страниц: <b>{stats['single_page_docs']}</b>\n"
-                f"  • Полных обходов: <b>{stats['full_crawl_docs']}</b>\n"
+                f"  • Одиночных страниц: <b>{stats['single_page_docs']}</b> ({stats['single_page_docs_kb']:.0f} Кб)\n"
+                f"  • Полных обходов: <b>{stats['full_crawl_docs']}</b> ({stats['full_crawl_docs_kb']:.0f} Кб)\n"
                 f"- Всего конспектов: <b>{stats['summaries_count']}</b>\n"
                 f"  • Для одиночных страниц: <b>{stats['single_page_summaries']}</b>\n"
                 f"  • Для полных обходов: <b>{stats['full_crawl_summaries']}</b>\n"
-                f"- Средний размер документа: <b>{stats['avg_doc_size_kb']:.1f} Кб</b>\n\n"
+                f"- Средний размер документа: <b>{stats['avg_doc_size_kb']:.1f} Кб</b>\n"
+                f"- Хранилище текстов: <b>{stats['blobs_count']}</b> шт., <b>{stats['blobs_stored_kb']:.1f} Кб</b> "
+                f"(сэкономлено <b>{stats['blobs_saved_kb']:.1f} Кб</b>)\n\n"
+                f"🗂 <b>Кэш страниц:</b>\n"
+                f"- Сохранено страниц: <b>{stats['pages_count']}</b>\n"
+                f"- Взято из кэша без запроса: <b>{stats['page_cache_hits']}</b>\n"
+                f"- Подтверждено без изменений: <b>{stats['page_cache_revalidated']}</b>\n"
+                f"- Загружено заново: <b>{stats['page_cache_misses']}</b>\n"
+                f"- Доля повторных использований: <b>{stats['page_hit_ratio']:.0%}</b>\n\n"
             )
             
             # Добавляем информацию о самых популярных документах, если они есть
-            if stats["most_popular_doc"]:
-                stats_text += (
-                    f"🔍 <b>Самый популярный документ:</b>\n"
-                    f"- URL: <code>{stats['most_popular_doc'].url[:50]}...</code>\n"
-                    f"- Просмотров: <b>{stats['most_popular_doc'].access_count}</b>\n"
-                    f"- Тип: <b>{'Одиночная страница' if stats['most_popular_doc'].is_single_page else 'Полный обход'}</b>\n"
-                    f"- Размер: <b>{len(stats['most_popular_doc'].content) // 1024} Кб</b>\n\n"
-                )
+            if stats["top_documents"]:
+                stats_text += f"🔍 <b>Самые популярные документы:</b>\n"
+                for position, entry in enumerate(stats["top_documents"], 1):
+                    document = entry["document"]
+                    stats_text += (
+                        f"{position}. <code>{document.url[:50]}...</code>\n"
+                        f"   Просмотров: <b>{document.access_count}</b>, "
+                        f"{'одиночная страница' if document.is_single_page else 'полный обход'}, "
+                        f"<b>{entry['size_kb']:.0f} Кб</b>\n"
+                    )
+                stats_text += "\n"
             
             # Добавляем информацию о популярной одиночной странице, если есть
             if stats["most_popular_page"]:
@@ -1459,7 +1875,7 @@ async def cache_stats_command(message: Message):
 async def main() -> None:
     """Initializes and starts the bot."""
     # Initialize database
-    init_db()
+    await init_db()
 
     # Initialize Bot with default session settings.
     # No custom session or SSL context passed.
@@ -1468,8 +1884,17 @@ async def main() -> None:
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
 
+    # Общий пул HTTP-соединений для обхода сайтов
+    await http_client.start()
+
     # Run bot polling using default session management.
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await crawl_scheduler.close()
+        await http_client.close()
+        parse_executor.shutdown()
+        await close_db()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+import time
+import logging
+from config import FETCH_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Класс для быстрого отказа в запросах к недоступным хостам.
+
+    После failure_threshold ошибок подряд хост считается недоступным
+    (цепь разомкнута), и запросы к нему сразу отклоняются. Через
+    reset_timeout секунд пропускается один пробный запрос: успех
+    замыкает цепь, ошибка снова размыкает ее на reset_timeout.
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # Состояние хостов с ошибками {host: {"failures": int, "opened_at": float | None, "last_failure": float}}
+        self._hosts = {}
+
+        # Счетчики срабатываний
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self, host):
+        """Проверяет, можно ли выполнить запрос к хосту."""
+        state = self._hosts.get(host)
+        if state is None or state["opened_at"] is None:
+            return True
+
+        current_time = time.monotonic()
+        if current_time - state["opened_at"] >= self.reset_timeout:
+            # Пропускаем один пробный запрос, остальные ждут следующего интервала
+            state["opened_at"] = current_time
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self, host):
+        """Хост ответил: сбрасываем счетчик ошибок и замыкаем цепь."""
+        state = self._hosts.pop(host, None)
+        if state and state["opened_at"] is not None:
+            logger.info(f"Circuit closed for {host}")
+
+    def record_failure(self, host):
+        """Хост не ответил или вернул ошибку сервера."""
+        current_time = time.monotonic()
+
+        # Удаляем давно не ошибавшиеся хосты, чтобы словарь не рос бесконечно
+        for stale_host in [h for h, s in self._hosts.items()
+                           if s["opened_at"] is None and current_time - s["last_failure"] > self.reset_timeout]:
+            del self._hosts[stale_host]
+
+        state = self._hosts.setdefault(host, {"failures": 0, "opened_at": None, "last_failure": current_time})
+        state["failures"] += 1
+        state["last_failure"] = current_time
+
+        if state["opened_at"] is not None:
+            # Пробный запрос (или запрос, начатый до размыкания) не удался - ждем еще один интервал
+            state["opened_at"] = current_time
+        elif state["failures"] >= self.failure_threshold:
+            state["opened_at"] = current_time
+            self.opened += 1
+            logger.warning(f"Circuit opened for {host} after {state['failures']} consecutive failures")
+
+    def get_stats(self):
+        """Возвращает статистику срабатываний."""
+        return {
+            "open_hosts": sum(1 for s in self._hosts.values() if s["opened_at"] is not None),
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+# Глобальный экземпляр для всех обходов
+circuit_breaker = CircuitBreaker(
+    failure_threshold=FETCH_SETTINGS["breaker_failures"],
+    reset_timeout=FETCH_SETTINGS["breaker_reset_seconds"]
+)
@@ -0,0 +1,78 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Причины остановки обхода по исчерпанию лимита
+BUDGET_PAGES = "pages"
+BUDGET_TIME = "time"
+BUDGET_DOWNLOAD = "download"
+BUDGET_TEXT = "text"
+
+class CrawlBudget:
+    """
+    Лимиты одного обхода: страницы, время, загруженные байты и объем текста.
+
+    Обход проверяет лимиты перед выдачей каждой следующей страницы. После
+    исчерпания любого из них новые страницы не выдаются, уже начатые
+    дорабатываются, и пользователь получает частичный документ. Загрузка
+    начатых страниц (с повторами) ограничена оставшимся временем, поэтому
+    лимит времени не превышается на время их загрузки. Лимит со значением
+    None не проверяется.
+    """
+    def __init__(self, max_pages, max_seconds=None, max_download_bytes=None, max_text_bytes=None):
+        self.max_pages = max_pages
+        self.max_seconds = max_seconds
+        self.max_download_bytes = max_download_bytes
+        self.max_text_bytes = max_text_bytes
+
+        self.started = time.monotonic()
+        self.downloaded_bytes = 0
+        self.text_bytes = 0
+
+        # Первый исчерпанный лимит (причина остановки)
+        self.exhausted = None
+
+    def add_download(self, size):
+        """Учитывает загруженные с сайта байты (вместе с повторными попытками)."""
+        self.downloaded_bytes += size
+
+    def add_text(self, text):
+        """Учитывает текст страницы, добавленный в документ."""
+        self.text_bytes += len(text.encode('utf-8', errors='ignore'))
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def remaining_seconds(self):
+        """Сколько секунд осталось до исчерпания лимита времени (None - без ограничения)."""
+        if self.max_seconds is None:
+            return None
+        return max(self.max_seconds - self.elapsed, 0)
+
+    def check(self, pages_processed):
+        """
+        Проверяет лимиты перед обработкой следующей страницы.
+
+        Returns:
+            str | None: Исчерпанный лимит (BUDGET_*) или None
+        """
+        if self.exhausted:
+            return self.exhausted
+
+        if pages_processed >= self.max_pages:
+            self.exhausted = BUDGET_PAGES
+        elif self.max_seconds is not None and self.elapsed >= self.max_seconds:
+            self.exhausted = BUDGET_TIME
+        elif self.max_download_bytes is not None and self.downloaded_bytes >= self.max_download_bytes:
+            self.exhausted = BUDGET_DOWNLOAD
+        elif self.max_text_bytes is not None and self.text_bytes >= self.max_text_bytes:
+            self.exhausted = BUDGET_TEXT
+
+        if self.exhausted and self.exhausted != BUDGET_PAGES:
+            logger.info(f"Crawl budget '{self.exhausted}' exhausted after {pages_processed} pages, "
+                        f"{self.elapsed:.0f}s, {self.downloaded_bytes // 1024} KB downloaded, "
+                        f"{self.text_bytes // 1024} KB of text")
+        return self.exhausted
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from collections import deque
+from config import CRAWL_SCHEDULER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class CrawlJob:
+    """Задача обхода в планировщике и все пользователи, ожидающие ее результат."""
+    def __init__(self, key, user_id, priority, factory, share_result):
+        self.key = key
+        self.user_id = user_id
+        self.priority = priority
+        self.factory = factory
+        self.share_result = share_result
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 1
+
+class CrawlScheduler:
+    """
+    Класс для планирования обходов сайтов всех пользователей.
+
+    Ограничивает общее число одновременных обходов и число обходов одного
+    пользователя, выбирает задачи из очереди по кругу между пользователями.
+    Быстрые задачи (одна страница) идут по приоритетной очереди и имеют
+    отдельные слоты, поэтому не ждут окончания больших обходов.
+    Одинаковые задачи, уже стоящие в очереди или выполняющиеся, не
+    запускаются повторно: новые пользователи ждут общий результат.
+    """
+    def __init__(self, max_jobs, priority_slots, max_jobs_per_user):
+        # Обычным задачам остаются слоты сверх приоритетных; если их нет, полные обходы никогда не запустятся
+        if priority_slots >= max_jobs:
+            raise ValueError(f"priority_slots ({priority_slots}) must be less than max_jobs ({max_jobs})")
+
+        self.max_jobs = max_jobs
+        self.priority_slots = priority_slots
+        self.max_jobs_per_user = max_jobs_per_user
+
+        # Задачи в очереди или в работе {key: CrawlJob}
+        self._jobs = {}
+
+        # Очереди по приоритету {priority: {user_id: deque[CrawlJob]}}, пользователи в порядке обслуживания
+        self._queues = {True: {}, False: {}}
+
+        # Выполняющиеся задачи: всего, по приоритету и по пользователям {(user_id, priority): count}
+        self._running = 0
+        self._running_by_priority = {True: 0, False: 0}
+        self._running_by_user = {}
+        self._tasks = set()
+
+        # После начала остановки новые задачи не запускаются
+        self._closing = False
+
+        # Счетчики задач
+        self.started = 0
+        self.coalesced = 0
+
+    def has_job(self, key):
+        """Проверяет, есть ли такая задача в очереди или в работе."""
+        return key in self._jobs
+
+    async def run(self, user_id, key, factory, priority=False, share_result=None):
+        """
+        Выполняет задачу через планировщик и возвращает ее результат.
+
+        Args:
+            user_id: ID пользователя, запросившего обход
+            key: Ключ задачи; задачи с одинаковым ключом выполняются один раз
+            factory: Функция без аргументов, возвращающая корутину обхода
+            priority: True для быстрых задач (приоритетная очередь)
+            share_result: Функция (result, waiters), вызываемая перед выдачей результата,
+                          если его нужно подготовить для нескольких пользователей
+                          (waiters = 0, если все пользователи отменили ожидание)
+        """
+        if self._closing:
+            raise asyncio.CancelledError()
+
+        job = self._jobs.get(key)
+        if job is not None:
+            job.waiters += 1
+            self.coalesced += 1
+            logger.info(f"Crawl job {key} requested by user {user_id} joined the job of user {job.user_id}")
+        else:
+            job = CrawlJob(key, user_id, priority, factory, share_result)
+            self._jobs[key] = job
+            self._queues[priority].setdefault(user_id, deque()).append(job)
+            self._dispatch()
+
+        # Отмена ожидания одним пользователем не отменяет задачу для остальных
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Отменивший ожидание пользователь результат не получит и не должен учитываться в share_result
+            if not job.future.done():
+                job.waiters -= 1
+            raise
+
+    def _next_job(self):
+        """Выбирает следующую задачу: сначала приоритетную, пользователей обслуживает по кругу."""
+        if self._running >= self.max_jobs:
+            return None
+
+        for priority in (True, False):
+            # Обычные задачи не занимают слоты, зарезервированные под приоритетные
+            if not priority and self._running_by_priority[False] >= self.max_jobs - self.priority_slots:
+                continue
+
+            queue = self._queues[priority]
+            for user_id in list(queue):
+                if self._running_by_user.get((user_id, priority), 0) >= self.max_jobs_per_user:
+                    continue
+
+                # Пользователь уходит в конец очереди, чтобы следующей стала задача другого пользователя
+                user_jobs = queue.pop(user_id)
+                job = user_jobs.popleft()
+                if user_jobs:
+                    queue[user_id] = user_jobs
+                return job
+
+        return None
+
+    def _dispatch(self):
+        """Запускает задачи из очереди, пока есть свободные слоты."""
+        if self._closing:
+            return
+
+        while (job := self._next_job()) is not None:
+            user_slot = (job.user_id, job.priority)
+            self._running += 1
+            self._running_by_priority[job.priority] += 1
+            self._running_by_user[user_slot] = self._running_by_user.get(user_slot, 0) + 1
+            self.started += 1
+
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job):
+        """Выполняет задачу и передает результат всем ожидающим пользователям."""
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            self._jobs.pop(job.key, None)
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self._jobs.pop(job.key, None)
+            job.future.set_exception(e)
+        else:
+            # После удаления из словаря к задаче никто не присоединится, число ожидающих окончательное
+            self._jobs.pop(job.key, None)
+            if job.share_result:
+                job.share_result(result, job.waiters)
+            job.future.set_result(result)
+        finally:
+            user_slot = (job.user_id, job.priority)
+            self._running -= 1
+            self._running_by_priority[job.priority] -= 1
+            self._running_by_user[user_slot] -= 1
+            if self._running_by_user[user_slot] == 0:
+                del self._running_by_user[user_slot]
+            self._dispatch()
+
+    async def close(self):
+        """Отменяет задачи в очереди и выполняющиеся задачи (вызывается при остановке бота)."""
+        self._closing = True
+
+        # Задачи из очереди уже не запустятся: ожидающие их пользователи получают отмену
+        for queue in self._queues.values():
+            for user_jobs in queue.values():
+                for job in user_jobs:
+                    self._jobs.pop(job.key, None)
+                    job.future.cancel()
+            queue.clear()
+
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self):
+        """Возвращает текущую загрузку планировщика."""
+        return {
+            "running": self._running,
+            "queued": sum(len(jobs) for queue in self._queues.values() for jobs in queue.values()),
+            "max_jobs": self.max_jobs,
+            "started": self.started,
+            "coalesced": self.coalesced
+        }
+
+# Глобальный планировщик обходов
+crawl_scheduler = CrawlScheduler(
+    max_jobs=CRAWL_SCHEDULER_SETTINGS["max_jobs"],
+    priority_slots=CRAWL_SCHEDULER_SETTINGS["priority_slots"],
+    max_jobs_per_user=CRAWL_SCHEDULER_SETTINGS["max_jobs_per_user"]
+)
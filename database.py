@@ -1,8 +1,19 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, create_engine, func
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index, LargeBinary, bindparam, event, func, inspect, select, delete, update, text as sql_text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship
+from contextlib import asynccontextmanager
+import asyncio
 import datetime
 import hashlib
+import json
+import logging
+import zlib
+from config import DATABASE_SETTINGS
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -20,7 +31,8 @@ class AISession(Base):
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    document_text = Column(Text, nullable=False)
+    document_text = Column(Text, nullable=False, default="")  # Устаревшее поле: текст документа теперь в blobs
+    document_hash = Column(String(64), ForeignKey('blobs.hash'), index=True)  # Текст документа сессии в хранилище blobs
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     last_activity = Column(DateTime, default=datetime.datetime.utcnow)
     is_active = Column(Boolean, default=True)
@@ -40,21 +52,41 @@ class Message(Base):
     
     session = relationship("AISession", back_populates="messages")
 
+class Blob(Base):
+    """Сжатый текст, адресуемый по хешу: одинаковые тексты документов и сессий хранятся один раз"""
+    __tablename__ = 'blobs'
+    
+    hash = Column(String(64), primary_key=True)  # SHA-256 несжатого текста в UTF-8
+    codec = Column(String(16), nullable=False)  # Способ сжатия данных
+    size = Column(Integer, nullable=False)  # Размер несжатого текста в байтах
+    data = Column(LargeBinary, nullable=False)
+
+class CacheStat(Base):
+    """Счетчик статистики кэша, который обновляется вместе с изменением данных (см. update_cache_stats)"""
+    __tablename__ = 'cache_stats'
+    
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
 class CachedDocument(Base):
     __tablename__ = 'cached_documents'
     
     id = Column(Integer, primary_key=True)
     url = Column(String(1024), nullable=False, index=True)
     url_hash = Column(String(64), nullable=False, unique=True, index=True)  # SHA-256 хеш URL для быстрого поиска
-    content = Column(Text, nullable=False)  # Сохраненный текст документа
+    content = Column(Text, nullable=False, default="")  # Устаревшее поле: текст документа теперь в blobs
+    content_hash = Column(String(64), ForeignKey('blobs.hash'), index=True)  # Текст документа в хранилище blobs
     pages_processed = Column(Integer, default=0)  # Количество обработанных страниц
     is_single_page = Column(Boolean, default=False)  # Флаг одиночной страницы или полного обхода
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     last_accessed = Column(DateTime, default=datetime.datetime.utcnow)
     access_count = Column(Integer, default=1)  # Счетчик использования кеша
     
     # Отношение один-к-многим с конспектами
     summaries = relationship("CachedSummary", back_populates="document", cascade="all, delete-orphan")
+    
+    # Самые популярные документы каждого типа выбираются по индексу, без просмотра таблицы
+    __table_args__ = (Index('ix_cached_documents_popularity', 'is_single_page', 'access_count'),)
 
 class CachedSummary(Base):
     __tablename__ = 'cached_summaries'
@@ -70,252 +102,745 @@ class CachedSummary(Base):
     # Отношение многие-к-одному с документом
     document = relationship("CachedDocument", back_populates="summaries")
 
-# Создание соединения с БД и сессии
-DATABASE_URL = "sqlite:///ai_chat_sessions.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class CachedPage(Base):
+    __tablename__ = 'cached_pages'
+    
+    id = Column(Integer, primary_key=True)
+    url = Column(String(2048), nullable=False)
+    url_hash = Column(String(64), nullable=False, unique=True, index=True)  # SHA-256 хеш канонического URL
+    etag = Column(String(512), nullable=True)  # Заголовок ETag последнего ответа
+    last_modified = Column(String(128), nullable=True)  # Заголовок Last-Modified последнего ответа
+    content_hash = Column(String(64), nullable=False)  # SHA-256 хеш HTML страницы
+    title = Column(String(1024), nullable=False)  # Заголовок страницы
+    text = Column(Text, nullable=False)  # Извлеченный текст страницы
+    links = Column(Text, nullable=False)  # Ссылки страницы в формате JSON
+    fetched_at = Column(DateTime, default=datetime.datetime.utcnow)  # Когда содержимое последний раз менялось
+    checked_at = Column(DateTime, default=datetime.datetime.utcnow)  # Когда страница последний раз проверялась
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+class CrawlCheckpoint(Base):
+    __tablename__ = 'crawl_checkpoints'
+    
+    id = Column(Integer, primary_key=True)
+    start_url = Column(String(2048), nullable=False)
+    job_hash = Column(String(64), nullable=False, unique=True, index=True)  # SHA-256 хеш стартового URL и лимита страниц
+    max_pages = Column(Integer, nullable=False)
+    pages_processed = Column(Integer, default=0)
+    state = Column(Text, nullable=False)  # Очередь, встреченные URL и готовые страницы в формате JSON
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Создание соединения с БД и сессии. Драйвер aiosqlite выполняет запросы SQLite в отдельном
+# потоке, поэтому обращения к БД не блокируют цикл событий (и обработчики других пользователей)
+DATABASE_URL = "sqlite+aiosqlite:///ai_chat_sessions.db"
+# Пул задан явно: число соединений ограничено, а занятое соединение возвращается в пул
+# при выходе из session_scope
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DATABASE_SETTINGS["pool_size"],
+    max_overflow=DATABASE_SETTINGS["max_overflow"],
+    pool_timeout=DATABASE_SETTINGS["pool_timeout"],
+    pool_recycle=DATABASE_SETTINGS["pool_recycle"],
+)
+# После commit объекты не перечитываются: их атрибуты нужны и после закрытия сессии
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настраивает каждое новое соединение SQLite (WAL, синхронизация, mmap, кэш страниц)"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DATABASE_SETTINGS['journal_mode']}")
+    cursor.execute(f"PRAGMA synchronous={DATABASE_SETTINGS['synchronous']}")
+    cursor.execute(f"PRAGMA mmap_size={DATABASE_SETTINGS['mmap_size_mb'] * 1024 * 1024}")
+    # Отрицательное значение cache_size задает размер кэша в КиБ, а не в страницах
+    cursor.execute(f"PRAGMA cache_size=-{DATABASE_SETTINGS['cache_size_mb'] * 1024}")
+    cursor.execute(f"PRAGMA busy_timeout={DATABASE_SETTINGS['busy_timeout_ms']}")
+    cursor.close()
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate_texts_to_blobs)
+        await conn.run_sync(_create_missing_indexes)
+    
+    # Счетчики статистики пересчитываются полностью только для БД, где их еще нет
+    async with session_scope() as db:
+        if not await db.scalar(select(func.count()).select_from(CacheStat)):
+            await rebuild_cache_stats(db)
+    access_stats.start()
+
+def _create_missing_indexes(conn):
+    """Создает индексы, добавленные в модели после создания таблиц (create_all их не добавляет)"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def _migrate_texts_to_blobs(conn):
+    """
+    Переносит тексты документов и сессий из БД прежней версии в хранилище blobs.
+
+    Добавляет недостающие столбцы со ссылкой на blob, сжимает сохраненные тексты
+    и очищает старые столбцы. Выполняется в потоке драйвера при запуске бота.
+    """
+    migrated = 0
+    for table, text_column, hash_column in (("cached_documents", "content", "content_hash"),
+                                            ("ai_sessions", "document_text", "document_hash")):
+        columns = {column["name"] for column in inspect(conn).get_columns(table)}
+        if hash_column not in columns:
+            conn.execute(sql_text(f"ALTER TABLE {table} ADD COLUMN {hash_column} VARCHAR(64) REFERENCES blobs (hash)"))
+        
+        while True:
+            rows = conn.execute(sql_text(
+                f"SELECT id, {text_column} FROM {table} WHERE {hash_column} IS NULL LIMIT 100"
+            )).all()
+            if not rows:
+                break
+            for row_id, row_text in rows:
+                blob_hash, size, data = _encode_blob(row_text)
+                conn.execute(sqlite_insert(Blob).values(hash=blob_hash, codec=BLOB_CODEC, size=size, data=data)
+                             .on_conflict_do_nothing())
+                conn.execute(sql_text(f"UPDATE {table} SET {hash_column} = :hash, {text_column} = '' WHERE id = :id"),
+                             {"hash": blob_hash, "id": row_id})
+            migrated += len(rows)
+    
+    if migrated:
+        logger.info(f"Moved {migrated} stored texts to the blob store")
 
-def get_db():
+async def close_db():
+    """Записывает накопленную статистику обращений и закрывает соединения с БД (вызывается при остановке бота)"""
+    await access_stats.stop()
+    await engine.dispose()
+
+@asynccontextmanager
+async def session_scope():
+    """
+    Единица работы с БД: async with session_scope() as db.
+
+    При нормальном выходе изменения фиксируются одним commit, при исключении
+    откатываются. Сессия закрывается в любом случае, ее соединение возвращается
+    в пул, а загруженные объекты не накапливаются между запросами.
+    """
     db = SessionLocal()
     try:
-        return db
+        yield db
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
     finally:
-        db.close()
+        await db.close()
+
+class AccessStatsBuffer:
+    """
+    Класс для отложенной записи статистики обращений к кэшу.
+
+    Попадание в кэш документов или конспектов только учитывается в памяти, и чтение
+    из кэша остается чтением. Фоновая задача раз в interval секунд записывает
+    накопленные счетчики одним пакетом UPDATE на каждую таблицу, при остановке
+    бота выполняется последняя запись.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        # {модель: {id записи: [число обращений, время последнего обращения]}}
+        self._pending = {CachedDocument: {}, CachedSummary: {}}
+        self._task = None
+
+    def record(self, model, row_id):
+        """Учитывает обращение к записи кэша"""
+        entry = self._pending[model].setdefault(row_id, [0, None])
+        entry[0] += 1
+        entry[1] = datetime.datetime.now()
+
+    def start(self):
+        """Запускает фоновую задачу записи"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Couldn't flush cache access stats: {e}")
+
+    async def flush(self):
+        """Записывает накопленные счетчики в БД"""
+        pending = {model: entries for model, entries in self._pending.items() if entries}
+        if not pending:
+            return
+        self._pending = {model: {} for model in self._pending}
+
+        try:
+            async with session_scope() as db:
+                for model, entries in pending.items():
+                    table = model.__table__
+                    await db.execute(
+                        update(table)
+                        .where(table.c.id == bindparam("row_id"))
+                        .values(access_count=table.c.access_count + bindparam("hits"),
+                                last_accessed=bindparam("accessed")),
+                        [{"row_id": row_id, "hits": hits, "accessed": accessed}
+                         for row_id, (hits, accessed) in entries.items()]
+                    )
+        except Exception:
+            # Возвращаем счетчики, чтобы записать их при следующей попытке
+            for model, entries in pending.items():
+                for row_id, (hits, accessed) in entries.items():
+                    entry = self._pending[model].setdefault(row_id, [0, accessed])
+                    entry[0] += hits
+                    entry[1] = max(entry[1], accessed)
+            raise
+
+    async def stop(self):
+        """Останавливает фоновую задачу и записывает оставшиеся счетчики"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+access_stats = AccessStatsBuffer(DATABASE_SETTINGS["access_stats_flush_seconds"])
+
+# Способ сжатия новых blob. Столбец codec позволяет сменить его без переписывания старых данных
+BLOB_CODEC = "zlib"
+
+# Размер блока сжатых данных при распаковке blob в файл
+BLOB_CHUNK_SIZE = 64 * 1024
+
+def _encode_blob(blob_text):
+    """Возвращает хеш, размер и сжатые данные текста"""
+    raw = blob_text.encode('utf-8')
+    return hashlib.sha256(raw).hexdigest(), len(raw), zlib.compress(raw, DATABASE_SETTINGS["blob_compression_level"])
+
+def _decode_blob(codec, data):
+    """Распаковывает текст blob"""
+    if codec == "zlib":
+        return zlib.decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown blob codec: {codec}")
+
+def _decode_blob_into(codec, data, file):
+    """Распаковывает blob в файл по частям, не собирая весь текст в памяти"""
+    if codec == "zlib":
+        decompressor = zlib.decompressobj()
+        for offset in range(0, len(data), BLOB_CHUNK_SIZE):
+            file.write(decompressor.decompress(data[offset:offset + BLOB_CHUNK_SIZE]))
+        file.write(decompressor.flush())
+        return
+    raise ValueError(f"Unknown blob codec: {codec}")
+
+async def store_blob(db, blob_text):
+    """
+    Сохраняет текст в хранилище blobs (если такого текста еще нет) и возвращает его хеш
+    и размер несжатого текста. Хеширование и сжатие выполняются в отдельном потоке,
+    чтобы не блокировать цикл событий.
+    """
+    blob_hash, size, data = await asyncio.to_thread(_encode_blob, blob_text)
+    result = await db.execute(sqlite_insert(Blob).values(hash=blob_hash, codec=BLOB_CODEC, size=size, data=data)
+                              .on_conflict_do_nothing())
+    if result.rowcount:
+        await update_cache_stats(db, blobs=1, blob_stored_bytes=len(data))
+    return blob_hash, size
+
+async def load_blob(db, blob_hash):
+    """Возвращает распакованный текст blob или None"""
+    row = (await db.execute(select(Blob.codec, Blob.data).filter(Blob.hash == blob_hash))).first()
+    if row is None:
+        return None
+    return await asyncio.to_thread(_decode_blob, row.codec, row.data)
+
+async def get_blob_text(blob_hash):
+    """Получает текст из хранилища blobs по хешу"""
+    async with session_scope() as db:
+        return await load_blob(db, blob_hash)
+
+async def read_blob_into(blob_hash, file):
+    """
+    Записывает текст blob (в UTF-8) в файл, распаковывая его по частям в отдельном потоке.
+    Возвращает False, если blob не найден.
+    """
+    async with session_scope() as db:
+        row = (await db.execute(select(Blob.codec, Blob.data).filter(Blob.hash == blob_hash))).first()
+    if row is None:
+        return False
+    await asyncio.to_thread(_decode_blob_into, row.codec, row.data, file)
+    return True
+
+# Сколько самых популярных документов показывать в статистике кэша
+TOP_DOCUMENTS = 5
+
+# Счетчики статистики кэша (имена строк таблицы cache_stats)
+CACHE_STAT_NAMES = (
+    "docs_single", "docs_full",  # Документы одиночных страниц и полных обходов
+    "doc_bytes_single", "doc_bytes_full",  # Размер их текстов в байтах
+    "summaries_single", "summaries_full",  # Конспекты по типам обхода
+    "pages",  # Страницы в кэше страниц
+    "blobs", "blob_stored_bytes",  # Записи хранилища blobs и их сжатый размер
+    "blob_referenced_bytes"  # Сколько занимали бы несжатые копии текстов во всех документах и сессиях
+)
+
+def _doc_type(is_single_page):
+    return "single" if is_single_page else "full"
+
+async def update_cache_stats(db, **deltas):
+    """
+    Изменяет счетчики статистики кэша в той же транзакции, что и сами данные.
+    Увеличение выполняется в SQL, поэтому одновременные сессии не теряют изменений.
+    """
+    for name, delta in deltas.items():
+        if delta:
+            await db.execute(sqlite_insert(CacheStat).values(name=name, value=delta).on_conflict_do_update(
+                index_elements=[CacheStat.name], set_={"value": CacheStat.value + delta}
+            ))
+
+async def rebuild_cache_stats(db):
+    """Пересчитывает все счетчики статистики кэша по данным таблиц"""
+    values = dict.fromkeys(CACHE_STAT_NAMES, 0)
+    
+    for is_single_page, docs, doc_bytes in await db.execute(
+        select(CachedDocument.is_single_page, func.count(), func.coalesce(func.sum(Blob.size), 0))
+        .outerjoin(Blob, CachedDocument.content_hash == Blob.hash)
+        .group_by(CachedDocument.is_single_page)
+    ):
+        values[f"docs_{_doc_type(is_single_page)}"] = docs
+        values[f"doc_bytes_{_doc_type(is_single_page)}"] = doc_bytes
+    
+    for is_single_page, summaries in await db.execute(
+        select(CachedSummary.is_single_page, func.count()).group_by(CachedSummary.is_single_page)
+    ):
+        values[f"summaries_{_doc_type(is_single_page)}"] = summaries
+    
+    values["pages"] = await db.scalar(select(func.count()).select_from(CachedPage))
+    values["blobs"], values["blob_stored_bytes"] = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(func.length(Blob.data)), 0))
+    )).one()
+    session_bytes = await db.scalar(
+        select(func.coalesce(func.sum(Blob.size), 0)).select_from(AISession).join(Blob, AISession.document_hash == Blob.hash)
+    )
+    values["blob_referenced_bytes"] = values["doc_bytes_single"] + values["doc_bytes_full"] + session_bytes
+    
+    await db.execute(delete(CacheStat))
+    db.add_all(CacheStat(name=name, value=value) for name, value in values.items())
 
 def get_url_hash(url):
     """Создает уникальный хеш URL для более быстрого поиска в кэше"""
     return hashlib.sha256(url.encode('utf-8')).hexdigest()
 
-def cache_document(url, content, pages_processed, is_single_page=False):
+async def cache_document(url, content, pages_processed, is_single_page=False):
     """Сохраняет документ в кэш"""
-    db = get_db()
-    url_hash = get_url_hash(url)
-    
-    # Проверяем, существует ли уже документ в кэше с таким же типом обхода
-    existing_doc = db.query(CachedDocument).filter(
-        CachedDocument.url_hash == url_hash,
-        CachedDocument.is_single_page == is_single_page
-    ).first()
-    
-    if existing_doc:
-        # Обновляем существующий документ
-        existing_doc.content = content
+    async with session_scope() as db:
+        content_hash, content_size = await store_blob(db, content)
+        url_hash = get_url_hash(url)
+        doc_type = _doc_type(is_single_page)
+        
+        # Документ второго типа обхода для того же URL хранится под модифицированным хешем
+        url_hashes = (url_hash, get_url_hash(f"{url}_{is_single_page}"))
+        
+        # Проверяем, существует ли уже документ в кэше с таким же типом обхода
+        existing_doc = await db.scalar(select(CachedDocument).filter(
+            CachedDocument.url_hash.in_(url_hashes),
+            CachedDocument.is_single_page == is_single_page
+        ).limit(1))
+        
+        if not existing_doc:
+            # Документ могут одновременно сохранять несколько обходов, поэтому вставляем
+            # без ошибки при конфликте: если основной хеш занят документом другого типа,
+            # пробуем модифицированный, а если документ этого типа уже вставлен - обновляем его
+            current_time = datetime.datetime.now()
+            for candidate_hash in url_hashes:
+                document_id = await db.scalar(sqlite_insert(CachedDocument).values(
+                    url=url,
+                    url_hash=candidate_hash,
+                    content_hash=content_hash,
+                    pages_processed=pages_processed,
+                    is_single_page=is_single_page,
+                    created_at=current_time,
+                    last_accessed=current_time,
+                    access_count=1
+                ).on_conflict_do_nothing(index_elements=[CachedDocument.url_hash]).returning(CachedDocument.id))
+                
+                if document_id is not None:
+                    await update_cache_stats(db, **{f"docs_{doc_type}": 1, f"doc_bytes_{doc_type}": content_size,
+                                                    "blob_referenced_bytes": content_size})
+                    return document_id
+                
+                existing_doc = await db.scalar(select(CachedDocument).filter(
+                    CachedDocument.url_hash == candidate_hash,
+                    CachedDocument.is_single_page == is_single_page
+                ))
+                if existing_doc:
+                    break
+        
+        old_size = await db.scalar(select(Blob.size).filter(Blob.hash == existing_doc.content_hash)) or 0
+        await update_cache_stats(db, **{f"doc_bytes_{doc_type}": content_size - old_size,
+                                        "blob_referenced_bytes": content_size - old_size})
+        
+        # Обновляем существующий документ (время создания - время получения актуального содержимого)
+        existing_doc.content_hash = content_hash
         existing_doc.pages_processed = pages_processed
+        existing_doc.created_at = datetime.datetime.now()
         existing_doc.last_accessed = datetime.datetime.now()
         existing_doc.access_count += 1
-        db.commit()
         return existing_doc.id
-    
-    # Проверяем, существует ли документ с другим типом обхода
-    # Если да, создаем новый с другим хешем для уникальности
-    has_other_type = db.query(CachedDocument).filter(
-        CachedDocument.url_hash == url_hash,
-        CachedDocument.is_single_page != is_single_page
-    ).first()
-    
-    if has_other_type:
-        # Создаем модифицированный хеш для уникальности
-        unique_key = f"{url}_{is_single_page}"
-        url_hash = get_url_hash(unique_key)
-    
-    # Создаем новый документ в кэше
-    new_doc = CachedDocument(
-        url=url,
-        url_hash=url_hash,
-        content=content,
-        pages_processed=pages_processed,
-        is_single_page=is_single_page,
-        created_at=datetime.datetime.now(),
-        last_accessed=datetime.datetime.now()
-    )
-    
-    db.add(new_doc)
-    db.commit()
-    db.refresh(new_doc)
-    return new_doc.id
 
-def get_cached_document(url, is_single_page=None):
+async def get_cached_document(url, is_single_page=None, max_age=None):
     """
-    Получает документ из кэша по URL и типу обхода
+    Получает документ из кэша по URL и типу обхода.
+    Текст документа не загружается: его можно получить по content_hash
+    (get_blob_text или read_blob_into)
     
     Args:
         url (str): URL документа
         is_single_page (bool, optional): Если True - ищем только одиночную страницу,
                                         если False - только полный обход,
                                         если None - любой тип
+        max_age (timedelta, optional): Если указан, документ старше этого возраста
+                                       считается устаревшим и не возвращается
     """
-    db = get_db()
-    url_hash = get_url_hash(url)
-    
-    # Если указан тип обхода, пробуем сначала найти по основному хешу с фильтром типа
-    if is_single_page is not None:
-        # Строим базовый запрос
-        query = db.query(CachedDocument).filter(
-            CachedDocument.url_hash == url_hash,
-            CachedDocument.is_single_page == is_single_page
-        )
-        
-        # Выполняем запрос
-        cached_doc = query.first()
+    async with session_scope() as db:
+        url_hash = get_url_hash(url)
         
-        # Если не нашли, пробуем искать по модифицированному хешу
-        if not cached_doc:
-            unique_key = f"{url}_{is_single_page}"
-            modified_url_hash = get_url_hash(unique_key)
-            
-            # Строим запрос с модифицированным хешем
-            query = db.query(CachedDocument).filter(
-                CachedDocument.url_hash == modified_url_hash,
+        # Если указан тип обхода, пробуем сначала найти по основному хешу с фильтром типа
+        if is_single_page is not None:
+            cached_doc = await db.scalar(select(CachedDocument).filter(
+                CachedDocument.url_hash == url_hash,
                 CachedDocument.is_single_page == is_single_page
-            )
+            ).limit(1))
             
-            # Выполняем запрос
-            cached_doc = query.first()
-    else:
-        # Если тип не указан, ищем по основному хешу
-        cached_doc = db.query(CachedDocument).filter(
-            CachedDocument.url_hash == url_hash
-        ).first()
-    
-    if cached_doc:
-        # Обновляем статистику доступа
-        cached_doc.last_accessed = datetime.datetime.now()
-        cached_doc.access_count += 1
-        db.commit()
+            # Если не нашли, пробуем искать по модифицированному хешу
+            if not cached_doc:
+                unique_key = f"{url}_{is_single_page}"
+                modified_url_hash = get_url_hash(unique_key)
+                
+                cached_doc = await db.scalar(select(CachedDocument).filter(
+                    CachedDocument.url_hash == modified_url_hash,
+                    CachedDocument.is_single_page == is_single_page
+                ).limit(1))
+        else:
+            # Если тип не указан, ищем по основному хешу
+            cached_doc = await db.scalar(select(CachedDocument).filter(
+                CachedDocument.url_hash == url_hash
+            ).limit(1))
         
-        return {
-            "id": cached_doc.id,
-            "content": cached_doc.content,
-            "pages_processed": cached_doc.pages_processed,
-            "is_single_page": cached_doc.is_single_page
-        }
-    
-    return None
+        if cached_doc and max_age is not None and cached_doc.created_at < datetime.datetime.now() - max_age:
+            # Документ устарел - его нужно обойти заново
+            return None
+        
+        if cached_doc:
+            # Статистика доступа запишется фоновой задачей
+            access_stats.record(CachedDocument, cached_doc.id)
+            
+            return {
+                "id": cached_doc.id,
+                "content_hash": cached_doc.content_hash,
+                "pages_processed": cached_doc.pages_processed,
+                "is_single_page": cached_doc.is_single_page
+            }
+        
+        return None
+
+async def get_document_content(document_id):
+    """Получает текст кэшированного документа по его ID"""
+    async with session_scope() as db:
+        content_hash = await db.scalar(select(CachedDocument.content_hash).filter(CachedDocument.id == document_id))
+        return await load_blob(db, content_hash) if content_hash else None
+
+async def get_document_hash(document_id):
+    """Получает хеш текста кэшированного документа по его ID (сессии ИИ ссылаются на тот же blob)"""
+    async with session_scope() as db:
+        return await db.scalar(select(CachedDocument.content_hash).filter(CachedDocument.id == document_id))
 
-def cache_summary(document_id, summary_content, is_single_page=False):
+async def cache_summary(document_id, summary_content, is_single_page=False):
     """Сохраняет конспект документа в кэш"""
-    db = get_db()
-    
-    # Проверяем, существует ли уже конспект для этого документа с таким же типом (одна страница/полный обход)
-    existing_summary = db.query(CachedSummary).filter(
-        CachedSummary.document_id == document_id,
-        CachedSummary.is_single_page == is_single_page
-    ).first()
-    
-    if existing_summary:
-        # Обновляем существующий конспект
-        existing_summary.content = summary_content
-        existing_summary.last_accessed = datetime.datetime.now()
-        existing_summary.access_count += 1
-        db.commit()
-        return existing_summary.id
-    
-    # Создаем новый конспект
-    new_summary = CachedSummary(
-        document_id=document_id,
-        content=summary_content,
-        is_single_page=is_single_page,
-        created_at=datetime.datetime.now(),
-        last_accessed=datetime.datetime.now()
-    )
-    
-    db.add(new_summary)
-    db.commit()
-    db.refresh(new_summary)
-    return new_summary.id
+    async with session_scope() as db:
+        # Проверяем, существует ли уже конспект для этого документа с таким же типом (одна страница/полный обход)
+        existing_summary = await db.scalar(select(CachedSummary).filter(
+            CachedSummary.document_id == document_id,
+            CachedSummary.is_single_page == is_single_page
+        ).limit(1))
+        
+        if existing_summary:
+            # Обновляем существующий конспект
+            existing_summary.content = summary_content
+            existing_summary.last_accessed = datetime.datetime.now()
+            existing_summary.access_count += 1
+            return existing_summary.id
+        
+        # Создаем новый конспект
+        new_summary = CachedSummary(
+            document_id=document_id,
+            content=summary_content,
+            is_single_page=is_single_page,
+            created_at=datetime.datetime.now(),
+            last_accessed=datetime.datetime.now()
+        )
+        
+        db.add(new_summary)
+        await db.flush()
+        await update_cache_stats(db, **{f"summaries_{_doc_type(is_single_page)}": 1})
+        return new_summary.id
 
-def get_cached_summary(document_id, is_single_page=False):
+async def get_cached_summary(document_id, is_single_page=False):
     """Получает конспект из кэша по ID документа и типу обхода"""
-    db = get_db()
-    
-    cached_summary = db.query(CachedSummary).filter(
-        CachedSummary.document_id == document_id,
-        CachedSummary.is_single_page == is_single_page
-    ).first()
-    
-    if cached_summary:
-        # Обновляем статистику доступа
-        cached_summary.last_accessed = datetime.datetime.now()
-        cached_summary.access_count += 1
-        db.commit()
+    async with session_scope() as db:
+        cached_summary = await db.scalar(select(CachedSummary).filter(
+            CachedSummary.document_id == document_id,
+            CachedSummary.is_single_page == is_single_page
+        ).limit(1))
+        
+        if cached_summary:
+            # Статистика доступа запишется фоновой задачей
+            access_stats.record(CachedSummary, cached_summary.id)
+            
+            return cached_summary.content
+        
+        return None
+
+# Счетчики обращений к кэшу страниц с момента запуска бота:
+# hits - страница взята из кэша без запроса к сайту,
+# revalidated - сайт подтвердил, что страница не изменилась (304 или тот же хеш),
+# misses - страница загружена и разобрана заново
+page_cache_counters = {"hits": 0, "revalidated": 0, "misses": 0}
+
+def record_page_cache_event(event):
+    """Учитывает обращение к кэшу страниц ('hits', 'revalidated' или 'misses')"""
+    page_cache_counters[event] += 1
+
+async def get_cached_page(url):
+    """Получает сохраненную страницу по каноническому URL (для условного GET при повторном обходе)"""
+    async with session_scope() as db:
+        cached_page = await db.scalar(select(CachedPage).filter(CachedPage.url_hash == get_url_hash(url)))
+        
+        if cached_page:
+            return {
+                "id": cached_page.id,
+                "url": cached_page.url,
+                "etag": cached_page.etag,
+                "last_modified": cached_page.last_modified,
+                "content_hash": cached_page.content_hash,
+                "title": cached_page.title,
+                "text": cached_page.text,
+                "links": json.loads(cached_page.links),
+                "fetched_at": cached_page.fetched_at,
+                "checked_at": cached_page.checked_at
+            }
+        
+        return None
+
+async def save_cached_page(url, title, text, links, content_hash, etag=None, last_modified=None):
+    """Сохраняет или обновляет страницу в хранилище страниц"""
+    async with session_scope() as db:
+        url_hash = get_url_hash(url)
+        current_time = datetime.datetime.now()
+        fields = {
+            "title": title[:1024],
+            "text": text,
+            "links": json.dumps(links),
+            "content_hash": content_hash,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": current_time,
+            "checked_at": current_time
+        }
+        
+        # Одну страницу могут одновременно сохранять несколько обходов, поэтому вместо
+        # проверки и вставки - вставка без ошибки при конфликте по url_hash. INSERT сразу
+        # берет блокировку записи, и следующий UPDATE выполняется в той же транзакции
+        result = await db.execute(sqlite_insert(CachedPage).values(url=url, url_hash=url_hash, **fields)
+                                  .on_conflict_do_nothing(index_elements=[CachedPage.url_hash])
+                                  .returning(CachedPage.id))
+        page_id = result.scalar()
+        if page_id is not None:
+            await update_cache_stats(db, pages=1)
+            return page_id
+        
+        return await db.scalar(update(CachedPage).filter(CachedPage.url_hash == url_hash).values(**fields)
+                               .returning(CachedPage.id))
+
+async def touch_cached_page(url, etag=None, last_modified=None):
+    """Отмечает, что страница проверена и не изменилась (ответ 304 или тот же хеш)"""
+    async with session_scope() as db:
+        cached_page = await db.scalar(select(CachedPage).filter(CachedPage.url_hash == get_url_hash(url)))
+        if cached_page:
+            cached_page.checked_at = datetime.datetime.now()
+            # Сервер может выдать новые валидаторы даже для неизмененной страницы
+            if etag:
+                cached_page.etag = etag
+            if last_modified:
+                cached_page.last_modified = last_modified
+
+def get_checkpoint_hash(start_url, max_pages):
+    """Хеш, идентифицирующий обход: стартовый URL и лимит страниц"""
+    return get_url_hash(f"{start_url}|{max_pages}")
+
+async def save_crawl_checkpoint(start_url, max_pages, state, pages_processed):
+    """Сохраняет или обновляет контрольную точку незавершенного обхода"""
+    # Состояние сериализуем сразу: пока идет запрос к БД, обход продолжает его менять
+    state_json = json.dumps(state)
+    async with session_scope() as db:
+        job_hash = get_checkpoint_hash(start_url, max_pages)
+        
+        checkpoint = await db.scalar(select(CrawlCheckpoint).filter(CrawlCheckpoint.job_hash == job_hash))
+        if not checkpoint:
+            checkpoint = CrawlCheckpoint(start_url=start_url, job_hash=job_hash, max_pages=max_pages)
+            db.add(checkpoint)
         
-        return cached_summary.content
+        checkpoint.state = state_json
+        checkpoint.pages_processed = pages_processed
+        checkpoint.updated_at = datetime.datetime.now()
+        
+
+async def get_crawl_checkpoint(start_url, max_pages, max_age=None):
+    """
+    Получает контрольную точку обхода.
     
-    return None
+    Контрольные точки старше max_age (timedelta) не возвращаются:
+    обход в этом случае начинается заново.
+    """
+    async with session_scope() as db:
+        checkpoint = await db.scalar(select(CrawlCheckpoint).filter(
+            CrawlCheckpoint.job_hash == get_checkpoint_hash(start_url, max_pages)
+        ))
+        
+        if not checkpoint:
+            return None
+        
+        if max_age is not None and checkpoint.updated_at < datetime.datetime.now() - max_age:
+            return None
+        
+        return {
+            "id": checkpoint.id,
+            "pages_processed": checkpoint.pages_processed,
+            "state": json.loads(checkpoint.state),
+            "updated_at": checkpoint.updated_at
+        }
 
-def cleanup_old_cache(days_threshold=30):
+async def delete_crawl_checkpoint(start_url, max_pages):
+    """Удаляет контрольную точку завершенного обхода"""
+    async with session_scope() as db:
+        await db.execute(delete(CrawlCheckpoint).filter(
+            CrawlCheckpoint.job_hash == get_checkpoint_hash(start_url, max_pages)
+        ))
+
+async def cleanup_old_cache(days_threshold=30):
     """Удаляет старые записи из кэша, которые не использовались более N дней"""
-    db = get_db()
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_threshold)
-    
-    # Находим документы, которые не использовались больше порогового значения
-    old_documents = db.query(CachedDocument).filter(CachedDocument.last_accessed < cutoff_date).all()
-    
-    # Удаляем найденные документы (связанные конспекты удалятся каскадно)
-    for doc in old_documents:
-        db.delete(doc)
-    
-    db.commit()
-    return len(old_documents)
+    # Сначала записываем накопленные обращения, чтобы не удалить используемые документы
+    await access_stats.flush()
+    async with session_scope() as db:
+        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_threshold)
+        
+        # Находим документы, которые не использовались больше порогового значения
+        old_document_ids = (await db.scalars(
+            select(CachedDocument.id).filter(CachedDocument.last_accessed < cutoff_date)
+        )).all()
+        
+        # Удаляем найденные документы вместе с их конспектами
+        if old_document_ids:
+            deltas = {}
+            for is_single_page, summaries in await db.execute(
+                select(CachedSummary.is_single_page, func.count())
+                .filter(CachedSummary.document_id.in_(old_document_ids))
+                .group_by(CachedSummary.is_single_page)
+            ):
+                deltas[f"summaries_{_doc_type(is_single_page)}"] = -summaries
+            for is_single_page, docs, doc_bytes in await db.execute(
+                select(CachedDocument.is_single_page, func.count(), func.coalesce(func.sum(Blob.size), 0))
+                .outerjoin(Blob, CachedDocument.content_hash == Blob.hash)
+                .filter(CachedDocument.id.in_(old_document_ids))
+                .group_by(CachedDocument.is_single_page)
+            ):
+                deltas[f"docs_{_doc_type(is_single_page)}"] = -docs
+                deltas[f"doc_bytes_{_doc_type(is_single_page)}"] = -doc_bytes
+                deltas["blob_referenced_bytes"] = deltas.get("blob_referenced_bytes", 0) - doc_bytes
+            
+            await db.execute(delete(CachedSummary).filter(CachedSummary.document_id.in_(old_document_ids)))
+            await db.execute(delete(CachedDocument).filter(CachedDocument.id.in_(old_document_ids)))
+            await update_cache_stats(db, **deltas)
+        
+        # Удаляем страницы, которые давно не проверялись ни одним обходом
+        deleted_pages = await db.execute(delete(CachedPage).filter(CachedPage.checked_at < cutoff_date))
+        await update_cache_stats(db, pages=-deleted_pages.rowcount)
+        
+        # Удаляем контрольные точки брошенных обходов
+        await db.execute(delete(CrawlCheckpoint).filter(CrawlCheckpoint.updated_at < cutoff_date))
+        
+        # Удаляем тексты, на которые больше не ссылается ни документ, ни сессия
+        unused_blob = (
+            Blob.hash.not_in(select(CachedDocument.content_hash).filter(CachedDocument.content_hash.is_not(None))),
+            Blob.hash.not_in(select(AISession.document_hash).filter(AISession.document_hash.is_not(None)))
+        )
+        unused_blobs, unused_bytes = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(func.length(Blob.data)), 0)).filter(*unused_blob)
+        )).one()
+        if unused_blobs:
+            await db.execute(delete(Blob).filter(*unused_blob))
+            await update_cache_stats(db, blobs=-unused_blobs, blob_stored_bytes=-unused_bytes)
+        
+        return len(old_document_ids)
 
-def cache_stats(db=None):
-    """Получает детальную статистику кэша"""
-    if db is None:
-        db = get_db()
-    
-    # Статистика по документам
-    docs_count = db.query(CachedDocument).count()
-    
-    # Статистика по типам документов
-    single_page_docs = db.query(CachedDocument).filter(CachedDocument.is_single_page == True).count()
-    full_crawl_docs = db.query(CachedDocument).filter(CachedDocument.is_single_page == False).count()
-    
-    # Статистика по конспектам
-    summaries_count = db.query(CachedSummary).count()
-    
-    # Статистика по типам конспектов
-    single_page_summaries = db.query(CachedSummary).filter(CachedSummary.is_single_page == True).count()
-    full_crawl_summaries = db.query(CachedSummary).filter(CachedSummary.is_single_page == False).count()
-    
-    # Статистика по времени создания
-    oldest_doc = db.query(CachedDocument.created_at).order_by(CachedDocument.created_at).first()
-    oldest_doc_date = oldest_doc[0] if oldest_doc else None
-    
-    newest_doc = db.query(CachedDocument.created_at).order_by(CachedDocument.created_at.desc()).first()
-    newest_doc_date = newest_doc[0] if newest_doc else None
-    
-    # Вычисляем средний размер документа
-    avg_doc_size = db.query(func.avg(func.length(CachedDocument.content))).scalar() or 0
-    avg_doc_size_kb = avg_doc_size / 1024
-    
-    # Самый популярный документ
-    most_popular_doc = db.query(CachedDocument).order_by(CachedDocument.access_count.desc()).first()
+async def cache_stats():
+    """
+    Получает детальную статистику кэша.
     
-    # Самая популярная страница
-    most_popular_page = db.query(CachedDocument).filter(
-        CachedDocument.is_single_page == True
-    ).order_by(CachedDocument.access_count.desc()).first()
+    Счетчики читаются из таблицы cache_stats, а даты и самые популярные документы
+    выбираются по индексам, поэтому время не зависит от размера кэша.
+    """
+    await access_stats.flush()
+    async with session_scope() as db:
+        counters = dict.fromkeys(CACHE_STAT_NAMES, 0)
+        counters.update((await db.execute(select(CacheStat.name, CacheStat.value))).all())
+        
+        # Статистика кэша страниц: сколько загрузок удалось не делать
+        page_lookups = sum(page_cache_counters.values())
+        page_hit_ratio = (page_cache_counters["hits"] + page_cache_counters["revalidated"]) / page_lookups if page_lookups else 0
+        
+        # Статистика по времени создания
+        oldest_doc_date = await db.scalar(select(CachedDocument.created_at).order_by(CachedDocument.created_at).limit(1))
+        newest_doc_date = await db.scalar(select(CachedDocument.created_at).order_by(CachedDocument.created_at.desc()).limit(1))
+        
+        # Самые популярные одиночные страницы и полные обходы
+        top_by_type = {}
+        for is_single_page in (True, False):
+            top_by_type[is_single_page] = (await db.scalars(select(CachedDocument).filter(
+                CachedDocument.is_single_page == is_single_page
+            ).order_by(CachedDocument.access_count.desc()).limit(TOP_DOCUMENTS))).all()
+        
+        top_documents = sorted(top_by_type[True] + top_by_type[False], key=lambda doc: doc.access_count, reverse=True)[:TOP_DOCUMENTS]
+        document_sizes = dict((await db.execute(
+            select(Blob.hash, Blob.size).filter(Blob.hash.in_([doc.content_hash for doc in top_documents]))
+        )).all())
     
-    # Самый популярный полный обход
-    most_popular_full = db.query(CachedDocument).filter(
-        CachedDocument.is_single_page == False
-    ).order_by(CachedDocument.access_count.desc()).first()
+    docs_count = counters["docs_single"] + counters["docs_full"]
+    doc_bytes = counters["doc_bytes_single"] + counters["doc_bytes_full"]
+    most_popular_page = top_by_type[True][0] if top_by_type[True] else None
+    most_popular_full = top_by_type[False][0] if top_by_type[False] else None
     
     # Формируем и возвращаем статистику
     return {
         "docs_count": docs_count,
-        "single_page_docs": single_page_docs,
-        "full_crawl_docs": full_crawl_docs,
-        "summaries_count": summaries_count,
-        "single_page_summaries": single_page_summaries,
-        "full_crawl_summaries": full_crawl_summaries,
+        "single_page_docs": counters["docs_single"],
+        "full_crawl_docs": counters["docs_full"],
+        "summaries_count": counters["summaries_single"] + counters["summaries_full"],
+        "single_page_summaries": counters["summaries_single"],
+        "full_crawl_summaries": counters["summaries_full"],
+        "pages_count": counters["pages"],
+        "page_cache_hits": page_cache_counters["hits"],
+        "page_cache_revalidated": page_cache_counters["revalidated"],
+        "page_cache_misses": page_cache_counters["misses"],
+        "page_hit_ratio": page_hit_ratio,
         "oldest_doc_date": oldest_doc_date,
         "newest_doc_date": newest_doc_date,
-        "avg_doc_size_kb": avg_doc_size_kb,
-        "most_popular_doc": most_popular_doc,
+        "avg_doc_size_kb": doc_bytes / docs_count / 1024 if docs_count else 0,
+        "single_page_docs_kb": counters["doc_bytes_single"] / 1024,
+        "full_crawl_docs_kb": counters["doc_bytes_full"] / 1024,
+        "blobs_count": counters["blobs"],
+        "blobs_stored_kb": counters["blob_stored_bytes"] / 1024,
+        "blobs_saved_kb": (counters["blob_referenced_bytes"] - counters["blob_stored_bytes"]) / 1024,
+        "top_documents": [
+            {"document": doc, "size_kb": document_sizes.get(doc.content_hash, 0) / 1024} for doc in top_documents
+        ],
         "most_popular_page": most_popular_page,
         "most_popular_full": most_popular_full
-    } 
\ No newline at end of file
+    }
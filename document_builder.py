@@ -0,0 +1,307 @@
+import io
+import re
+import math
+import tempfile
+from collections import Counter
+from aiogram.types import InputFile
+from config import CRAWL_SETTINGS
+from page_extractor import TABLE_MARKS
+
+# Размер блока при копировании и отправке документа
+CHUNK_SIZE = 64 * 1024
+
+# Документ держится в памяти, пока не превысит этот размер, затем переносится во временный файл
+SPOOL_MAX_MEMORY = CRAWL_SETTINGS["document_spool_mb"] * 1024 * 1024
+
+# Шаблонные блоки ищутся, только если в документе не меньше стольких страниц
+BOILERPLATE_MIN_PAGES = 3
+
+# Строки без букв и цифр (рамки, разделители) и рамки таблиц относятся к оформлению и шаблонными не считаются
+WORD_REGEX = re.compile(r'\w')
+FRAME_LINES = {TABLE_MARKS[0].strip()}
+
+def _is_text_line(line):
+    """Строка с текстом страницы, а не с оформлением."""
+    return WORD_REGEX.search(line) is not None and line not in FRAME_LINES
+
+# Шаблонным считается блок из стольких идущих подряд повторяющихся строк (меню, подвал)...
+BOILERPLATE_MIN_BLOCK_LINES = 2
+# ...или одна повторяющаяся строка не короче этого (баннер). Короткие одиночные строки
+# вроде подзаголовков "Parameters" или "Example" относятся к структуре страницы и остаются
+BOILERPLATE_MIN_LINE_LENGTH = 60
+
+def _frame(title, left_pad, right_pad):
+    """Рамка-заголовок раздела документа."""
+    frame = "╔" + "═" * 78 + "╗\n"
+    frame += "║" + " " * left_pad + title + " " * right_pad + "║\n"
+    frame += "╚" + "═" * 78 + "╝\n\n"
+    return frame
+
+def _page_header(title, url):
+    """Заголовок раздела страницы с ее названием и URL."""
+    page_header = "\n\n" + "╔" + "═" * 78 + "╗\n"
+    page_header += f"║  СТРАНИЦА: {title}\n"
+    page_header += f"║  URL: {url}\n"
+    page_header += "╚" + "═" * 78 + "╝\n\n"
+    return page_header
+
+class CrawlDocument:
+    """
+    Итоговый документ обхода, хранящийся в SpooledTemporaryFile.
+
+    Документ можно отправить в Telegram и прочитать по частям,
+    не держа в памяти несколько его копий. Один документ может быть
+    выдан нескольким пользователям: файл закрывается, когда каждый
+    из них вызовет close().
+    """
+    def __init__(self, file, pages_processed):
+        self._file = file
+        self._users = 1
+        self.pages_processed = pages_processed
+        self.size = file.seek(0, io.SEEK_END)  # Размер в байтах UTF-8
+
+    @classmethod
+    async def from_writer(cls, write, pages_processed):
+        """
+        Создает документ, содержимое которого записывает корутина write(file)
+        (например, распаковка документа из кэша по частям).
+        """
+        file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+b')
+        try:
+            await write(file)
+        except BaseException:
+            file.close()
+            raise
+        return cls(file, pages_processed)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Читает документ блоками байтов (несколько чтений могут идти одновременно)."""
+        position = 0
+        while True:
+            self._file.seek(position)
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+
+    def read_text(self):
+        """Возвращает весь документ одной строкой (нужно для БД и промпта ИИ)."""
+        self._file.seek(0)
+        return self._file.read().decode('utf-8', errors='ignore')
+
+    def as_input_file(self, filename):
+        """Возвращает файл для отправки в Telegram, читающий документ по частям."""
+        return DocumentInputFile(self, filename)
+
+    def retain(self, count=1):
+        """
+        Добавляет пользователей документа, каждый из которых должен вызвать close().
+
+        Отрицательное count убирает пользователей; если их не осталось, документ закрывается.
+        """
+        self._users += count
+        if self._users <= 0:
+            self._file.close()
+
+    def close(self):
+        self._users -= 1
+        if self._users <= 0:
+            self._file.close()
+
+class DocumentInputFile(InputFile):
+    """Файл для aiogram, который отправляет CrawlDocument потоком, без копии в памяти."""
+    def __init__(self, document, filename, chunk_size=CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.document = document
+
+    async def read(self, bot):
+        for chunk in self.document.iter_chunks(self.chunk_size):
+            yield chunk
+
+class DocumentBuilder:
+    """
+    Собирает документ обхода по мере загрузки страниц.
+
+    Разделы страниц сразу пишутся во временный файл, в памяти хранится
+    только индекс {url: (смещение, длина, заголовок)} для оглавления.
+
+    Блоки текста, повторяющиеся на большинстве страниц сайта (меню,
+    баннеры, боковые панели), при сборке документа выносятся в отдельный
+    раздел и удаляются из разделов страниц. Для этого по мере добавления
+    страниц считается, на скольких страницах встретилась каждая строка, а
+    при сборке удаляются только блоки таких строк, идущих подряд, и длинные
+    одиночные строки.
+    """
+    def __init__(self, boilerplate_min_share=None):
+        self._sections = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+b')
+        self._index = {}
+
+        # Доля страниц, на которых должна встретиться строка, чтобы считаться шаблонной (None - не искать)
+        self.boilerplate_min_share = boilerplate_min_share
+
+        # Число страниц с каждой строкой {hash(строка): count} и текст строк, встреченных больше одного раза
+        self._line_counts = Counter()
+        self._repeated_lines = {}
+
+    def add_page(self, url, title, text):
+        """Добавляет раздел страницы (заголовок раздела и текст)."""
+        data = (_page_header(title, url) + text).encode('utf-8', errors='ignore')
+        offset = self._sections.seek(0, io.SEEK_END)
+        self._sections.write(data)
+        self._index[url] = (offset, len(data), title)
+
+        if self.boilerplate_min_share is not None:
+            self._count_lines(text)
+
+    def _count_lines(self, text):
+        """Учитывает строки страницы (каждую один раз) для поиска шаблонных блоков."""
+        for line in dict.fromkeys(text.splitlines()):
+            if not _is_text_line(line):
+                continue
+            key = hash(line)
+            self._line_counts[key] += 1
+            if self._line_counts[key] == 2:
+                self._repeated_lines[key] = line
+
+    def _find_boilerplate(self):
+        """Возвращает строки, встречающиеся на большинстве страниц, в порядке их появления."""
+        if self.boilerplate_min_share is None or len(self._index) < BOILERPLATE_MIN_PAGES:
+            return []
+
+        min_pages = max(BOILERPLATE_MIN_PAGES, math.ceil(self.boilerplate_min_share * len(self._index)))
+        return [line for key, line in self._repeated_lines.items() if self._line_counts[key] >= min_pages]
+
+    @staticmethod
+    def _boilerplate_block_lines(lines, repeated):
+        """
+        Возвращает номера строк раздела, входящих в шаблонные блоки: подряд идущие
+        повторяющиеся строки (строки оформления между ними блок не прерывают) или
+        одна длинная повторяющаяся строка.
+        """
+        removed = set()
+        block = []
+
+        def close_block():
+            if len(block) >= BOILERPLATE_MIN_BLOCK_LINES or (block and len(lines[block[0]]) >= BOILERPLATE_MIN_LINE_LENGTH):
+                removed.update(block)
+            block.clear()
+
+        for number, line in enumerate(lines):
+            if line in repeated:
+                block.append(number)
+            elif _is_text_line(line):
+                close_block()
+        close_block()
+        return removed
+
+    def _read_section_lines(self, url):
+        offset, length, _ = self._index[url]
+        self._sections.seek(offset)
+        return self._sections.read(length).decode('utf-8', errors='ignore').split('\n')
+
+    def page_text(self, url):
+        """Текст добавленной страницы без заголовка раздела."""
+        offset, length, title = self._index[url]
+        header_length = len(_page_header(title, url).encode('utf-8', errors='ignore'))
+        self._sections.seek(offset + header_length)
+        return self._sections.read(length - header_length).decode('utf-8', errors='ignore')
+
+    def __contains__(self, url):
+        return url in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def _copy_section(self, url, target):
+        """Копирует раздел страницы в итоговый документ блоками."""
+        offset, length, _ = self._index[url]
+        self._sections.seek(offset)
+        while length > 0:
+            chunk = self._sections.read(min(CHUNK_SIZE, length))
+            target.write(chunk)
+            length -= len(chunk)
+
+    def _copy_section_without(self, url, target, repeated):
+        """Копирует раздел страницы, удаляя шаблонные блоки и оставшиеся после них пустые рамки списков."""
+        lines = self._read_section_lines(url)
+        removed = self._boilerplate_block_lines(lines, repeated)
+
+        kept = []
+        for number, line in enumerate(lines):
+            if number in removed:
+                continue
+            if not line and kept and not kept[-1]:
+                continue
+            # Список, из которого удалены все пункты, убираем целиком
+            if line.startswith('└'):
+                previous = len(kept) - 1
+                while previous >= 0 and not kept[previous]:
+                    previous -= 1
+                if previous >= 0 and kept[previous].startswith('┌'):
+                    del kept[previous:]
+                    continue
+            kept.append(line)
+
+        target.write('\n'.join(kept).encode('utf-8', errors='ignore'))
+
+    def finish(self, order, base_domain, pages_processed, errors, duplicates_skipped=0, completion_reason=None):
+        """
+        Собирает итоговый документ: информация о сайте (и причина завершения
+        обхода, если она передана), оглавление, разделы страниц в порядке
+        order и список ошибок.
+        """
+        document = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+b')
+
+        # Добавляем информацию о сайте
+        header = f"📋 Сайт: {base_domain}\n"
+        header += f"📊 Обработано страниц: {pages_processed}\n"
+        if duplicates_skipped:
+            header += f"♻️ Пропущено почти одинаковых страниц: {duplicates_skipped}\n"
+        if completion_reason:
+            header += f"🏁 Причина завершения: {completion_reason}\n"
+        header += "\n"
+
+        # Создаем оглавление из заголовков, без чтения самих разделов
+        header += "\n\n" + _frame("ОГЛАВЛЕНИЕ", 30, 30)
+        for page_number, url in enumerate(order, start=1):
+            header += f"  {page_number:02d}. {self._index[url][2]}\n"
+
+        header += "\n" + _frame("ИНФОРМАЦИЯ О ДОКУМЕНТЕ", 25, 25)
+
+        # Шаблонные блоки сайта приводим один раз, а из разделов страниц удаляем.
+        # Какие повторяющиеся строки образуют блоки, видно только по самим разделам,
+        # поэтому для общего раздела они читаются заранее отдельным проходом
+        repeated = set(self._find_boilerplate())
+        boilerplate = {}
+        if repeated:
+            for url in order:
+                lines = self._read_section_lines(url)
+                boilerplate.update((lines[number], None) for number in sorted(self._boilerplate_block_lines(lines, repeated)))
+        if boilerplate:
+            header += "\n\n" + _frame("ОБЩИЕ ЭЛЕМЕНТЫ САЙТА", 26, 26)
+            header += "\n".join(boilerplate) + "\n"
+
+        header += "\n\n" + _frame("СОДЕРЖИМОЕ САЙТА", 27, 27)
+        document.write(header.encode('utf-8', errors='ignore'))
+
+        for i, url in enumerate(order):
+            if i > 0:
+                document.write(b"\n")
+            if boilerplate:
+                self._copy_section_without(url, document, repeated)
+            else:
+                self._copy_section(url, document)
+
+        # Если были ошибки, добавляем их в конец
+        if errors:
+            error_section = "\n\n" + _frame("ОШИБКИ ПРИ СКАНИРОВАНИИ", 26, 25)
+            for error in errors:
+                error_section += f"⚠️ {error}\n"
+            document.write(error_section.encode('utf-8', errors='ignore'))
+
+        self._sections.close()
+        return CrawlDocument(document, pages_processed)
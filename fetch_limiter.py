@@ -0,0 +1,233 @@
+import asyncio
+import datetime
+import logging
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from config import CRAWL_SETTINGS, HOST_RATE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд простоя забывается подобранная скорость хоста
+HOST_STATE_TTL = 600
+
+# Коэффициент сглаживания времени ответа (экспоненциальное скользящее среднее)
+LATENCY_SMOOTHING = 0.2
+
+def parse_retry_after(value, max_delay):
+    """
+    Разбирает заголовок Retry-After (секунды или HTTP-дата).
+
+    Returns:
+        float | None: Пауза в секундах, не больше max_delay
+    """
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        delay = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(delay, 0), max_delay)
+
+class HostRate:
+    """
+    Token bucket одного хоста.
+
+    Скорость (запросов в секунду) подстраивается по AIMD: растет на постоянную
+    величину после быстрых ответов и уменьшается в несколько раз при 429/503,
+    ошибках соединения и росте времени ответа. До первого снижения
+    скорость растет экспоненциально (медленный старт, как в TCP).
+    """
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = now  # Время последнего пополнения (может быть в будущем после Retry-After)
+        self.last_used = now
+        self.last_decrease = None
+        self.latency = None  # Сглаженное время ответа
+        self.best_latency = None  # Лучшее сглаженное время ответа
+
+class FetchLimiter:
+    """
+    Класс для ограничения количества одновременных HTTP-запросов
+    при обходе сайтов: в целом по боту и для каждого хоста отдельно.
+
+    Частота запросов к каждому хосту задается адаптивным token bucket (HostRate).
+    """
+    def __init__(self, max_concurrency, per_host_concurrency, rate_settings):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.rate_settings = rate_settings
+
+        # Общий семафор на все обходы всех пользователей
+        self._global_semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Семафоры хостов {host: semaphore} и число их пользователей {host: count}
+        self._host_semaphores = {}
+        self._host_users = {}
+
+        # Подобранная скорость запросов к хостам {host: HostRate}
+        self._host_rates = {}
+
+        # Количество запросов, выполняющихся прямо сейчас
+        self.active_requests = 0
+
+        # Счетчики сигналов перегрузки хостов
+        self.throttled_responses = 0
+        self.rate_decreases = 0
+
+    def _get_host_rate(self, host, now):
+        """Возвращает состояние скорости хоста, удаляя давно не использовавшиеся."""
+        for expired_host in [h for h, r in self._host_rates.items() if now - r.last_used > HOST_STATE_TTL and h != host]:
+            del self._host_rates[expired_host]
+
+        host_rate = self._host_rates.get(host)
+        if host_rate is None:
+            host_rate = HostRate(self.rate_settings["initial_rate"], self.rate_settings["burst"], now)
+            self._host_rates[host] = host_rate
+        host_rate.last_used = now
+        return host_rate
+
+    async def _wait_token(self, host, min_interval):
+        """
+        Берет токен из корзины хоста, при необходимости дожидаясь его.
+
+        Crawl-delay (min_interval) ограничивает скорость сверху и отключает пачки запросов.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        host_rate = self._get_host_rate(host, now)
+
+        rate = host_rate.rate
+        capacity = self.rate_settings["burst"]
+        if min_interval:
+            rate = min(rate, 1 / min_interval)
+            capacity = 1
+
+        if now > host_rate.updated:
+            host_rate.tokens = min(capacity, host_rate.tokens + (now - host_rate.updated) * rate)
+            host_rate.updated = now
+
+        # Резервируем токен: отрицательный остаток означает очередь ожидающих запросов
+        host_rate.tokens -= 1
+        delay = (host_rate.updated - now) + max(-host_rate.tokens, 0) / rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _decrease_rate(self, host_rate, now):
+        """Мультипликативно снижает скорость, но не чаще одного раза за время ответа хоста."""
+        cooldown = max(host_rate.latency or 0, 1 / host_rate.rate)
+        if host_rate.last_decrease is not None and now - host_rate.last_decrease < cooldown:
+            return
+
+        host_rate.rate = max(self.rate_settings["min_rate"], host_rate.rate * self.rate_settings["decrease_factor"])
+        host_rate.last_decrease = now
+        self.rate_decreases += 1
+
+    def record_response(self, host, status, latency, retry_after=None):
+        """
+        Подстраивает скорость хоста по результату запроса.
+
+        Args:
+            host: Хост, к которому выполнялся запрос
+            status: HTTP-статус ответа или None, если ответа не было (таймаут, ошибка соединения)
+            latency: Время выполнения запроса в секундах
+            retry_after: Значение заголовка Retry-After
+        """
+        host_rate = self._host_rates.get(host)
+        if host_rate is None:
+            return
+        now = asyncio.get_running_loop().time()
+
+        if status in (429, 503):
+            self.throttled_responses += 1
+            delay = parse_retry_after(retry_after, self.rate_settings["max_retry_after"])
+            if delay:
+                # Не начинаем новых запросов к хосту, пока не истечет Retry-After
+                host_rate.updated = max(host_rate.updated, now + delay)
+                host_rate.tokens = min(host_rate.tokens, 0)
+                logger.info(f"{host} asked to retry after {delay:.1f}s")
+            self._decrease_rate(host_rate, now)
+            return
+
+        if status is None:
+            self._decrease_rate(host_rate, now)
+            return
+
+        if host_rate.latency is None:
+            host_rate.latency = latency
+        else:
+            host_rate.latency += LATENCY_SMOOTHING * (latency - host_rate.latency)
+        if host_rate.best_latency is None or host_rate.latency < host_rate.best_latency:
+            host_rate.best_latency = host_rate.latency
+
+        slow_latency = max(self.rate_settings["min_slow_latency"],
+                           host_rate.best_latency * self.rate_settings["slow_latency_factor"])
+        if host_rate.latency > slow_latency:
+            self._decrease_rate(host_rate, now)
+        elif host_rate.last_decrease is None:
+            # Медленный старт: пока хост ни разу не перегружался, скорость растет экспоненциально
+            host_rate.rate = min(self.rate_settings["max_rate"], host_rate.rate * self.rate_settings["slow_start_factor"])
+        else:
+            host_rate.rate = min(self.rate_settings["max_rate"], host_rate.rate + self.rate_settings["increase"])
+
+    @asynccontextmanager
+    async def acquire(self, host, min_interval=0):
+        """
+        Захватывает слот для запроса к хосту (сначала хост и его токен, затем общий лимит).
+
+        Args:
+            host: Хост, к которому выполняется запрос
+            min_interval: Минимальный интервал между запросами к хосту в секундах
+        """
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_concurrency)
+            self._host_semaphores[host] = semaphore
+            self._host_users[host] = 0
+        self._host_users[host] += 1
+
+        try:
+            async with semaphore:
+                await self._wait_token(host, min_interval)
+                async with self._global_semaphore:
+                    self.active_requests += 1
+                    try:
+                        yield
+                    finally:
+                        self.active_requests -= 1
+        finally:
+            # Удаляем семафор хоста, когда он больше никому не нужен
+            self._host_users[host] -= 1
+            if self._host_users[host] == 0:
+                del self._host_users[host]
+                del self._host_semaphores[host]
+
+    def get_host_rate(self, host):
+        """Возвращает текущую скорость запросов к хосту или None, если она еще не подобрана."""
+        host_rate = self._host_rates.get(host)
+        return host_rate.rate if host_rate else None
+
+    def get_stats(self):
+        """Возвращает текущую загрузку лимитера."""
+        return {
+            "active_requests": self.active_requests,
+            "active_hosts": len(self._host_semaphores),
+            "tracked_hosts": len(self._host_rates),
+            "max_concurrency": self.max_concurrency,
+            "per_host_concurrency": self.per_host_concurrency,
+            "throttled_responses": self.throttled_responses,
+            "rate_decreases": self.rate_decreases
+        }
+
+# Глобальный экземпляр лимитера запросов
+fetch_limiter = FetchLimiter(
+    max_concurrency=CRAWL_SETTINGS["max_concurrency"],
+    per_host_concurrency=CRAWL_SETTINGS["per_host_concurrency"],
+    rate_settings=HOST_RATE_SETTINGS
+)
@@ -0,0 +1,323 @@
+import re
+import math
+import heapq
+from collections import deque, Counter
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, unquote_plus
+
+# Стандартные порты, которые не нужно указывать в URL
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Параметры отслеживания, не влияющие на содержимое страницы
+TRACKING_PARAMS = {"gclid", "fbclid", "yclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl"}
+TRACKING_PREFIXES = ("utm_",)
+
+# Параметры постраничного вывода, сортировки и фильтров: их комбинации дают бесконечно много адресов
+LOW_VALUE_PARAMS = {"page", "p", "sort", "order", "orderby", "dir", "filter", "offset", "start", "limit",
+                    "per_page", "view", "date", "month", "year", "day", "replytocom", "share", "print"}
+
+# Разделы, которые обычно состоят из списков, архивов и служебных страниц
+LOW_VALUE_PATH_REGEX = re.compile(
+    r'/(?:calendar|events?/\d|archives?|tags?|search|print|login|logout|register|signin|signup|'
+    r'feed|rss|comments?|share|cart|compare|wishlist|page/\d+)(?:/|$)|/\d{4}/\d{1,2}(?:/\d{1,2})?(?:/|$)',
+    re.IGNORECASE
+)
+
+# Сегменты пути, которые считаются переменной частью шаблона адреса
+NUMBER_REGEX = re.compile(r'\d+')
+ID_SEGMENT_REGEX = re.compile(r'^(?=.*\d)[0-9a-f-]{16,}$', re.IGNORECASE)
+
+def is_tracking_param(name):
+    """Проверяет, является ли параметр запроса параметром отслеживания."""
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url):
+    """
+    Приводит URL к каноническому виду, чтобы одна страница имела один адрес.
+
+    Схема и хост переводятся в нижний регистр, стандартный порт и фрагмент
+    удаляются, пустой путь заменяется на "/". Завершающий слеш сохраняется:
+    /docs/ и /docs - разные адреса, и относительные ссылки от них разрешаются
+    по-разному. Параметры отслеживания удаляются, остальные параметры
+    сортируются без изменения их записи (?flag не превращается в ?flag=).
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        # Некорректный порт или IPv6-адрес - оставляем URL как есть
+        return url
+
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f"{host}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        host = f"{userinfo}@{host}"
+
+    path = parts.path or "/"
+
+    query = parts.query
+    if query:
+        params = []
+        for param in query.split("&"):
+            name = unquote_plus(param.partition("=")[0])
+            if param and not is_tracking_param(name):
+                params.append((name, param))
+        query = "&".join(param for name, param in sorted(params))
+
+    return urlunsplit((scheme, host, path, query, ""))
+
+class Frontier:
+    """
+    Очередь URL для обхода сайта (FIFO) с множеством уже встреченных адресов.
+
+    Все URL хранятся в каноническом виде, поэтому проверка "уже в очереди
+    или уже обработан" выполняется за O(1) и не зависит от записи ссылки.
+    """
+    def __init__(self, urls=()):
+        self._queue = deque()
+        self._seen = set()
+        for url in urls:
+            self.add(url)
+
+    def add(self, url):
+        """
+        Добавляет URL в очередь, если он еще не встречался.
+
+        Returns:
+            bool: True, если URL новый и добавлен в очередь
+        """
+        url = canonicalize_url(url)
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self._queue.append(url)
+        return True
+
+    @classmethod
+    def restore(cls, pending, seen):
+        """Восстанавливает очередь из контрольной точки (URL уже канонические)."""
+        frontier = cls()
+        frontier._queue.extend(pending)
+        frontier._seen.update(seen)
+        frontier._seen.update(pending)
+        return frontier
+
+    def snapshot(self):
+        """
+        Возвращает состояние очереди для контрольной точки.
+
+        Returns:
+            tuple: (pending, seen) - URL в очереди по порядку и все встреченные URL
+        """
+        return list(self._queue), list(self._seen)
+
+    def pop(self):
+        """Возвращает следующий URL из очереди или None, если очередь пуста."""
+        return self._queue.popleft() if self._queue else None
+
+    def __contains__(self, url):
+        return canonicalize_url(url) in self._seen
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __bool__(self):
+        return bool(self._queue)
+
+    @property
+    def seen_count(self):
+        """Количество всех встреченных URL (в очереди и уже выданных)."""
+        return len(self._seen)
+
+
+def get_path_template(path):
+    """Заменяет в пути числа на {n}, а идентификаторы (хеши, UUID) на {id}."""
+    segments = []
+    for segment in path.split("/"):
+        if ID_SEGMENT_REGEX.match(segment):
+            segments.append("{id}")
+        else:
+            segments.append(NUMBER_REGEX.sub("{n}", segment))
+    return "/".join(segments)
+
+def get_url_template(url):
+    """
+    Возвращает шаблон адреса: шаблон пути и имена параметров запроса.
+
+    Например, /calendar/2024/05/12?view=day и /calendar/2031/01/01?view=week
+    дают один шаблон /calendar/{n}/{n}/{n}?view.
+    """
+    parts = urlsplit(url)
+    template = get_path_template(parts.path)
+
+    param_names = sorted({name for name, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    if param_names:
+        template += "?" + "&".join(param_names)
+    return template
+
+class PriorityFrontier(Frontier):
+    """
+    Очередь URL с приоритетами и защитой от ловушек для обхода.
+
+    Первыми выдаются самые ценные адреса: ближе к стартовой странице,
+    с коротким путем, без параметров постраничного вывода и фильтров,
+    на которые ссылается больше страниц. При равной оценке порядок FIFO.
+
+    Адреса-ловушки (календари, фасетный поиск, бесконечная вложенность)
+    отбрасываются: слишком глубокий путь, повторяющиеся сегменты пути,
+    слишком много параметров, а также адреса сверх лимита на один шаблон
+    (см. get_url_template).
+    """
+    def __init__(self, urls=(), settings=None):
+        settings = settings or {}
+        self.max_path_depth = settings.get("max_path_depth")
+        self.max_segment_repeats = settings.get("max_segment_repeats")
+        self.max_query_params = settings.get("max_query_params")
+        self.max_urls_per_template = settings.get("max_urls_per_template")
+
+        # Куча (оценка, порядковый номер, url); устаревшие записи пропускаются при выдаче
+        self._heap = []
+        self._counter = 0
+        self._entries = {}  # URL в очереди {url: (оценка, порядковый номер)}
+        self._inlinks = Counter()  # Число ссылок на URL в очереди
+        self._depths = {}  # Глубина (в переходах от начала обхода) всех принятых URL
+        self._templates = Counter()  # Число принятых URL для каждого шаблона
+
+        # Отброшенные адреса
+        self.trapped = 0
+        self.capped = 0
+
+        super().__init__()
+        for url in urls:
+            self.add(url, seed=True)
+
+    def _is_trap(self, url):
+        """Проверяет признаки бесконечного пространства адресов."""
+        parts = urlsplit(url)
+        segments = [segment for segment in parts.path.split("/") if segment]
+
+        if self.max_path_depth is not None and len(segments) > self.max_path_depth:
+            return True
+        if self.max_segment_repeats is not None and segments and \
+                max(Counter(segments).values()) > self.max_segment_repeats:
+            return True
+        if self.max_query_params is not None and parts.query and \
+                len(parse_qsl(parts.query, keep_blank_values=True)) > self.max_query_params:
+            return True
+        return False
+
+    def _score(self, url, depth, inlinks):
+        """Оценка адреса: чем меньше, тем раньше он будет обойден."""
+        parts = urlsplit(url)
+        score = depth + 0.5 * max(0, parts.path.count("/") - 2)
+
+        if parts.query:
+            for name, _ in parse_qsl(parts.query, keep_blank_values=True):
+                score += 2 if name.lower() in LOW_VALUE_PARAMS else 1
+        if LOW_VALUE_PATH_REGEX.search(parts.path):
+            score += 3
+
+        # Страницы, на которые ссылаются многие страницы, обычно важнее
+        return score - math.log2(1 + inlinks)
+
+    def _push(self, url, order=None):
+        if order is None:
+            order = self._counter
+            self._counter += 1
+        entry = (self._score(url, self._depths[url], self._inlinks[url]), order)
+        self._entries[url] = entry
+        heapq.heappush(self._heap, (entry[0], entry[1], url))
+
+    def add(self, url, depth=0, referrer=None, seed=False):
+        """
+        Добавляет URL в очередь, если он еще не встречался и не похож на ловушку.
+        Повторная ссылка на URL в очереди повышает его приоритет, если она
+        ведет из другого раздела (ссылки страниц одного шаблона друг на друга,
+        как в календаре или фильтрах, приоритет не повышают).
+
+        Начальные адреса (seed=True: стартовый URL и адреса из sitemap) задал
+        пользователь или сам сайт, поэтому они принимаются без проверок на
+        ловушки и лимита на шаблон.
+
+        Returns:
+            bool: True, если URL новый и добавлен в очередь
+        """
+        url = canonicalize_url(url)
+        if url in self._seen:
+            if url in self._entries and (referrer is None or
+                                         get_path_template(urlsplit(referrer).path) != get_path_template(urlsplit(url).path)):
+                self._inlinks[url] += 1
+                self._push(url, self._entries[url][1])
+            return False
+        self._seen.add(url)
+
+        if not seed and self._is_trap(url):
+            self.trapped += 1
+            return False
+
+        template = get_url_template(url)
+        if not seed and self.max_urls_per_template is not None and self._templates[template] >= self.max_urls_per_template:
+            self.capped += 1
+            return False
+        self._templates[template] += 1
+
+        self._depths[url] = depth
+        self._push(url)
+        return True
+
+    @classmethod
+    def restore(cls, pending, seen, depths=None, inlinks=None, settings=None):
+        """
+        Восстанавливает очередь из контрольной точки (URL уже канонические).
+
+        С числом ссылок на URL в очереди (inlinks) оценки и порядок выдачи
+        совпадают с сохраненной очередью.
+        """
+        frontier = cls(settings=settings)
+        frontier._seen.update(seen)
+        frontier._depths.update(depths or {})
+        frontier._inlinks.update(inlinks or {})
+        for url in frontier._depths:
+            frontier._templates[get_url_template(url)] += 1
+        for url in pending:
+            frontier._seen.add(url)
+            frontier._depths.setdefault(url, 0)
+            if url not in frontier._entries:
+                frontier._push(url)
+        return frontier
+
+    def snapshot(self):
+        """
+        Возвращает состояние очереди для контрольной точки.
+
+        Returns:
+            tuple: (pending, seen, depths, inlinks) - URL в очереди в порядке выдачи,
+                   все встреченные URL, глубина принятых URL и число ссылок на URL в очереди
+        """
+        pending = [url for score, order, url in sorted(self._heap) if self._entries.get(url) == (score, order)]
+        return pending, list(self._seen), self._depths, dict(self._inlinks)
+
+    def pop(self):
+        """Возвращает URL с наилучшей оценкой или None, если очередь пуста."""
+        while self._heap:
+            score, order, url = heapq.heappop(self._heap)
+            if self._entries.get(url) == (score, order):
+                del self._entries[url]
+                self._inlinks.pop(url, None)
+                return url
+        return None
+
+    def depth(self, url):
+        """Глубина URL в переходах от начала обхода."""
+        return self._depths.get(url, 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
@@ -0,0 +1,82 @@
+import logging
+import aiohttp
+from config import HTTP_CLIENT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class HttpClientManager:
+    """
+    Класс для общего долгоживущего HTTP-клиента всех обходов.
+
+    Одна aiohttp.ClientSession с настроенным TCPConnector позволяет
+    переиспользовать DNS-кэш и keep-alive соединения между обходами
+    и пользователями, которые обращаются к одному и тому же сайту.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self._session = None
+
+        # Статистика работы пула соединений
+        self.stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0
+        }
+
+    def _create_trace_config(self):
+        """Создает трассировку aiohttp для подсчета новых и переиспользованных соединений."""
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(key):
+            async def handler(session, context, params):
+                self.stats[key] += 1
+            return handler
+
+        trace_config.on_request_start.append(counter("requests"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(counter("dns_cache_misses"))
+        return trace_config
+
+    async def start(self):
+        """Создает сессию с пулом соединений (вызывается в main())."""
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.settings["limit"],
+            limit_per_host=self.settings["limit_per_host"],
+            ttl_dns_cache=self.settings["dns_cache_ttl"],
+            keepalive_timeout=self.settings["keepalive_timeout"]
+        )
+        self._session = aiohttp.ClientSession(connector=connector, trace_configs=[self._create_trace_config()])
+        logger.info(f"HTTP client started (limit={self.settings['limit']}, limit_per_host={self.settings['limit_per_host']})")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, при необходимости создавая ее."""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула (вызывается при остановке бота)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            stats = self.get_stats()
+            logger.info(f"HTTP client closed: {stats['requests']} requests, {stats['connections_created']} connections created, "
+                        f"{stats['connections_reused']} reused ({stats['reuse_ratio']:.0%})")
+        self._session = None
+
+    def get_stats(self):
+        """Возвращает статистику запросов и переиспользования соединений."""
+        connections = self.stats["connections_created"] + self.stats["connections_reused"]
+        return {
+            **self.stats,
+            "reuse_ratio": self.stats["connections_reused"] / connections if connections else 0
+        }
+
+# Глобальный HTTP-клиент
+http_client = HttpClientManager(HTTP_CLIENT_SETTINGS)
@@ -0,0 +1,94 @@
+import re
+import hashlib
+from collections import Counter
+
+# Размер отпечатка SimHash в битах
+FINGERPRINT_BITS = 64
+
+# Количество слов в шингле (фрагменте текста, из которых строится отпечаток)
+SHINGLE_SIZE = 3
+
+WORD_REGEX = re.compile(r'\w+')
+
+def shingles(text: str) -> set[str]:
+    """Шинглы текста: все последовательности из SHINGLE_SIZE слов подряд."""
+    words = WORD_REGEX.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def simhash(text: str) -> int:
+    """
+    Вычисляет 64-битный отпечаток SimHash текста по шинглам из SHINGLE_SIZE слов.
+
+    У почти одинаковых текстов отпечатки отличаются в нескольких битах,
+    поэтому близость страниц проверяется по расстоянию Хэмминга.
+    """
+    text_shingles = shingles(text)
+    digests = b"".join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in text_shingles)
+
+    # Бит отпечатка равен 1, если он установлен у большинства хешей шинглов.
+    # Считаем значения каждого байта хешей (Counter работает на C), а не перебираем биты в цикле
+    fingerprint = 0
+    for byte_index in range(FINGERPRINT_BITS // 8):
+        byte_counts = Counter(digests[byte_index::8]).items()
+        for bit in range(8):
+            ones = sum(count for value, count in byte_counts if value >> bit & 1)
+            if ones * 2 > len(text_shingles):
+                fingerprint |= 1 << (byte_index * 8 + bit)
+
+    return fingerprint
+
+class NearDuplicateIndex:
+    """
+    Индекс отпечатков SimHash страниц одного обхода.
+
+    Отпечаток делится на max_distance + 1 полос: если два отпечатка отличаются
+    не больше чем в max_distance битах, хотя бы одна полоса у них совпадает.
+    Поэтому сравниваются только отпечатки с общей полосой, а не все подряд.
+    """
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self._band_count = max_distance + 1
+        self._band_bits = FINGERPRINT_BITS // self._band_count
+
+        # Полосы {значение полосы: [(отпечаток, url), ...]} для каждой позиции
+        self._bands = [{} for _ in range(self._band_count)]
+        self._size = 0
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self._band_bits) - 1
+        for band in range(self._band_count):
+            # Последняя полоса забирает оставшиеся биты
+            if band == self._band_count - 1:
+                yield fingerprint >> (band * self._band_bits)
+            else:
+                yield (fingerprint >> (band * self._band_bits)) & mask
+
+    def find(self, fingerprint, confirm=None):
+        """
+        Ищет в индексе страницу, отпечаток которой отличается не больше чем в max_distance битах.
+
+        Args:
+            fingerprint (int): отпечаток SimHash страницы
+            confirm (callable | None): проверка найденной страницы по URL; страницы,
+                                       для которых она вернула False, пропускаются
+
+        Returns:
+            str | None: URL похожей страницы или None
+        """
+        for band, key in zip(self._bands, self._band_keys(fingerprint)):
+            for other_fingerprint, other_url in band.get(key, ()):
+                if (fingerprint ^ other_fingerprint).bit_count() <= self.max_distance:
+                    if confirm is None or confirm(other_url):
+                        return other_url
+        return None
+
+    def add(self, url, fingerprint):
+        """Добавляет страницу в индекс."""
+        for band, key in zip(self._bands, self._band_keys(fingerprint)):
+            band.setdefault(key, []).append((fingerprint, url))
+        self._size += 1
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+from config import PARSE_SETTINGS
+from near_duplicates import simhash
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+logger = logging.getLogger(__name__)
+
+# Парсеры HTML: "lxml" строит дерево на C и обходит его один раз, "html.parser" - BeautifulSoup
+# со встроенным в Python парсером. На корректном HTML текст получается одинаковым,
+# на битой разметке (незакрытые <p> и <li>) деревья парсеров могут различаться
+PARSER_BACKENDS = ("lxml", "html.parser")
+FALLBACK_PARSER = "html.parser"
+
+def _resolve_parser_backend(name: str) -> str:
+    """Проверяет выбранный парсер; если lxml не установлен, возвращает встроенный."""
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown HTML parser backend: {name}")
+    if name == "lxml" and lxml is None:
+        logger.warning("lxml is not installed, falling back to html.parser")
+        return FALLBACK_PARSER
+    return name
+
+PARSER_BACKEND = _resolve_parser_backend(PARSE_SETTINGS["parser"])
+
+# Версия извлечения текста: входит в хеш страницы в кэше, чтобы после изменения
+# извлечения (или смены парсера) сохраненные страницы были разобраны заново
+EXTRACTOR_VERSION = f"2/{PARSER_BACKEND}"
+
+# Элементы, удаляемые вместе с содержимым
+REMOVED_TAGS = ["script", "style", "nav", "footer", "aside"]
+
+# Блочные контейнеры, текст которых выводится с новой строки (меню и баннеры из div не склеиваются с текстом)
+BLOCK_TAGS = ['div', 'section', 'article', 'header', 'main', 'form', 'dl', 'dt', 'dd',
+              'figure', 'figcaption', 'address', 'details', 'summary']
+
+# Граница блока; несколько границ подряд (и пробелы между ними) дают один перенос строки
+BLOCK_BREAK = '\x00'
+BLOCK_BREAK_REGEX = re.compile(r'\x00(?:\s*\x00)*')
+
+# Разделители вокруг элементов (до, после)
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+HEADING_MARKS = {
+    1: ('\n\n★' + '═' * 48 + '★\n', '\n★' + '═' * 48 + '★\n'),
+    2: ('\n\n┌' + '─' * 38 + '┐\n', '\n└' + '─' * 38 + '┘\n')
+}
+SUBHEADING_MARKS = ('\n\n• • • • • •\n', '\n• • • • • •\n')
+LIST_MARKS = ('\n┌─────────────────────────────┐\n', '\n└─────────────────────────────┘\n')
+TABLE_MARKS = ('\n\n┏' + '━' * 30 + ' ТАБЛИЦА ' + '━' * 30 + '┓\n', '\n┗' + '━' * 70 + '┛\n\n')
+CODE_MARKS = ('\n```\n', '\n```\n')
+QUOTE_MARKS = ('\n\n▌ ', '\n\n')
+PARAGRAPH_END = '\n\n'
+ORDERED_ITEM = '\n  ➜ '
+UNORDERED_ITEM = '\n  ◆ '
+
+def _link_mark(href: str) -> str:
+    return f" 🔗 [{href}]"
+
+def _image_mark(alt_text: str) -> str:
+    return f'\n[🖼️ ИЗОБРАЖЕНИЕ: {alt_text}]\n'
+
+def _quote_lines(text: str) -> str:
+    """Оформляет текст цитаты: каждая строка с маркером ▌."""
+    return ''.join(f'\n▌ {line}' for line in text.split('\n'))
+
+def _render_text(soup: BeautifulSoup) -> str:
+    """Renders parsed HTML into text with preserved structure (modifies the soup)."""
+    # Remove script, style, and nav elements
+    for element in soup(REMOVED_TAGS):
+        element.decompose()
+    
+    # Добавим разделители для структурных элементов
+    for header in soup.find_all(HEADING_TAGS):
+        # Определяем уровень заголовка по тегу и добавляем разделители в зависимости от уровня
+        before, after = HEADING_MARKS.get(int(header.name[1]), SUBHEADING_MARKS)
+        header.insert_before(soup.new_string(before))
+        header.insert_after(soup.new_string(after))
+    
+    # Отделяем блочные контейнеры от соседнего текста
+    for block in soup.find_all(BLOCK_TAGS):
+        block.insert_before(soup.new_string(BLOCK_BREAK))
+        block.insert_after(soup.new_string(BLOCK_BREAK))
+    
+    # Добавляем разделители для параграфов
+    for paragraph in soup.find_all('p'):
+        paragraph.insert_after(soup.new_string(PARAGRAPH_END))
+    
+    # Добавляем разделители для списков
+    for list_tag in soup.find_all(['ul', 'ol']):
+        list_tag.insert_before(soup.new_string(LIST_MARKS[0]))
+        list_tag.insert_after(soup.new_string(LIST_MARKS[1]))
+    
+    for li in soup.find_all('li'):
+        # Для нумерованных списков используем стрелки, для ненумерованных - другой маркер
+        li.insert_before(soup.new_string(ORDERED_ITEM if li.parent.name == 'ol' else UNORDERED_ITEM))
+    
+    # Добавляем разделители для таблиц
+    for table in soup.find_all('table'):
+        table.insert_before(soup.new_string(TABLE_MARKS[0]))
+        table.insert_after(soup.new_string(TABLE_MARKS[1]))
+    
+    # Добавляем информацию о ссылках
+    for a in soup.find_all('a', href=True):
+        a.insert_after(soup.new_string(_link_mark(a['href'])))
+    
+    # Обрабатываем изображения
+    for img in soup.find_all('img'):
+        img.insert_before(soup.new_string(_image_mark(img.get('alt', 'Изображение'))))
+    
+    # Обрабатываем блоки кода
+    for code in soup.find_all(['code', 'pre']):
+        code.insert_before(soup.new_string(CODE_MARKS[0]))
+        code.insert_after(soup.new_string(CODE_MARKS[1]))
+    
+    # Обрабатываем цитаты: заменяем содержимое blockquote на форматированное
+    for blockquote in soup.find_all('blockquote'):
+        blockquote.insert_before(soup.new_string(QUOTE_MARKS[0]))
+        quoted = _quote_lines(blockquote.get_text())
+        blockquote.clear()
+        blockquote.append(quoted)
+        blockquote.insert_after(soup.new_string(QUOTE_MARKS[1]))
+    
+    # Get text with preserved structure
+    return _clean_lines(soup.get_text())
+
+# Разделители, которые сохраняются даже среди пустых строк
+SEPARATOR_CHARS = set('─═━•┌┐└┘┏┓┗┛★◆➜')
+
+def _clean_lines(text: str) -> str:
+    """Убирает границы блоков, пробелы по краям строк и повторяющиеся пустые строки."""
+    text = BLOCK_BREAK_REGEX.sub('\n', text)
+    
+    # Break into lines and remove leading/trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    
+    # Remove duplicated empty lines but keep meaningful structure
+    processed_lines = []
+    prev_line_empty = False
+    
+    for line in lines:
+        is_empty = len(line) == 0
+        is_separator = not SEPARATOR_CHARS.isdisjoint(line)
+        
+        # Всегда добавляем разделители
+        if is_separator:
+            processed_lines.append(line)
+            prev_line_empty = False
+        # Добавляем пустые строки только если предыдущая не была пустой
+        elif is_empty:
+            if not prev_line_empty:
+                processed_lines.append(line)
+                prev_line_empty = True
+        # Добавляем непустые строки
+        else:
+            processed_lines.append(line)
+            prev_line_empty = False
+    
+    # Объединяем с одинарными переносами строк
+    return '\n'.join(processed_lines)
+
+def _parse_html_parser(html_content: str) -> tuple[str | None, list[str], str]:
+    """Разбирает страницу BeautifulSoup со встроенным html.parser: (заголовок, ссылки, текст)."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Заголовок и ссылки берем до рендеринга текста: он удаляет nav/footer/aside
+    title = soup.title.string if soup.title and soup.title.string else None
+    hrefs = [a['href'] for a in soup.find_all('a', href=True)]
+    return title, hrefs, _render_text(soup)
+
+_BLOCK_TAG_SET = frozenset(BLOCK_TAGS)
+
+# Текст этих элементов не выводится (BeautifulSoup не включает содержимое <template> в get_text)
+_SKIPPED_TAG_SET = frozenset(REMOVED_TAGS + ['template'])
+
+def _render_lxml(element, parts: list[str]):
+    """
+    Добавляет в parts текст элемента lxml с теми же разделителями, что и _render_text.
+
+    Один проход по дереву вместо отдельного find_all для каждого вида
+    элементов; хвостовой текст элемента (tail) добавляет вызывающий.
+    """
+    tag = element.tag
+    if tag in _SKIPPED_TAG_SET:
+        return
+
+    before = after = None
+    if tag in _BLOCK_TAG_SET:
+        before = after = BLOCK_BREAK
+    elif tag == 'p':
+        after = PARAGRAPH_END
+    elif tag == 'a':
+        href = element.get('href')
+        if href is not None:
+            after = _link_mark(href)
+    elif tag == 'li':
+        parent = element.getparent()
+        before = ORDERED_ITEM if parent is not None and parent.tag == 'ol' else UNORDERED_ITEM
+    elif tag in ('ul', 'ol'):
+        before, after = LIST_MARKS
+    elif tag in ('code', 'pre'):
+        before, after = CODE_MARKS
+    elif tag in HEADING_TAGS:
+        before, after = HEADING_MARKS.get(int(tag[1]), SUBHEADING_MARKS)
+    elif tag == 'table':
+        before, after = TABLE_MARKS
+    elif tag == 'img':
+        before = _image_mark(element.get('alt', 'Изображение'))
+    elif tag == 'blockquote':
+        quoted = []
+        _render_lxml_children(element, quoted)
+        parts.append(QUOTE_MARKS[0])
+        parts.append(_quote_lines(''.join(quoted)))
+        parts.append(QUOTE_MARKS[1])
+        return
+
+    if before:
+        parts.append(before)
+    _render_lxml_children(element, parts)
+    if after:
+        parts.append(after)
+
+def _render_lxml_children(element, parts: list[str]):
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        # Комментарии и инструкции обработки пропускаем, но текст после них сохраняем
+        if isinstance(child.tag, str):
+            _render_lxml(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+def _lxml_string(element) -> str | None:
+    """Единственная строка внутри элемента (как Tag.string в BeautifulSoup) или None."""
+    if len(element) == 0:
+        return element.text
+    if not element.text and len(element) == 1 and not element[0].tail and isinstance(element[0].tag, str):
+        return _lxml_string(element[0])
+    return None
+
+def _parse_lxml(html_content: str) -> tuple[str | None, list[str], str]:
+    """Разбирает страницу lxml: (заголовок, ссылки, текст)."""
+    # Строка передается в байтах: lxml не принимает str с объявлением кодировки внутри.
+    # huge_tree снимает ограничение libxml2 на глубину вложенности (иначе глубокие страницы обрезаются)
+    parser = lxml.html.HTMLParser(encoding='utf-8', huge_tree=True)
+    root = lxml.html.document_fromstring(html_content.encode('utf-8'), parser=parser)
+
+    title_element = next(root.iter('title'), None)
+    title = _lxml_string(title_element) if title_element is not None else None
+    hrefs = [a.get('href') for a in root.iter('a') if a.get('href') is not None]
+
+    parts = []
+    _render_lxml(root, parts)
+    return title or None, hrefs, _clean_lines(''.join(parts))
+
+# Функции разбора для каждого парсера
+PARSERS = {
+    "lxml": _parse_lxml,
+    "html.parser": _parse_html_parser
+}
+
+def _parse(html_content: str) -> tuple[str | None, list[str], str]:
+    """Разбирает HTML выбранным парсером, при его ошибке - встроенным."""
+    if PARSER_BACKEND != FALLBACK_PARSER:
+        try:
+            return PARSERS[PARSER_BACKEND](html_content)
+        except Exception as e:
+            logger.warning(f"{PARSER_BACKEND} failed to parse the page ({e}), falling back to {FALLBACK_PARSER}")
+    return PARSERS[FALLBACK_PARSER](html_content)
+
+def get_text_from_html(html_content: str) -> str:
+    """Extracts text content from HTML string with preserved structure."""
+    return _parse(html_content)[2]
+
+def extract_page(html_content: str, page_url: str) -> dict:
+    """
+    Разбирает HTML страницы один раз и возвращает все, что нужно обходу.
+
+    Args:
+        html_content (str): HTML страницы
+        page_url (str): URL страницы для преобразования относительных ссылок
+
+    Returns:
+        dict: title - заголовок страницы, text - структурированный текст,
+              links - абсолютные URL всех ссылок в порядке появления,
+              fingerprint - отпечаток SimHash текста для поиска дубликатов
+    """
+    title, hrefs, text = _parse(html_content)
+    return {
+        "title": str(title) if title else "Без заголовка",
+        "text": text,
+        "links": [urljoin(page_url, href) for href in hrefs],
+        "fingerprint": simhash(text)
+    }
+
+class ParseExecutor:
+    """
+    Класс для выполнения разбора HTML вне цикла событий asyncio.
+
+    Режимы: "inline" - прямо в цикле событий, "thread" - в пуле потоков,
+    "process" - в пуле процессов (разбор масштабируется по ядрам).
+    """
+    MODES = ("inline", "thread", "process")
+
+    def __init__(self, mode="process", workers=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown parse executor mode: {mode}")
+
+        self.mode = mode
+        self.workers = workers
+        self._pool = None
+
+    def _get_pool(self):
+        """Лениво создает пул при первом обращении."""
+        if self._pool is None:
+            if self.mode == "thread":
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse")
+            else:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            logger.info(f"Parse executor started: mode={self.mode}, workers={self.workers or 'auto'}, parser={PARSER_BACKEND}")
+        return self._pool
+
+    async def extract_page(self, html_content: str, page_url: str) -> dict:
+        """Асинхронная версия extract_page, выполняемая в выбранном исполнителе."""
+        return await self.run(extract_page, html_content, page_url)
+
+    async def run(self, func, *args):
+        """Выполняет функцию разбора (модульного уровня, чтобы ее можно было передать в процесс)."""
+        if self.mode == "inline":
+            return func(*args)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), func, *args)
+        except BrokenProcessPool:
+            # Процесс-воркер упал (например, из-за нехватки памяти) - пересоздадим пул при следующем вызове
+            logger.error("Parse process pool is broken, it will be recreated")
+            self._pool = None
+            raise
+
+    def shutdown(self):
+        """Останавливает пул исполнителя."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            logger.info("Parse executor stopped")
+
+# Глобальный исполнитель разбора страниц
+parse_executor = ParseExecutor(
+    mode=PARSE_SETTINGS["executor"],
+    workers=PARSE_SETTINGS["workers"]
+)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Максимальная пауза между попытками обновления после ошибок Telegram (в секундах)
+MAX_BACKOFF = 60
+
+class ProgressReporter:
+    """
+    Класс для показа прогресса обхода в статусном сообщении.
+
+    Работает отдельной задачей: раз в interval секунд строит текст статуса
+    функцией render (она читает текущие показатели обхода) и редактирует
+    сообщение, только если текст изменился. Промежуточные состояния между
+    обновлениями просто не показываются. При flood control Telegram задача
+    ждет указанное время, при других ошибках увеличивает паузу. Обход
+    никогда не ждет Telegram.
+    """
+    def __init__(self, message, render, interval=2.0):
+        self.message = message
+        self.render = render
+        self.interval = interval
+        self._delay = interval
+        self._last_text = None
+        self._paused_until = 0
+        self._task = None
+
+    def start(self):
+        """Запускает фоновую задачу обновления статуса."""
+        if self.message is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._update(self.render())
+            await asyncio.sleep(self._delay)
+
+    async def _update(self, text):
+        """Редактирует сообщение, если текст изменился."""
+        if text is None or text == self._last_text:
+            return
+
+        try:
+            await self.message.edit_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            self._last_text = text
+            self._delay = self.interval
+        except TelegramRetryAfter as e:
+            # Flood control: ждем столько, сколько попросил Telegram
+            logger.warning(f"Flood control on status message, pausing updates for {e.retry_after}s")
+            self._paused_until = asyncio.get_running_loop().time() + e.retry_after
+            self._delay = max(self.interval, e.retry_after)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                self._last_text = text
+            else:
+                logger.warning(f"Couldn't update status message: {e}")
+                self._delay = min(self._delay * 2, MAX_BACKOFF)
+        except Exception as e:
+            logger.warning(f"Couldn't update status message: {e}")
+            self._delay = min(self._delay * 2, MAX_BACKOFF)
+
+    async def stop(self, final_text=None):
+        """
+        Останавливает обновления и, если Telegram не ограничил нас, показывает итоговый текст.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if final_text and self.message is not None and asyncio.get_running_loop().time() >= self._paused_until:
+            await self._update(final_text)
@@ -0,0 +1,192 @@
+import asyncio
+import gzip
+import io
+import logging
+import zlib
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse, urljoin
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+
+from frontier import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на разбор sitemap (по протоколу sitemaps.org файл не больше 50 Мб)
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+MAX_SITEMAP_FILES = 50
+
+async def load_robots(session: aiohttp.ClientSession, start_url: str, headers: dict) -> RobotFileParser:
+    """
+    Загружает и разбирает robots.txt сайта.
+
+    Если robots.txt недоступен, разрешено все; при ответе 401/403 запрещено все
+    (так же, как в urllib.robotparser).
+    """
+    parsed = urlparse(start_url)
+    robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+
+    robots = RobotFileParser(robots_url)
+    try:
+        async with session.get(robots_url, headers=headers, timeout=10, ssl=False) as response:
+            if response.status in (401, 403):
+                robots.disallow_all = True
+            elif response.status >= 400:
+                robots.allow_all = True
+            else:
+                text = await response.text(errors='ignore')
+                robots.parse(text.splitlines())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.info(f"Couldn't load {robots_url}: {e}")
+        robots.allow_all = True
+
+    return robots
+
+def _decompress_gzip(data: bytes) -> bytes:
+    """Распаковывает gzip, не позволяя результату превысить MAX_SITEMAP_BYTES."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    result = decompressor.decompress(data, MAX_SITEMAP_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed sitemap is too large")
+    return result
+
+def _local_name(tag: str) -> str:
+    # Пространства имен у разных генераторов отличаются, поэтому сравниваем локальные имена тегов
+    return tag.rsplit('}', 1)[-1]
+
+def parse_sitemap(data: bytes, max_urls: int, accept=None) -> tuple[list[str], list[str]]:
+    """
+    Разбирает sitemap или индекс sitemap (в том числе сжатые gzip).
+
+    Файл разбирается потоково: разобранные элементы сразу удаляются, и разбор
+    прекращается, как только собрано max_urls адресов страниц. Функция
+    синхронная и долгая, ее нужно вызывать вне цикла событий.
+
+    Args:
+        data: Содержимое файла sitemap
+        max_urls: Сколько адресов страниц собрать
+        accept: Функция (loc) -> URL или None; отбирает и нормализует адреса страниц
+
+    Returns:
+        tuple: (page_urls, sitemap_urls) - адреса страниц и вложенных sitemap
+    """
+    if data[:2] == b'\x1f\x8b':
+        data = _decompress_gzip(data)
+
+    page_urls = []
+    sitemap_urls = []
+    seen = set()
+    if max_urls <= 0:
+        return page_urls, sitemap_urls
+
+    root = None
+    entry = None  # 'url' или 'sitemap', внутри которого находится разбор
+    for event, element in ET.iterparse(io.BytesIO(data), events=('start', 'end')):
+        tag = _local_name(element.tag)
+        if event == 'start':
+            if root is None:
+                root = element
+            if tag in ('url', 'sitemap'):
+                entry = tag
+            continue
+
+        if tag == 'loc' and entry and element.text:
+            loc = element.text.strip()
+            if entry == 'sitemap':
+                sitemap_urls.append(loc)
+            else:
+                page_url = accept(loc) if accept else loc
+                if page_url and page_url not in seen:
+                    seen.add(page_url)
+                    page_urls.append(page_url)
+                    if len(page_urls) >= max_urls:
+                        break
+        elif tag in ('url', 'sitemap'):
+            entry = None
+            # Разобранные записи не накапливаются в памяти
+            element.clear()
+            root.clear()
+
+    return page_urls, sitemap_urls
+
+async def fetch_sitemap(session: aiohttp.ClientSession, sitemap_url: str, headers: dict) -> bytes | None:
+    """Загружает файл sitemap, возвращает None при ошибке или превышении размера."""
+    try:
+        async with session.get(sitemap_url, headers=headers, timeout=30, ssl=False) as response:
+            if response.status >= 400:
+                return None
+            if response.content_length and response.content_length > MAX_SITEMAP_BYTES:
+                logger.warning(f"Sitemap {sitemap_url} is too large ({response.content_length} bytes)")
+                return None
+            # read(n) возвращает только уже полученную часть, поэтому читаем блоками до конца
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > MAX_SITEMAP_BYTES:
+                    logger.warning(f"Sitemap {sitemap_url} is too large")
+                    return None
+            return bytes(data)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.info(f"Couldn't load sitemap {sitemap_url}: {e}")
+        return None
+
+async def discover_sitemap_urls(session: aiohttp.ClientSession, start_url: str, robots: RobotFileParser,
+                                headers: dict, max_urls: int) -> list[str]:
+    """
+    Собирает адреса страниц сайта из sitemap, указанных в robots.txt
+    (или из /sitemap.xml, если в robots.txt их нет).
+
+    Возвращает не более max_urls канонических URL того же хоста,
+    разрешенных robots.txt, в порядке их появления в sitemap. Вложенные
+    sitemap из индекса загружаются только с того же хоста.
+    """
+    parsed = urlparse(start_url)
+    base_domain = parsed.netloc
+
+    sitemap_queue = list(robots.site_maps() or [urljoin(start_url, '/sitemap.xml')])
+    seen_sitemaps = set()
+    seen_urls = set()
+    urls = []
+
+    def is_site_url(url):
+        parsed_url = urlparse(url)
+        return parsed_url.netloc == base_domain and parsed_url.scheme in ('http', 'https')
+
+    while sitemap_queue and len(seen_sitemaps) < MAX_SITEMAP_FILES and len(urls) < max_urls:
+        sitemap_url = sitemap_queue.pop(0)
+        if sitemap_url in seen_sitemaps:
+            continue
+        seen_sitemaps.add(sitemap_url)
+
+        data = await fetch_sitemap(session, sitemap_url, headers)
+        if not data:
+            continue
+
+        def accept(loc, sitemap_url=sitemap_url):
+            page_url = canonicalize_url(urljoin(sitemap_url, loc))
+            if (not is_site_url(page_url) or
+                page_url in seen_urls or
+                not robots.can_fetch(headers.get('User-Agent', '*'), page_url)):
+                return None
+            return page_url
+
+        # Большой sitemap разбирается в отдельном потоке, чтобы не останавливать цикл событий
+        try:
+            page_urls, nested_sitemaps = await asyncio.to_thread(parse_sitemap, data, max_urls - len(urls), accept)
+        except (ET.ParseError, ValueError, zlib.error, gzip.BadGzipFile) as e:
+            logger.warning(f"Couldn't parse sitemap {sitemap_url}: {e}")
+            continue
+
+        # Вложенные sitemap из индекса загружаем только с того же сайта, что и страницы
+        for nested_url in nested_sitemaps:
+            nested_url = urljoin(sitemap_url, nested_url)
+            if is_site_url(nested_url):
+                sitemap_queue.append(nested_url)
+            else:
+                logger.info(f"Skipping sitemap {nested_url} listed in {sitemap_url}: not on {base_domain}")
+        seen_urls.update(page_urls)
+        urls.extend(page_urls)
+
+    logger.info(f"Discovered {len(urls)} URLs from {len(seen_sitemaps)} sitemap(s) for {base_domain}")
+    return urls
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from aiohttp.test_utils import TestServer
+
+# Модули бота лежат в корне репозитория; config.py должен быть доступен для импорта
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _run_with_db(coro_function):
+    import database
+    from http_client import http_client
+
+    await database.init_db()
+    try:
+        return await coro_function()
+    finally:
+        await http_client.close()
+        await database.close_db()
+
+
+async def _crawl_server(server, path="/", **kwargs):
+    import bot
+
+    kwargs.setdefault("use_sitemaps", False)
+    document, pages_count = await bot.crawl_website(str(server.make_url(path)), **kwargs)
+    try:
+        return document.read_text(), pages_count
+    finally:
+        document.close()
+
+
+@pytest.fixture
+def run_with_db(tmp_path, monkeypatch):
+    """
+    Выполняет корутину в новом цикле событий с БД во временном каталоге теста.
+
+    Общая HTTP-сессия и соединения с БД закрываются после выполнения,
+    поэтому каждый вызов не зависит от предыдущих циклов событий.
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def run(coro_function):
+        return asyncio.run(_run_with_db(coro_function))
+
+    return run
+
+
+@pytest.fixture
+def crawl_server():
+    """Корутина, которая обходит сайт запущенного TestServer и возвращает (текст документа, число страниц)."""
+    return _crawl_server
+
+
+@pytest.fixture
+def crawl_site(run_with_db):
+    """Обходит сайт из aiohttp-приложения и возвращает (текст документа, число страниц)."""
+    def crawl(app, path="/", **kwargs):
+        async def run():
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                return await _crawl_server(server, path, **kwargs)
+            finally:
+                await server.close()
+
+        return run_with_db(run)
+
+    return crawl
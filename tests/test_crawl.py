@@ -0,0 +1,242 @@
+import asyncio
+import random
+import re
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+def html_page(title, body):
+    return web.Response(text=f"<html><head><title>{title}</title></head><body>{body}</body></html>",
+                        content_type="text/html")
+
+
+def test_relative_links_resolve_against_directory_url(crawl_site):
+    async def index(request):
+        return html_page("Home", '<p>Home page</p><a href="docs/">Docs</a> <a href="/guide">Guide</a>')
+
+    async def docs(request):
+        return html_page("Docs", '<p>Docs index</p><a href="intro.html">Intro</a> <a href="api.html">API</a>')
+
+    async def guide(request):
+        raise web.HTTPMovedPermanently("/guide/")
+
+    async def guide_index(request):
+        return html_page("Guide", '<p>Guide index</p><a href="start.html">Start</a>')
+
+    async def leaf(request):
+        name = request.match_info["name"]
+        return html_page(name, f"<p>Text of {request.path}</p>")
+
+    app = web.Application()
+    app.router.add_get("/", index)
+    app.router.add_get("/docs/", docs)
+    app.router.add_get("/guide", guide)
+    app.router.add_get("/guide/", guide_index)
+    app.router.add_get("/docs/{name}", leaf)
+    app.router.add_get("/guide/{name}", leaf)
+
+    text, pages_count = crawl_site(app, max_pages=20)
+
+    assert "Text of /docs/intro.html" in text
+    assert "Text of /docs/api.html" in text
+    assert "Text of /guide/start.html" in text
+    assert "404" not in text
+
+
+def test_start_url_that_looks_like_a_trap_is_crawled(crawl_site):
+    async def search(request):
+        return html_page("Search", f"<p>Results for {request.query_string}</p>")
+
+    start_path = "/search?" + "&".join(f"f{i}={i}" for i in range(8))
+
+    for max_pages in (1, 10):
+        app = web.Application()
+        app.router.add_get("/search", search)
+        text, pages_count = crawl_site(app, start_path, max_pages=max_pages)
+
+        assert pages_count == 1
+        assert "Results for f0=0" in text
+
+
+def make_low_discovery_site(seed):
+    """Дерево из 40 разделов по 3 ссылки; остальные страницы ссылаются только на уже известные."""
+    rnd = random.Random(seed)
+
+    async def page(request):
+        i = int(request.match_info.get("i", 0))
+        await asyncio.sleep(rnd.uniform(0.001, 0.05))
+        children = [i * 3 + k for k in (1, 2, 3)] if i < 40 else []
+        links = "".join(f'<a href="/p/{k}">P{k}</a> ' for k in children + [0, i // 2, max(i - 1, 0)])
+        return html_page(f"P{i}", f"<p>Page {i}: " + f"topic{i} " * 30 + f"</p>{links}")
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    app.router.add_get("/p/{i}", page)
+    return app
+
+
+def without_host(text):
+    return re.sub(r"127\.0\.0\.1:\d+", "HOST", text)
+
+
+def test_low_discovery_stop_gives_the_same_document_every_run(crawl_site):
+    documents = set()
+    for seed in range(3):
+        text, pages_count = crawl_site(make_low_discovery_site(seed), max_pages=1000, workers=8)
+        assert pages_count < 100
+        documents.add((without_host(text), pages_count))
+
+    assert len(documents) == 1
+
+
+# Прерывание до решения об остановке по низкому открытию ссылок и после него
+@pytest.mark.parametrize("interrupt_at", [53, 57])
+def test_resumed_crawl_gives_the_same_document(run_with_db, crawl_server, monkeypatch, interrupt_at):
+    import bot
+
+    # Каждый обход загружает страницы заново, а не берет их из кэша страниц
+    monkeypatch.setattr(bot, "PAGE_CACHE_TTL_MINUTES", 0)
+
+    async def run():
+        requests = {"count": 0, "interrupt_at": None}
+        interrupted = asyncio.Event()
+
+        @web.middleware
+        async def count_requests(request, handler):
+            requests["count"] += 1
+            if requests["count"] == requests["interrupt_at"]:
+                interrupted.set()
+            return await handler(request)
+
+        app = make_low_discovery_site(0)
+        app.middlewares.append(count_requests)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            full_text, full_count = await crawl_server(server, max_pages=1000, workers=8)
+
+            requests.update(count=0, interrupt_at=interrupt_at)
+            crawl = asyncio.create_task(crawl_server(server, max_pages=1000, workers=8))
+            await interrupted.wait()
+            crawl.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await crawl
+
+            resumed_text, resumed_count = await crawl_server(server, max_pages=1000, workers=8)
+        finally:
+            await server.close()
+
+        assert (resumed_text, resumed_count) == (full_text, full_count)
+
+    run_with_db(run)
+
+
+def test_short_pages_with_shared_template_are_not_duplicates(crawl_site):
+    rnd = random.Random(1)
+    vocabulary = [f"word{i}" for i in range(2000)]
+    header = " ".join(rnd.choice(vocabulary) for _ in range(60))
+    sidebar = " ".join(rnd.choice(vocabulary) for _ in range(60))
+    bodies = [" ".join(rnd.choice(vocabulary) for _ in range(10)) for _ in range(200)]
+
+    async def item(request):
+        number = int(request.match_info["number"])
+        return html_page(f"Item {number}", f"<header><div>{header}</div></header><main><h1>Item {number}</h1>"
+                                           f"<p>{bodies[number]}</p></main><div>{sidebar}</div>")
+
+    async def sitemap(request):
+        urls = [f"/item/{number}" for number in range(200)] + [f"/print/{number}" for number in range(20)]
+        locs = "".join(f"<url><loc>{request.url.origin()}{url}</loc></url>" for url in urls)
+        return web.Response(text=f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>',
+                            content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_get("/item/{number}", item)
+    # Версия для печати повторяет страницу и в документ не попадает
+    app.router.add_get("/print/{number}", item)
+    app.router.add_get("/sitemap.xml", sitemap)
+
+    text, pages_count = crawl_site(app, "/item/0", max_pages=1000, use_sitemaps=True)
+
+    assert pages_count == 220
+    assert text.count("║  СТРАНИЦА: Item") == 200
+    assert "Пропущено почти одинаковых страниц: 20" in text
+
+
+def test_time_budget_limits_in_flight_fetches(run_with_db, crawl_server, monkeypatch):
+    import bot
+
+    monkeypatch.setattr(bot, "PAGE_CACHE_TTL_MINUTES", 0)
+    monkeypatch.setitem(bot.CRAWL_BUDGET_SETTINGS, "max_seconds", 1)
+
+    async def index(request):
+        # Медленных страниц меньше, чем одновременных запросов к хосту: /busy не ждет своей очереди
+        links = "".join(f'<a href="/slow/{number}">Slow {number}</a> ' for number in range(3))
+        return html_page("Home", f'<p>Home page</p>{links}<a href="/busy">Busy</a>')
+
+    async def slow(request):
+        await asyncio.sleep(3)
+        return html_page("Slow", "<p>Slow page</p>")
+
+    async def busy(request):
+        # Повтор после такой паузы уже не уложится в лимит времени
+        return web.Response(status=503, headers={"Retry-After": "3"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", index)
+        app.router.add_get("/slow/{number}", slow)
+        app.router.add_get("/busy", busy)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            started = time.monotonic()
+            text, pages_count = await crawl_server(server, max_pages=20)
+            elapsed = time.monotonic() - started
+        finally:
+            await server.close()
+
+        assert elapsed < 2
+        assert pages_count == 5
+        assert "Slow page" not in text
+        assert text.count("Crawl time limit reached") == 3
+        assert "/busy: HTTP Error: 503" in text
+
+    run_with_db(run)
+
+
+def test_oversize_pages_are_skipped_with_or_without_content_length(crawl_site, monkeypatch):
+    import bot
+
+    monkeypatch.setattr(bot, "PAGE_CACHE_TTL_MINUTES", 0)
+    monkeypatch.setitem(bot.CRAWL_SETTINGS, "max_page_bytes", 64 * 1024)
+    large_body = "<p>Large page</p>" + "<p>" + "x" * 100 * 1024 + "</p>"
+
+    async def index(request):
+        return html_page("Home", '<p>Home page</p><a href="/declared">Declared</a> <a href="/streamed">Streamed</a>')
+
+    async def declared(request):
+        return html_page("Declared", large_body)
+
+    async def streamed(request):
+        # Без Content-Length: размер становится известен только при чтении тела
+        response = web.StreamResponse(headers={"Content-Type": "text/html"})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        await response.write(b"<html><head><title>Streamed</title></head><body>")
+        await response.write(large_body.encode())
+        await response.write(b"</body></html>")
+        return response
+
+    app = web.Application()
+    app.router.add_get("/", index)
+    app.router.add_get("/declared", declared)
+    app.router.add_get("/streamed", streamed)
+
+    text, pages_count = crawl_site(app, max_pages=20)
+
+    assert "Large page" not in text
+    assert re.search(r"/declared: Page is too large", text)
+    assert re.search(r"/streamed: Page is too large", text)
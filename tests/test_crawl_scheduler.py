@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from crawl_scheduler import CrawlScheduler
+
+
+def test_priority_slots_must_leave_room_for_full_crawls():
+    with pytest.raises(ValueError):
+        CrawlScheduler(max_jobs=2, priority_slots=2, max_jobs_per_user=1)
+
+
+def test_cancelled_waiter_is_not_counted_in_shared_result():
+    async def run():
+        scheduler = CrawlScheduler(max_jobs=2, priority_slots=1, max_jobs_per_user=1)
+        finish = asyncio.Event()
+        shared = []
+
+        async def crawl():
+            await finish.wait()
+            return "document"
+
+        def share_result(result, waiters):
+            shared.append(waiters)
+
+        first = asyncio.create_task(scheduler.run(1, "site", crawl, share_result=share_result))
+        second = asyncio.create_task(scheduler.run(2, "site", crawl, share_result=share_result))
+        third = asyncio.create_task(scheduler.run(3, "site", crawl, share_result=share_result))
+        await asyncio.sleep(0)
+
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+        finish.set()
+        assert await first == "document"
+        assert await third == "document"
+        assert shared == [2]
+
+    asyncio.run(run())
@@ -0,0 +1,22 @@
+def test_cached_document_is_streamed_from_the_blob(run_with_db):
+    from database import cache_document, get_cached_document, read_blob_into
+    from document_builder import CrawlDocument
+
+    text = "".join(f"Строка {number} документа\n" for number in range(100000))
+
+    async def run():
+        await cache_document("https://example.com/", text, 3, is_single_page=False)
+        cached_doc = await get_cached_document("https://example.com/", is_single_page=False)
+
+        document = await CrawlDocument.from_writer(lambda file: read_blob_into(cached_doc["content_hash"], file),
+                                                   cached_doc["pages_processed"])
+        try:
+            return document.size, document.pages_processed, b"".join(document.iter_chunks())
+        finally:
+            document.close()
+
+    size, pages_processed, data = run_with_db(run)
+
+    assert data == text.encode("utf-8")
+    assert size == len(data)
+    assert pages_processed == 3
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+def test_rate_backs_off_on_429_and_recovers():
+    import bot
+    from fetch_limiter import fetch_limiter
+
+    async def run():
+        requests = []
+
+        async def page(request):
+            requests.append(time.monotonic())
+            # Третий запрос сервер отклоняет и просит подождать секунду
+            if len(requests) == 3:
+                return web.Response(status=429, headers={"Retry-After": "1"})
+            return web.Response(text="<html><body><p>Page</p></body></html>", content_type="text/html")
+
+        app = web.Application()
+        app.router.add_get("/{number}", page)
+        server = TestServer(app)
+        await server.start_server()
+        host = server.make_url("/").raw_authority
+        rates = []
+        try:
+            async with aiohttp.ClientSession() as session:
+                for number in range(12):
+                    html_content, error, info = await bot.fetch_page_with_retries(session, str(server.make_url(f"/{number}")))
+                    assert error is None and html_content
+                    rates.append(fetch_limiter.get_host_rate(host))
+        finally:
+            await server.close()
+
+        # Повтор отклоненного запроса - не раньше Retry-After
+        assert requests[3] - requests[2] >= 1
+        # После 429 скорость снижена, затем восстанавливается выше прежней
+        rate_before, rate_after_429 = rates[1], rates[2]
+        assert rate_after_429 < rate_before
+        assert rates[-1] > rate_before
+        assert rates[2:] == sorted(rates[2:])
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+from frontier import PriorityFrontier, canonicalize_url
+
+SETTINGS = {"max_path_depth": 3, "max_segment_repeats": 1, "max_query_params": 2, "max_urls_per_template": 1}
+
+
+def test_seed_urls_skip_trap_checks():
+    seeds = ["https://example.com/a/b/c/d/e", "https://example.com/x/x/page", "https://example.com/s?a=1&b=2&c=3"]
+    frontier = PriorityFrontier(seeds, settings=SETTINGS)
+
+    assert sorted(frontier.pop() for _ in seeds) == sorted(canonicalize_url(url) for url in seeds)
+    assert frontier.trapped == 0
+
+
+def test_seed_urls_skip_template_cap():
+    frontier = PriorityFrontier(["https://example.com/item/1"], settings=SETTINGS)
+
+    assert frontier.add("https://example.com/item/2", seed=True)
+    assert not frontier.add("https://example.com/item/3")
+    assert frontier.capped == 1
+
+
+def test_discovered_trap_links_are_dropped():
+    frontier = PriorityFrontier(["https://example.com/"], settings=SETTINGS)
+
+    assert not frontier.add("https://example.com/s?a=1&b=2&c=3", depth=1)
+    assert frontier.trapped == 1
+
+
+def test_canonical_url_keeps_directory_slash():
+    assert canonicalize_url("HTTPS://Example.com:443/docs/#top") == "https://example.com/docs/"
+    assert canonicalize_url("https://example.com/docs") == "https://example.com/docs"
+    assert canonicalize_url("https://example.com") == "https://example.com/"
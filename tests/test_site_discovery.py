@@ -0,0 +1,51 @@
+import asyncio
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from site_discovery import discover_sitemap_urls
+
+
+def sitemap_app(sitemap):
+    async def handler(request):
+        return web.Response(text=sitemap(request), content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_get("/{name}.xml", handler)
+    return app
+
+
+def test_nested_sitemaps_from_other_hosts_are_skipped():
+    async def run():
+        # Чужой sitemap перечисляет страницы атакуемого сайта, чтобы они попали в обход
+        other = TestServer(sitemap_app(lambda request: (
+            f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f'<url><loc>{site.make_url("/injected")}</loc></url></urlset>')))
+
+        def site_sitemap(request):
+            if request.path == "/pages.xml":
+                return (f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                        f'<url><loc>{request.url.origin()}/about</loc></url></urlset>')
+            return (f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    f'<sitemap><loc>/pages.xml</loc></sitemap>'
+                    f'<sitemap><loc>{other.make_url("/evil.xml")}</loc></sitemap></sitemapindex>')
+
+        site = TestServer(sitemap_app(site_sitemap))
+        await other.start_server()
+        await site.start_server()
+
+        robots = RobotFileParser()
+        robots.parse([])
+        expected = [str(site.make_url("/about"))]
+        try:
+            async with aiohttp.ClientSession() as session:
+                urls = await discover_sitemap_urls(session, str(site.make_url("/")), robots, {}, max_urls=100)
+        finally:
+            await site.close()
+            await other.close()
+
+        assert urls == expected
+
+    asyncio.run(run())